@@ -1,23 +1,196 @@
+from collections import Counter
+
+from django.conf import settings
 from django.contrib import admin
-from .models import User, Book, Borrow
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Count, F, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from django.utils.functional import cached_property
+from .caching import bump_availability_version, bump_catalog_version
+from .events import record_book_event, record_borrow_events
+from .fines import settle_fines
+from .holds import release_copies
+from .models import User, Book, Borrow, Event, Hold
+from .routers import branch_atomic
+from .stream import announce_availability
+
+def estimated_row_count(model, using):
+    """
+    Cheap table size estimate from the database's own statistics.
+    """
+    connection = connections[using]
+    table = connection.ops.quote_name(model._meta.db_table)
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute("SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass", [model._meta.db_table])
+        elif connection.vendor == 'sqlite':
+            cursor.execute(f"SELECT MAX(rowid) FROM {table}")
+        else:
+            return None
+        row = cursor.fetchone()
+    return row[0] if row and row[0] else None
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Counts exactly up to ADMIN_EXACT_COUNT_LIMIT rows. Beyond that an
+    unfiltered changelist uses the table estimate and a filtered one stops
+    at the limit, so huge tables never pay for a full COUNT(*).
+    """
+
+    @cached_property
+    def count(self):
+        limit = getattr(settings, 'ADMIN_EXACT_COUNT_LIMIT', 10000)
+        queryset = self.object_list
+        bounded = queryset[:limit + 1].count()
+        if bounded <= limit:
+            return bounded
+        if not queryset.query.where:
+            estimate = estimated_row_count(queryset.model, queryset.db)
+            if estimate:
+                return max(estimate, bounded)
+        return bounded
+
+def prefix_lookup(field, term):
+    """
+    Prefix match written as a range, so it can use a plain b-tree index on
+    any backend. Also tries the term with its first letter capitalized.
+    """
+    condition = Q()
+    for variant in {term, term[:1].upper() + term[1:]}:
+        condition |= Q(**{f'{field}__gte': variant, f'{field}__lt': variant + '\uffff'})
+    return condition
+
+class IndexedSearchMixin:
+    """
+    Replaces the admin's icontains search (a full scan, plus joins for
+    related fields) with indexed lookups. ``indexed_search_fields`` holds
+    (path, 'exact' | 'prefix') pairs; a path into a related model becomes
+    an ``IN`` subquery on that model's indexed column.
+    """
+    indexed_search_fields = ()
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def get_search_results(self, request, queryset, search_term):
+        term = search_term.strip()
+        if not term:
+            return queryset, False
+
+        condition = Q()
+        for path, mode in self.indexed_search_fields:
+            relation, _, column = path.rpartition('__')
+            lookup = Q(**{column: term}) if mode == 'exact' else prefix_lookup(column, term)
+            if relation:
+                related_model = self.model._meta.get_field(relation).related_model
+                condition |= Q(**{f'{relation}__in': related_model.objects.filter(lookup).values('pk')})
+            else:
+                condition |= lookup
+        return queryset.filter(condition), False
 
 @admin.register(User)
-class UserAdmin(admin.ModelAdmin):
+class UserAdmin(IndexedSearchMixin, admin.ModelAdmin):
     list_display = ('id', 'username', 'email', 'role', 'is_staff')
     list_filter = ('role',)
     search_fields = ('username', 'email')
+    indexed_search_fields = (('username', 'prefix'), ('email', 'prefix'))
     ordering = ('id',)
 
+class AvailabilityFilter(admin.SimpleListFilter):
+    title = 'available'
+    parameter_name = 'available'
+
+    def lookups(self, request, model_admin):
+        return (('yes', 'Yes'), ('no', 'No'))
+
+    def queryset(self, request, queryset):
+        if self.value() == 'yes':
+            return queryset.filter(available_copies__gt=0)
+        if self.value() == 'no':
+            return queryset.filter(available_copies=0)
+        return queryset
+
 @admin.register(Book)
-class BookAdmin(admin.ModelAdmin):
-    list_display = ('id', 'title', 'author', 'genre', 'available')
-    list_filter = ('genre', 'available')
+class BookAdmin(IndexedSearchMixin, admin.ModelAdmin):
+    list_display = ('id', 'title', 'author', 'genre', 'available_copies', 'total_copies')
+    list_filter = ('genre', AvailabilityFilter)
     search_fields = ('title', 'author')
+    indexed_search_fields = (('title', 'prefix'), ('author', 'prefix'))
     ordering = ('id',)
+    actions = ['mark_available']
+
+    @admin.action(description='Mark available (recount copies on the shelf)')
+    def mark_available(self, request, queryset):
+        def outstanding(model, **filters):
+            return Coalesce(
+                Subquery(
+                    model.objects.filter(book=OuterRef('pk'), **filters)
+                    .order_by()
+                    .values('book')
+                    .annotate(total=Count('pk'))
+                    .values('total')
+                ),
+                Value(0),
+            )
+
+        now = timezone.now()
+        with branch_atomic():
+            books = list(queryset.select_for_update().annotate(
+                on_shelf=F('total_copies')
+                - outstanding(Borrow, returned=False)
+                - outstanding(Hold, status=Hold.READY)
+            ))
+            # Copies found on the shelf go through the hold queue like returns.
+            release_copies({
+                book.pk: book.on_shelf - book.available_copies
+                for book in books if book.on_shelf > book.available_copies
+            })
+            overcounted = [book for book in books if book.on_shelf < book.available_copies]
+            for book in overcounted:
+                Book.objects.filter(pk=book.pk).update(available_copies=max(book.on_shelf, 0), updated_at=now)
+            if overcounted:
+                announce_availability([book.pk for book in overcounted])
+                bump_availability_version()
+
+            changed = [book.pk for book in books if book.on_shelf != book.available_copies]
+            for book in Book.objects.filter(pk__in=changed):
+                record_book_event(Event.BOOK_UPDATED, book)
+        bump_catalog_version()
+        self.message_user(request, f'Recounted {len(books)} books.')
 
 @admin.register(Borrow)
-class BorrowAdmin(admin.ModelAdmin):
+class BorrowAdmin(IndexedSearchMixin, admin.ModelAdmin):
     list_display = ('id', 'user', 'book', 'borrowed_at', 'due_date', 'returned')
     list_filter = ('returned', 'due_date')
+    list_select_related = ('user', 'book')
     search_fields = ('user__username', 'book__title')
+    indexed_search_fields = (('user__username', 'exact'), ('book__title', 'prefix'))
+    raw_id_fields = ('user', 'book')
     ordering = ('-borrowed_at',)
+    actions = ['mark_returned']
+
+    @admin.action(description='Mark selected borrows as returned')
+    def mark_returned(self, request, queryset):
+        now = timezone.now()
+        with branch_atomic():
+            returned = [
+                pk for pk in queryset.filter(returned=False).values_list('pk', flat=True)
+                # Conditional, so a borrow returned meanwhile is not released twice.
+                if Borrow.objects.filter(pk=pk, returned=False).update(returned=True, returned_at=now)
+            ]
+            borrows = list(Borrow.objects.select_related('book').filter(pk__in=returned))
+            settle_fines(borrows)
+            release_copies(Counter(borrow.book_id for borrow in borrows))
+            record_borrow_events(Event.BORROW_RETURNED, borrows)
+        self.message_user(request, f'Marked {len(returned)} borrows as returned.')
+
+@admin.register(Hold)
+class HoldAdmin(IndexedSearchMixin, admin.ModelAdmin):
+    list_display = ('id', 'user', 'book', 'position', 'status', 'expires_at')
+    list_filter = ('status',)
+    list_select_related = ('user', 'book')
+    search_fields = ('user__username', 'book__title')
+    indexed_search_fields = (('user__username', 'exact'), ('book__title', 'prefix'))
+    raw_id_fields = ('user', 'book')
+    ordering = ('book', 'position')
@@ -0,0 +1,162 @@
+"""
+Borrow analytics rollups.
+
+DailyBookStats and DailyGenreStats hold per-day borrow, return and overdue
+counts per branch. run_rollups() catches the current branch's rollups up
+from Borrow using stored watermarks, so each run only reads rows that
+changed since the previous one. A loan
+counts as overdue on the first day after its due date on which it was
+still out.
+"""
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+
+from django.conf import settings
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import TruncDate, TruncMonth, TruncWeek
+from django.utils import timezone
+
+from .models import Book, Borrow, DailyBookStats, DailyGenreStats, RollupWatermark
+from .routers import branch_atomic, current_branch
+
+COUNTERS = ('borrows', 'returns', 'overdues')
+EPOCH = '1970-01-01T00:00:00+00:00'
+GRANULARITIES = {
+    'day': None,
+    'week': TruncWeek,
+    'month': TruncMonth,
+}
+
+
+def _get_watermark(kind, default):
+    name = f'{kind}:{current_branch()}'
+    watermark = RollupWatermark.objects.filter(name=name).values_list('value', flat=True).first()
+    return watermark if watermark is not None else default
+
+
+def _set_watermark(kind, value):
+    RollupWatermark.objects.update_or_create(name=f'{kind}:{current_branch()}', defaults={'value': value})
+
+
+def _merge(counter, per_book):
+    """
+    Add ``per_book`` ({(day, book_id): count}) to the ``counter`` column of
+    both rollup tables.
+    """
+    if not per_book:
+        return
+
+    genres = dict(Book.objects.filter(pk__in={book_id for _, book_id in per_book}).values_list('pk', 'genre'))
+    per_genre = defaultdict(int)
+    for (day, book_id), count in per_book.items():
+        per_genre[(day, genres.get(book_id, ''))] += count
+
+    days = {day for day, _ in per_book}
+    _merge_into(DailyBookStats, 'book_id', counter, per_book, days)
+    _merge_into(DailyGenreStats, 'genre', counter, per_genre, days)
+
+
+def _merge_into(model, key_field, counter, counts, days):
+    branch = current_branch()
+    existing = {
+        (row.date, getattr(row, key_field)): row
+        for row in model.objects.filter(
+            branch=branch, date__in=days, **{f'{key_field}__in': {key for _, key in counts}}
+        )
+    }
+    changed, created = [], []
+    for (day, key), count in counts.items():
+        row = existing.get((day, key))
+        if row is None:
+            created.append(model(date=day, branch=branch, **{key_field: key, counter: count}))
+        else:
+            setattr(row, counter, getattr(row, counter) + count)
+            changed.append(row)
+    model.objects.bulk_update(changed, [counter], batch_size=500)
+    model.objects.bulk_create(created, batch_size=500)
+
+
+def _count_by_day(queryset, timestamp_field):
+    rows = (
+        queryset.annotate(day=TruncDate(timestamp_field))
+        .values('day', 'book_id')
+        .annotate(total=Count('id'))
+    )
+    return {(row['day'], row['book_id']): row['total'] for row in rows}
+
+
+@branch_atomic()
+def run_rollups(now=None):
+    """
+    Fold borrows, returns and overdues that settled since the last run into
+    the daily rollups. Returns how many events of each kind were added.
+    """
+    now = now or timezone.now()
+    cutoff = now - timedelta(seconds=getattr(settings, 'ROLLUP_SETTLE_SECONDS', 60))
+    loans = Borrow.objects.filter(branch=current_branch())
+    added = {}
+
+    borrowed_since = datetime.fromisoformat(_get_watermark('borrows', EPOCH))
+    borrows = _count_by_day(
+        loans.filter(borrowed_at__gt=borrowed_since, borrowed_at__lte=cutoff), 'borrowed_at'
+    )
+    _merge('borrows', borrows)
+    _set_watermark('borrows', cutoff.isoformat())
+    added['borrows'] = sum(borrows.values())
+
+    returned_since = datetime.fromisoformat(_get_watermark('returns', EPOCH))
+    returns = _count_by_day(
+        loans.filter(returned_at__gt=returned_since, returned_at__lte=cutoff), 'returned_at'
+    )
+    _merge('returns', returns)
+    _set_watermark('returns', cutoff.isoformat())
+    added['returns'] = sum(returns.values())
+
+    # Days are only closed once they are over, so overdues stop at yesterday.
+    first_open_day = loans.order_by('due_date').values_list('due_date', flat=True).first()
+    last_day = timezone.localdate(now) - timedelta(days=1)
+    overdue_from = _get_watermark('overdues', None)
+    overdue_from = date.fromisoformat(overdue_from) + timedelta(days=1) if overdue_from else first_open_day
+    overdues = {}
+    if overdue_from is not None and overdue_from <= last_day:
+        rows = (
+            loans.filter(
+                due_date__gte=overdue_from - timedelta(days=1),
+                due_date__lte=last_day - timedelta(days=1),
+            )
+            .filter(Q(returned_at__isnull=True) | Q(returned_at__date__gt=F('due_date')))
+            .values('due_date', 'book_id')
+            .annotate(total=Count('id'))
+        )
+        overdues = {(row['due_date'] + timedelta(days=1), row['book_id']): row['total'] for row in rows}
+        _merge('overdues', overdues)
+        _set_watermark('overdues', last_day.isoformat())
+    added['overdues'] = sum(overdues.values())
+
+    return added
+
+
+def borrow_series(granularity='day', genre=None, book_id=None, start=None, end=None):
+    """
+    Return [{'period', 'borrows', 'returns', 'overdues'}, ...] summed over
+    the current branch's rollups for the requested period size.
+    """
+    if book_id is not None:
+        queryset = DailyBookStats.objects.filter(branch=current_branch(), book_id=book_id)
+    else:
+        queryset = DailyGenreStats.objects.filter(branch=current_branch())
+        if genre:
+            queryset = queryset.filter(genre=genre)
+    if start:
+        queryset = queryset.filter(date__gte=start)
+    if end:
+        queryset = queryset.filter(date__lte=end)
+
+    trunc = GRANULARITIES[granularity]
+    period = F('date') if trunc is None else trunc('date')
+    return list(
+        queryset.annotate(period=period)
+        .values('period')
+        .annotate(**{counter: Sum(counter) for counter in COUNTERS})
+        .order_by('period')
+    )
@@ -0,0 +1,124 @@
+"""
+Hot/cold split of borrow history.
+
+Borrow holds open loans and recently returned ones. archive_returned_borrows()
+moves returned borrows older than BORROW_ARCHIVE_AFTER_DAYS to ArchivedBorrow
+in batches, keeping their ids. BorrowHistory reads both tables as one
+sliceable sequence for listings that cover a patron's or branch's whole
+history.
+"""
+from datetime import timedelta
+from itertools import chain
+
+from django.conf import settings
+from django.utils import timezone
+
+from .models import ArchivedBorrow, Borrow
+from .routers import branch_atomic, current_branch
+
+ARCHIVED_FIELDS = [field.attname for field in ArchivedBorrow._meta.concrete_fields if field.name != 'archived_at']
+
+
+def archive_returned_borrows(older_than_days=None, batch_size=None, now=None):
+    """
+    Move the current branch's borrows returned more than ``older_than_days``
+    ago into the archive. Each batch is copied and deleted in one
+    transaction. Returns the number of borrows moved.
+    """
+    if older_than_days is None:
+        older_than_days = getattr(settings, 'BORROW_ARCHIVE_AFTER_DAYS', 365)
+    batch_size = batch_size or getattr(settings, 'BORROW_ARCHIVE_BATCH_SIZE', 1000)
+    cutoff = (now or timezone.now()) - timedelta(days=older_than_days)
+    candidates = Borrow.objects.filter(branch=current_branch(), returned=True, returned_at__lt=cutoff)
+
+    moved = 0
+    while True:
+        with branch_atomic():
+            rows = list(candidates.order_by('pk').values(*ARCHIVED_FIELDS)[:batch_size])
+            if not rows:
+                return moved
+            ArchivedBorrow.objects.bulk_create([ArchivedBorrow(**row) for row in rows])
+            Borrow.objects.filter(pk__in=[row['id'] for row in rows]).delete()
+        moved += len(rows)
+
+
+def borrow_history():
+    """
+    Every borrow of the current database, live and archived.
+    """
+    return BorrowHistory(Borrow.objects.all(), ArchivedBorrow.objects.all())
+
+
+class BorrowHistory:
+    """
+    Live and archived borrows as one queryset-like sequence, for paginated
+    listings. ``hot`` and ``cold`` are Borrow and ArchivedBorrow querysets
+    with the same filters; ids never collide because archived borrows keep
+    theirs. Pages are ordered like ``hot`` when it is ordered by plain
+    columns, otherwise newest first.
+    """
+    ordered = True
+
+    def __init__(self, hot, cold, fields=None, flat=False):
+        self.hot = hot
+        self.cold = cold
+        self.fields = fields
+        self.flat = flat
+
+    def _clone(self, hot, cold, **kwargs):
+        options = {'fields': self.fields, 'flat': self.flat, **kwargs}
+        return type(self)(hot, cold, **options)
+
+    def filter(self, *args, **kwargs):
+        return self._clone(self.hot.filter(*args, **kwargs), self.cold.filter(*args, **kwargs))
+
+    def values_list(self, *fields, flat=False):
+        return self._clone(
+            self.hot.values_list(*fields, flat=flat), self.cold.values_list(*fields, flat=flat),
+            fields=fields, flat=flat,
+        )
+
+    def count(self):
+        return self.hot.count() + self.cold.count()
+
+    def iterator(self, chunk_size=2000):
+        """
+        Every row, live borrows first, in no particular order.
+        """
+        return chain(self.hot.iterator(chunk_size=chunk_size), self.cold.iterator(chunk_size=chunk_size))
+
+    def _ordering(self):
+        columns = {field.attname for field in ArchivedBorrow._meta.concrete_fields}
+        ordering = [
+            name.replace('pk', 'id') if name.lstrip('-') == 'pk' else name
+            for name in self.hot.query.order_by if isinstance(name, str)
+        ]
+        if not ordering or any(name.lstrip('-') not in columns for name in ordering):
+            ordering = ['-borrowed_at']
+        return ordering + ['-id']
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            return self[index:index + 1][0]
+
+        ordering = self._ordering()
+        key_columns = list(dict.fromkeys(['id'] + [name.lstrip('-') for name in ordering]))
+        keys = self.hot.order_by().values_list(*key_columns).union(
+            self.cold.order_by().values_list(*key_columns), all=True
+        ).order_by(*ordering)
+        ids = [key[0] for key in keys[index]]
+        rows = self._load(self.hot, ids) | self._load(self.cold, ids)
+        return [rows[pk] for pk in ids if pk in rows]
+
+    def _load(self, queryset, ids):
+        queryset = queryset.filter(pk__in=ids)
+        if self.fields is None:
+            return {row.pk: row for row in queryset}
+        # Fetch the id alongside the requested columns to put rows in order.
+        return {row[0]: row[1] if self.flat else row[1:] for row in queryset.values_list('pk', *self.fields)}
+
+    def __iter__(self):
+        return iter(self[:])
+
+    def __len__(self):
+        return self.count()
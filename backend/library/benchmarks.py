@@ -0,0 +1,98 @@
+"""
+Helpers shared by the bench_* management commands. Benchmarks always run
+against a freshly migrated scratch database, never the real one.
+"""
+import random
+import statistics
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.db import connection
+from django.utils import timezone
+
+from .models import Book, Borrow, User
+
+GENRES = ['Fantasy', 'Sci-Fi', 'Mystery', 'Romance', 'History', 'Biography', 'Poetry', 'Horror']
+
+
+@contextmanager
+def scratch_database():
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+def measure(func, repeat=20, warmup=2):
+    for _ in range(warmup):
+        func()
+
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - start) * 1000)
+
+    timings.sort()
+    return {
+        'mean_ms': statistics.fmean(timings),
+        'p50_ms': timings[len(timings) // 2],
+        'p99_ms': timings[min(len(timings) - 1, int(len(timings) * 0.99))],
+    }
+
+
+def format_stats(label, stats):
+    return f"{label:<40} mean {stats['mean_ms']:9.3f} ms   p50 {stats['p50_ms']:9.3f} ms   p99 {stats['p99_ms']:9.3f} ms"
+
+
+def seed_catalog(books, users=0, borrows=0, days=365, seed=0):
+    """
+    Fill the scratch database with ``books`` titles, ``users`` patrons and
+    up to ``borrows`` returned loans spread over the last ``days`` days.
+    """
+    rng = random.Random(seed)
+    Book.objects.bulk_create(
+        [
+            Book(
+                title=f'Title {index}',
+                author=f'Author {index % max(books // 5, 1)}',
+                genre=GENRES[index % len(GENRES)],
+                total_copies=3,
+                available_copies=3,
+            )
+            for index in range(books)
+        ],
+        batch_size=1000,
+    )
+    User.objects.bulk_create(
+        [User(username=f'patron{index}', email=f'patron{index}@example.com') for index in range(users)],
+        batch_size=1000,
+    )
+    if not (borrows and users):
+        return
+
+    book_ids = list(Book.objects.values_list('pk', flat=True))
+    user_ids = list(User.objects.values_list('pk', flat=True))
+    pairs = set()
+    while len(pairs) < min(borrows, len(book_ids) * len(user_ids)):
+        # Skew towards the front of the catalog so some titles are popular.
+        book_id = book_ids[min(int(rng.expovariate(10 / len(book_ids))), len(book_ids) - 1)]
+        pairs.add((rng.choice(user_ids), book_id))
+
+    now = timezone.now()
+    for start in range(0, len(pairs), 5000):
+        chunk = list(pairs)[start:start + 5000]
+        created = Borrow.objects.bulk_create(
+            [
+                Borrow(user_id=user_id, book_id=book_id, due_date=now.date(), returned=True, returned_at=now)
+                for user_id, book_id in chunk
+            ]
+        )
+        # borrowed_at is auto_now_add, so spread it out after the insert.
+        for borrow in created:
+            borrow.borrowed_at = now - timedelta(seconds=rng.randrange(days * 86400))
+            borrow.due_date = (borrow.borrowed_at + timedelta(days=14)).date()
+        Borrow.objects.bulk_update(created, ['borrowed_at', 'due_date'], batch_size=1000)
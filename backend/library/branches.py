@@ -0,0 +1,49 @@
+"""
+Catalog search across every library branch.
+
+Each branch is queried on its own thread, against its own database, and
+the per-branch results are merged into one list ordered by title. Branches
+that share a database are still queried separately, so the work and the
+result size per branch stay the same however branches are placed.
+"""
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connections
+from django.db.models import Q
+
+from .models import Book
+from .routers import get_branches, using_branch
+
+RESULT_FIELDS = ('id', 'title', 'author', 'genre', 'branch', 'available_copies', 'total_copies')
+
+
+def _search_branch(code, search, limit):
+    try:
+        with using_branch(code):
+            queryset = Book.objects.filter(branch=code)
+            if search:
+                queryset = queryset.filter(
+                    Q(title__icontains=search) | Q(author__icontains=search) | Q(genre__icontains=search)
+                )
+            return list(queryset.order_by('title', 'id').values(*RESULT_FIELDS)[:limit])
+    finally:
+        # Worker threads get their own connections; do not leave them open.
+        connections.close_all()
+
+
+def search_all_branches(search, limit=20):
+    """
+    Return up to ``limit`` books matching ``search`` from every branch,
+    each with its ``branch`` code, ordered by title.
+    """
+    branches = list(get_branches())
+    workers = min(len(branches), getattr(settings, 'BRANCH_FANOUT_WORKERS', 8))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        per_branch = pool.map(lambda code: _search_branch(code, search, limit), branches)
+        rows = [row for branch_rows in per_branch for row in branch_rows]
+
+    rows.sort(key=lambda row: (row['title'].casefold(), row['branch'], row['id']))
+    for row in rows:
+        row['available'] = row['available_copies'] > 0
+    return rows[:limit]
@@ -0,0 +1,69 @@
+import hashlib
+import time
+
+from django.core.cache import caches
+from django.db import transaction
+
+from .routers import branch_database, current_branch
+
+CATALOG_VERSION_KEY = 'library:catalog-version'
+
+
+def _clock_version():
+    return time.time_ns() // 1000
+
+
+def _version(key):
+    # Versions live in the shared cache so every worker sees a bump. A key
+    # lost to eviction restarts from the clock rather than from a number
+    # that old entries may still be stored under.
+    shared = caches['shared']
+    version = shared.get(key)
+    if version is None:
+        version = _clock_version()
+        shared.add(key, version, None)
+        version = shared.get(key, version)
+    return version
+
+
+def _bump(key):
+    shared = caches['shared']
+    try:
+        shared.incr(key)
+    except ValueError:
+        shared.set(key, _clock_version(), None)
+
+
+def catalog_version():
+    """
+    Version number of the book catalog. Cached entries derived from it embed
+    the version in their key, so bumping it invalidates them all at once.
+    """
+    return _version(CATALOG_VERSION_KEY)
+
+
+def bump_catalog_version():
+    _bump(CATALOG_VERSION_KEY)
+
+
+def availability_version():
+    """
+    Version of the current branch's shelf counters, for cached entries
+    that depend on how many copies are available.
+    """
+    return _version(f'library:availability-version:{current_branch()}')
+
+
+def bump_availability_version():
+    """
+    Invalidate the current branch's availability once the current
+    transaction commits, so nothing recomputed before then is cached as
+    fresh.
+    """
+    key = f'library:availability-version:{current_branch()}'
+    transaction.on_commit(lambda: _bump(key), using=branch_database())
+
+
+def make_key(prefix, *parts):
+    digest = hashlib.md5(repr(parts).encode(), usedforsecurity=False).hexdigest()
+    return f'library:{prefix}:{digest}'
@@ -0,0 +1,72 @@
+"""
+Catalog delta sync for mirrors.
+
+GET /api/books/changes/?since=<token> returns the books created or changed
+since the token, the ids of books deleted since it (from BookTombstone),
+and the token to send next time. Without a token the whole catalog comes
+back, a page at a time. Tokens are opaque to clients; inside they are an
+(updated_at, id) position, so paging walks the (branch, updated_at, id)
+index. Changes younger than CATALOG_CHANGES_SETTLE_SECONDS wait for the
+next call: updated_at is stamped before commit, so a slower transaction
+could still commit behind a position already handed out.
+"""
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import Book, BookTombstone
+from .routers import current_branch
+
+EPOCH = datetime(2000, 1, 1, tzinfo=dt_timezone.utc)
+MICROSECOND = timedelta(microseconds=1)
+
+
+def encode_token(moment, book_id=0):
+    return f'{(moment - EPOCH) // MICROSECOND}.{book_id}'
+
+
+def decode_token(token):
+    """
+    (moment, book id) for a token; raises ValueError if it is malformed.
+    """
+    if not token:
+        return EPOCH, 0
+    micros, book_id = token.split('.')
+    try:
+        return EPOCH + int(micros) * MICROSECOND, int(book_id)
+    except OverflowError:
+        raise ValueError(token)
+
+
+def catalog_changes(since=None, limit=500, now=None):
+    """
+    Changes to the current branch's catalog after the ``since`` token:
+    (books, deleted book ids, next token, whether more are waiting).
+    """
+    after, after_id = decode_token(since)
+    settled = (now or timezone.now()) - timedelta(seconds=getattr(settings, 'CATALOG_CHANGES_SETTLE_SECONDS', 2))
+
+    books = list(
+        Book.objects.filter(branch=current_branch(), updated_at__lte=settled)
+        .filter(Q(updated_at__gt=after) | Q(updated_at=after, id__gt=after_id))
+        .order_by('updated_at', 'id')[:limit + 1]
+    )
+    more = len(books) > limit
+    books = books[:limit]
+    if more:
+        # An empty page (limit below 1) must not move the cursor past what it skipped.
+        upper, upper_id = (books[-1].updated_at, books[-1].pk) if books else (after, after_id)
+    elif settled > after:
+        upper = settled
+        upper_id = max((book.pk for book in books if book.updated_at == settled), default=0)
+    else:
+        upper, upper_id = after, after_id
+
+    deleted = list(
+        BookTombstone.objects.filter(branch=current_branch(), deleted_at__gt=after, deleted_at__lte=upper)
+        .order_by('deleted_at', 'id')
+        .values_list('book_id', flat=True)
+    )
+    return books, deleted, encode_token(upper, upper_id), more
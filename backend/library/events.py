@@ -0,0 +1,85 @@
+"""
+Transactional outbox for catalog and circulation changes.
+
+record_* helpers must be called inside the transaction that makes the
+change, so an event exists if and only if the change was committed.
+Readers page through Event by id, either over GET /api/events/?after= or
+in-process with consume_events().
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from .models import Event, RollupWatermark
+from .routers import branch_atomic
+
+
+def book_payload(book):
+    return {
+        'id': book.pk,
+        'title': book.title,
+        'author': book.author,
+        'genre': book.genre,
+        'total_copies': book.total_copies,
+        'available_copies': book.available_copies,
+    }
+
+
+def borrow_payload(borrow):
+    return {
+        'id': borrow.pk,
+        'user': borrow.user_id,
+        'book': borrow.book_id,
+        'due_date': borrow.due_date.isoformat() if borrow.due_date else None,
+        'returned': borrow.returned,
+        'returned_at': borrow.returned_at.isoformat() if borrow.returned_at else None,
+    }
+
+
+def record_book_event(kind, book):
+    return Event.objects.create(kind=kind, object_id=book.pk, payload=book_payload(book))
+
+
+def record_borrow_event(kind, borrow):
+    return Event.objects.create(kind=kind, object_id=borrow.pk, payload=borrow_payload(borrow))
+
+
+def record_borrow_events(kind, borrows):
+    Event.objects.bulk_create(
+        [Event(kind=kind, object_id=borrow.pk, payload=borrow_payload(borrow)) for borrow in borrows],
+        batch_size=500,
+    )
+
+
+def events_after(after=0, limit=100):
+    """
+    Events with an id above ``after``, oldest first. Events younger than
+    EVENTS_SETTLE_SECONDS are held back: ids are handed out before commit,
+    so a slower transaction could still commit an earlier id.
+    """
+    settled = timezone.now() - timedelta(seconds=getattr(settings, 'EVENTS_SETTLE_SECONDS', 2))
+    return list(Event.objects.filter(pk__gt=after, created_at__lte=settled).order_by('pk')[:limit])
+
+
+def consume_events(name, handler, batch_size=500):
+    """
+    Feed unseen events to ``handler`` one batch (a list) at a time, storing
+    the consumer's position under ``name`` after each batch. If the handler
+    raises, the batch is retried on the next call. Returns the number of
+    events handled.
+    """
+    cursor_name = f'events:{name}'
+    handled = 0
+    while True:
+        position = int(
+            RollupWatermark.objects.filter(name=cursor_name).values_list('value', flat=True).first() or 0
+        )
+        batch = events_after(position, batch_size)
+        if not batch:
+            return handled
+
+        with branch_atomic():
+            handler(batch)
+            RollupWatermark.objects.update_or_create(name=cursor_name, defaults={'value': str(batch[-1].pk)})
+        handled += len(batch)
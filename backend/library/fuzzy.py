@@ -0,0 +1,99 @@
+"""
+Typo-tolerant book search.
+
+Titles and authors are normalized (case, accents and punctuation removed)
+and broken into pg_trgm-style word trigrams stored in BookTrigram. A query
+first collects the books sharing the most trigrams with it through the
+(trigram, book) index, and only those candidates are scored.
+"""
+import math
+import unicodedata
+
+from django.conf import settings
+from django.db.models import Count
+
+from .models import Book, BookTrigram
+from .routers import branch_atomic, current_branch
+
+
+def normalize(text):
+    decomposed = unicodedata.normalize('NFKD', text.casefold())
+    stripped = ''.join(char for char in decomposed if not unicodedata.combining(char))
+    return ' '.join(''.join(char if char.isalnum() else ' ' for char in stripped).split())
+
+
+def trigrams(text):
+    grams = set()
+    for word in normalize(text).split():
+        padded = f'  {word} '
+        grams.update(padded[index:index + 3] for index in range(len(padded) - 2))
+    return grams
+
+
+def similarity(left, right):
+    if not left or not right:
+        return 0.0
+    return len(left & right) / len(left | right)
+
+
+def score(query_grams, text):
+    """
+    Best of whole-text similarity and similarity to any single word, so a
+    misspelt surname still matches a full author name.
+    """
+    best = similarity(query_grams, trigrams(text))
+    for word in normalize(text).split():
+        best = max(best, similarity(query_grams, trigrams(word)))
+    return best
+
+
+def index_book(book):
+    grams = trigrams(book.title) | trigrams(book.author)
+    with branch_atomic():
+        BookTrigram.objects.filter(book_id=book.pk).delete()
+        BookTrigram.objects.bulk_create([BookTrigram(book_id=book.pk, trigram=gram) for gram in grams])
+
+
+def rebuild_index(batch_size=1000):
+    BookTrigram.objects.all().delete()
+    batch = []
+    indexed = 0
+    for book_id, title, author in Book.objects.values_list('pk', 'title', 'author').iterator(chunk_size=batch_size):
+        batch.extend(BookTrigram(book_id=book_id, trigram=gram) for gram in trigrams(title) | trigrams(author))
+        indexed += 1
+        if len(batch) >= batch_size * 20:
+            BookTrigram.objects.bulk_create(batch, batch_size=batch_size)
+            batch = []
+    BookTrigram.objects.bulk_create(batch, batch_size=batch_size)
+    return indexed
+
+
+def fuzzy_search(query, limit=100):
+    """
+    Return [(book_id, score), ...] best match first, for books whose title
+    or author is at least FUZZY_SEARCH_THRESHOLD similar to ``query``.
+    """
+    query_grams = trigrams(query)
+    if not query_grams:
+        return []
+
+    threshold = getattr(settings, 'FUZZY_SEARCH_THRESHOLD', 0.3)
+    # A and B can only reach `threshold` Jaccard similarity if they share at
+    # least threshold * |A| trigrams; use that to prune before scoring.
+    min_shared = max(1, math.ceil(len(query_grams) * threshold))
+    candidates = (
+        BookTrigram.objects.filter(trigram__in=query_grams, book__branch=current_branch())
+        .values('book_id')
+        .annotate(shared=Count('id'))
+        .filter(shared__gte=min_shared)
+        .order_by('-shared')
+        .values_list('book_id', flat=True)[:getattr(settings, 'FUZZY_SEARCH_CANDIDATES', 500)]
+    )
+
+    scored = []
+    for book_id, title, author in Book.objects.filter(pk__in=list(candidates)).values_list('pk', 'title', 'author'):
+        best = max(score(query_grams, title), score(query_grams, author))
+        if best >= threshold:
+            scored.append((book_id, best))
+    scored.sort(key=lambda item: (-item[1], item[0]))
+    return scored[:limit]
@@ -0,0 +1,139 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Case, F, IntegerField, Value, When
+from django.utils import timezone
+
+from .caching import bump_availability_version
+from .models import Book, Hold
+from .routers import branch_atomic
+from .stream import announce_availability
+
+
+def pickup_window():
+    return timedelta(days=getattr(settings, 'HOLD_PICKUP_DAYS', 3))
+
+
+@branch_atomic()
+def place_hold(user, book):
+    last = (
+        Hold.objects.filter(book=book)
+        .order_by('-position')
+        .values_list('position', flat=True)
+        .first()
+    )
+    return Hold.objects.create(user=user, book=book, position=(last or 0) + 1)
+
+
+def release_copy(book):
+    """
+    A copy of ``book`` came back. Give it to the next waiting patron, or put
+    it back on the shelf if nobody is waiting. Returns the promoted hold.
+    """
+    while True:
+        hold = (
+            Hold.objects.filter(book_id=book.pk, status=Hold.WAITING)
+            .order_by('position')
+            .first()
+        )
+        if hold is None:
+            # Only a copy that reaches the shelf changes availability.
+            if book.check_in():
+                announce_availability([book.pk])
+            return None
+
+        now = timezone.now()
+        promoted = Hold.objects.filter(pk=hold.pk, status=Hold.WAITING).update(
+            status=Hold.READY,
+            ready_at=now,
+            expires_at=now + pickup_window()
+        )
+        if promoted:
+            hold.refresh_from_db()
+            return hold
+
+
+def release_copies(book_counts):
+    """
+    Bulk version of release_copy for ``{book_id: copies}``. Books with
+    waiting holds are handed out one copy at a time; all the others go back
+    on the shelf in a single UPDATE.
+    """
+    waiting = set(
+        Hold.objects.filter(book_id__in=book_counts, status=Hold.WAITING)
+        .values_list('book_id', flat=True)
+        .distinct()
+    )
+    for book_id in waiting:
+        for _ in range(book_counts[book_id]):
+            release_copy(Book(pk=book_id))
+
+    shelved = {book_id: count for book_id, count in book_counts.items() if book_id not in waiting}
+    if shelved:
+        Book.objects.filter(pk__in=shelved).update(
+            available_copies=F('available_copies') + Case(
+                *[When(pk=book_id, then=Value(count)) for book_id, count in shelved.items()],
+                output_field=IntegerField(),
+            ),
+            updated_at=timezone.now(),
+        )
+        announce_availability(shelved)
+        bump_availability_version()
+
+
+def fulfill_ready_hold(user, book):
+    """
+    Turn the user's ready hold on ``book`` into a loan. The copy was already
+    set aside for them, so the shelf counter is left alone.
+    """
+    return bool(
+        Hold.objects.filter(user=user, book=book, status=Hold.READY)
+        .update(status=Hold.FULFILLED)
+    )
+
+
+def withdraw_waiting_hold(user, book):
+    """
+    ``user`` borrowed a shelf copy of ``book``: cancel their waiting hold
+    so no copy is set aside for them later.
+    """
+    return Hold.objects.filter(user=user, book=book, status=Hold.WAITING).update(status=Hold.CANCELLED)
+
+
+@branch_atomic()
+def cancel_hold(hold):
+    was_ready = hold.status == Hold.READY
+    updated = Hold.objects.filter(pk=hold.pk, status__in=Hold.ACTIVE_STATUSES).update(
+        status=Hold.CANCELLED
+    )
+    if updated and was_ready:
+        release_copy(hold.book)
+    hold.status = Hold.CANCELLED
+    return hold
+
+
+def expire_ready_holds(batch_size=500, now=None):
+    """
+    Expire ready holds whose pickup window has passed, ``batch_size`` at a
+    time, passing each copy on to the next patron. Returns the number of
+    holds expired.
+    """
+    now = now or timezone.now()
+    expired = 0
+
+    while True:
+        with branch_atomic():
+            batch = list(
+                Hold.objects.select_for_update(skip_locked=True)
+                .filter(status=Hold.READY, expires_at__lt=now)
+                .order_by('expires_at')
+                .values_list('pk', 'book_id')[:batch_size]
+            )
+            if not batch:
+                return expired
+
+            Hold.objects.filter(pk__in=[pk for pk, _ in batch]).update(status=Hold.EXPIRED)
+            for _, book_id in batch:
+                release_copy(Book(pk=book_id))
+
+        expired += len(batch)
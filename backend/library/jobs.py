@@ -0,0 +1,98 @@
+"""
+Background jobs stored in the main database.
+
+enqueue() adds a Job row. Workers (manage.py run_worker) claim due jobs in
+batches: on backends with SKIP LOCKED the candidate rows are locked so
+concurrent workers pass over each other, elsewhere (SQLite) the claim is a
+conditional UPDATE that only the first writer wins. Handlers are looked up
+by kind in settings.JOB_HANDLERS and receive the job's payload. Failed jobs
+are retried with exponential backoff until max_attempts.
+"""
+import os
+import socket
+import traceback
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import Job
+
+
+def enqueue(kind, payload=None, run_at=None, unique_key=None, max_attempts=5):
+    """
+    Queue a job. With ``unique_key``, a job already queued under that key is
+    returned instead of a duplicate.
+    """
+    if kind not in settings.JOB_HANDLERS:
+        raise ValueError(f'Unknown job kind: {kind}')
+
+    try:
+        with transaction.atomic():
+            return Job.objects.create(
+                kind=kind,
+                payload=payload or {},
+                run_at=run_at or timezone.now(),
+                unique_key=unique_key,
+                max_attempts=max_attempts,
+            )
+    except IntegrityError:
+        if unique_key is None:
+            raise
+        return Job.objects.get(unique_key=unique_key)
+
+
+def claim_jobs(limit=10, now=None):
+    """
+    Mark up to ``limit`` due jobs as running for this worker and return them.
+    Jobs left running longer than JOB_LOCK_TIMEOUT_SECONDS (a crashed
+    worker) are claimed again.
+    """
+    now = now or timezone.now()
+    token = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+    stale = now - timedelta(seconds=getattr(settings, 'JOB_LOCK_TIMEOUT_SECONDS', 600))
+    due = Q(status=Job.QUEUED, run_at__lte=now) | Q(status=Job.RUNNING, locked_at__lt=stale)
+
+    with transaction.atomic():
+        candidates = Job.objects.filter(due).order_by('run_at', 'pk')
+        if connection.features.has_select_for_update_skip_locked:
+            candidates = candidates.select_for_update(skip_locked=True)
+        ids = list(candidates.values_list('pk', flat=True)[:limit])
+        Job.objects.filter(due, pk__in=ids).update(
+            status=Job.RUNNING, locked_by=token, locked_at=now, attempts=F('attempts') + 1
+        )
+    return list(Job.objects.filter(pk__in=ids, locked_by=token).order_by('run_at', 'pk'))
+
+
+def run_job(job):
+    handler = import_string(settings.JOB_HANDLERS[job.kind])
+    try:
+        handler(job.payload)
+    except Exception:
+        job.last_error = traceback.format_exc()
+        if job.attempts >= job.max_attempts:
+            job.status = Job.FAILED
+        else:
+            job.status = Job.QUEUED
+            backoff = getattr(settings, 'JOB_RETRY_BASE_SECONDS', 30) * 2 ** (job.attempts - 1)
+            job.run_at = timezone.now() + timedelta(seconds=backoff)
+        job.save(update_fields=['status', 'run_at', 'last_error'])
+        return False
+
+    job.status = Job.DONE
+    job.save(update_fields=['status'])
+    return True
+
+
+def work(batch_size=10):
+    """
+    Claim and run one batch. Returns the number of jobs run.
+    """
+    jobs = claim_jobs(batch_size)
+    for job in jobs:
+        run_job(job)
+    return len(jobs)
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from library.archive import archive_returned_borrows
+from library.routers import get_branches, using_branch
+
+
+class Command(BaseCommand):
+    help = 'Move long-returned borrows of every branch into the borrow archive'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than-days', type=int, default=None,
+                            help='Defaults to BORROW_ARCHIVE_AFTER_DAYS')
+        parser.add_argument('--batch-size', type=int, default=None)
+
+    def handle(self, *args, **options):
+        for code in get_branches():
+            with using_branch(code):
+                moved = archive_returned_borrows(options['older_than_days'], options['batch_size'])
+            self.stdout.write(self.style.SUCCESS(f'{code}: archived {moved} borrows'))
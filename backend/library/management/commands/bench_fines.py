@@ -0,0 +1,67 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from library.benchmarks import GENRES, scratch_database, seed_catalog
+from library.fines import compute_fines, recalculate_fines
+from library.models import Book, Borrow, User
+
+
+class Command(BaseCommand):
+    help = 'Time recalculate_fines over many open overdue loans, against writing the same fines with bulk_update'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loans', type=int, default=200000)
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--days', type=int, default=3, help='Consecutive days to recalculate')
+
+    def seed_loans(self, loans, users):
+        seed_catalog(-(-loans // users), users)
+        book_ids = list(Book.objects.values_list('pk', flat=True))
+        user_ids = list(User.objects.values_list('pk', flat=True))
+        today = timezone.localdate()
+        for start in range(0, loans, 20000):
+            Borrow.objects.bulk_create(
+                [
+                    Borrow(user_id=user_ids[index % users], book_id=book_ids[index // users],
+                           due_date=today - timedelta(days=index % 60))
+                    for index in range(start, min(start + 20000, loans))
+                ],
+                batch_size=2000,
+            )
+
+    def bulk_update_run(self, today):
+        import numpy as np
+
+        rows = list(Borrow.objects.filter(returned=False, due_date__lt=today)
+                    .values_list('id', 'due_date', 'book__genre').iterator(chunk_size=20000))
+        ids, due_dates, genres = zip(*rows)
+        fines = compute_fines(np.array(due_dates, dtype='datetime64[D]'), np.array(genres), today)
+        Borrow.objects.bulk_update(
+            [Borrow(pk=pk, fine_cents=fine) for pk, fine in zip(ids, fines.tolist())], ['fine_cents'], batch_size=1000
+        )
+
+    def handle(self, *args, **options):
+        with scratch_database():
+            start = time.perf_counter()
+            self.seed_loans(options['loans'], options['users'])
+            self.stdout.write(f"Seeded {options['loans']} open loans over {len(GENRES)} genres "
+                              f"in {time.perf_counter() - start:.1f} s")
+
+            today = timezone.localdate()
+            for day in range(1, options['days'] + 1):
+                start = time.perf_counter()
+                checked, changed = recalculate_fines(today + timedelta(days=day))
+                self.stdout.write(f'recalculate_fines day {day}: {checked} checked, {changed} changed '
+                                  f'in {time.perf_counter() - start:.2f} s')
+
+            start = time.perf_counter()
+            checked, changed = recalculate_fines(today + timedelta(days=options['days']))
+            self.stdout.write(f'recalculate_fines, nothing changed: {checked} checked '
+                              f'in {time.perf_counter() - start:.2f} s')
+
+            start = time.perf_counter()
+            self.bulk_update_run(today + timedelta(days=options['days'] + 1))
+            self.stdout.write(f'same pass writing every fine with bulk_update: {time.perf_counter() - start:.2f} s')
@@ -0,0 +1,61 @@
+import gzip
+
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from library.benchmarks import format_stats, measure, scratch_database, seed_catalog
+from library.models import User
+from library.renderers import FastJSONRenderer
+from library.views import BookViewSet, BorrowViewSet
+
+
+class Command(BaseCommand):
+    help = 'Measure CPU time and payload size of the book and borrow list endpoints'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--books', type=int, default=2000)
+        parser.add_argument('--borrows', type=int, default=5000)
+        parser.add_argument('--page-size', type=int, default=100)
+        parser.add_argument('--repeat', type=int, default=30)
+
+    def cases(self):
+        book_fields = 'id,title,author,genre,available'
+        borrow_fields = 'id,book,book_title,book_author,due_date,returned'
+        return [
+            ('books', BookViewSet, 'list', '/api/books/', {}),
+            ('books ?fields=', BookViewSet, 'list', '/api/books/', {'fields': book_fields}),
+            ('borrows', BorrowViewSet, 'list', '/api/borrows/', {}),
+            ('borrows ?fields=', BorrowViewSet, 'list', '/api/borrows/', {'fields': borrow_fields}),
+        ]
+
+    def handle(self, *args, **options):
+        with scratch_database():
+            seed_catalog(options['books'], users=200, borrows=options['borrows'])
+            librarian = User.objects.create(username='bench', email='bench@example.com', role='librarian')
+            factory = APIRequestFactory()
+
+            for renderer in (JSONRenderer, FastJSONRenderer):
+                for fast_rows in (False, True):
+                    self.stdout.write(f"-- {renderer.__name__}, {'values_list rows' if fast_rows else 'serializer'}")
+                    with override_settings(FAST_LIST_ROWS=fast_rows):
+                        self.run_cases(factory, librarian, renderer, options)
+
+    def run_cases(self, factory, librarian, renderer, options):
+        for label, viewset, action, url, params in self.cases():
+            view = viewset.as_view({'get': action}, renderer_classes=[renderer], throttle_classes=[])
+            query = {'page_size': options['page_size'], **params}
+
+            def request():
+                http_request = factory.get(url, query, HTTP_HOST='localhost')
+                force_authenticate(http_request, librarian)
+                return view(http_request).render().content
+
+            body = request()
+            stats = measure(request, repeat=options['repeat'])
+            per_row_us = stats['mean_ms'] * 1000 / options['page_size']
+            self.stdout.write(
+                f'{format_stats(label, stats)}   {per_row_us:6.1f} us/row'
+                f'   {len(body):>7} B   {len(gzip.compress(body)):>6} B gzip'
+            )
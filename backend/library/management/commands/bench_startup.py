@@ -0,0 +1,125 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+# Runs in a fresh interpreter under ``python -X importtime``: import the
+# entry point, then push one request through it.
+STARTUP_SCRIPT = '''
+import json
+import time
+
+start = time.perf_counter()
+import library_system.{entry} as entry
+imported = time.perf_counter()
+status = first_request(entry.application)
+finished = time.perf_counter()
+print(json.dumps({{
+    'import_ms': (imported - start) * 1000,
+    'request_ms': (finished - imported) * 1000,
+    'status': status,
+}}))
+'''
+
+WSGI_REQUEST = '''
+from wsgiref.util import setup_testing_defaults
+
+
+def first_request(application):
+    environ = {'PATH_INFO': '/api/books/', 'HTTP_HOST': 'localhost'}
+    setup_testing_defaults(environ)
+    statuses = []
+    b''.join(application(environ, lambda status, headers: statuses.append(status)))
+    return int(statuses[0].split()[0])
+'''
+
+ASGI_REQUEST = '''
+import asyncio
+
+
+def first_request(application):
+    messages = []
+    body_sent = False
+
+    async def receive():
+        nonlocal body_sent
+        if not body_sent:
+            body_sent = True
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+        await asyncio.Future()
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET',
+        'scheme': 'http', 'path': '/api/books/', 'raw_path': b'/api/books/', 'query_string': b'',
+        'root_path': '', 'headers': [(b'host', b'localhost')], 'server': ('localhost', 80),
+        'client': ('127.0.0.1', 0),
+    }
+    asyncio.run(application(scope, receive, send))
+    return messages[0]['status']
+'''
+
+ENTRY_POINTS = {'wsgi': WSGI_REQUEST, 'asgi': ASGI_REQUEST}
+
+
+def parse_importtime(stderr):
+    """
+    Self time in milliseconds per top-level package, from ``-X importtime``
+    output.
+    """
+    per_package = defaultdict(float)
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, _, name = line[len('import time:'):].split('|')
+        per_package[name.strip().split('.')[0]] += int(self_us) / 1000
+    return per_package
+
+
+class Command(BaseCommand):
+    help = 'Measure import time and time to first request of wsgi.py/asgi.py in fresh interpreters'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--settings-modules', nargs='+',
+            default=['library_system.settings', 'library_system.settings_production'],
+        )
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--top', type=int, default=6, help='Slowest packages to list')
+
+    def run_once(self, entry, settings_module):
+        env = {**os.environ, 'DJANGO_SETTINGS_MODULE': settings_module, 'LIBRARY_ALLOWED_HOSTS': 'localhost'}
+        script = ENTRY_POINTS[entry] + STARTUP_SCRIPT.format(entry=entry)
+        result = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', script],
+            cwd=settings.BASE_DIR, env=env, capture_output=True, text=True, check=True,
+        )
+        return json.loads(result.stdout.strip().splitlines()[-1]), parse_importtime(result.stderr)
+
+    def handle(self, *args, **options):
+        for settings_module in options['settings_modules']:
+            for entry in ENTRY_POINTS:
+                runs = [self.run_once(entry, settings_module) for _ in range(options['repeat'])]
+                import_ms = statistics.median(timing['import_ms'] for timing, _ in runs)
+                request_ms = statistics.median(timing['request_ms'] for timing, _ in runs)
+                self.stdout.write(
+                    f'{settings_module} {entry}: import {import_ms:7.1f} ms   '
+                    f'first request {request_ms:6.1f} ms (HTTP {runs[0][0]["status"]})   '
+                    f'total {import_ms + request_ms:7.1f} ms'
+                )
+
+                packages = defaultdict(list)
+                for _, per_package in runs:
+                    for package, self_ms in per_package.items():
+                        packages[package].append(self_ms)
+                slowest = sorted(packages.items(), key=lambda item: -statistics.median(item[1]))
+                self.stdout.write('    ' + ', '.join(
+                    f'{package} {statistics.median(timings):.0f} ms' for package, timings in slowest[:options['top']]
+                ))
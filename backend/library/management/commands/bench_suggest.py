@@ -0,0 +1,59 @@
+import random
+import string
+import tracemalloc
+
+from django.core.management.base import BaseCommand
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from library import suggest
+from library.benchmarks import format_stats, measure
+from library.models import User
+from library.routers import current_branch
+from library.views import BookViewSet
+
+
+class Command(BaseCommand):
+    help = 'Measure autocomplete latency against a synthetic catalog'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--titles', type=int, default=1_000_000)
+        parser.add_argument('--repeat', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        rng = random.Random(0)
+        words = [''.join(rng.choices(string.ascii_lowercase, k=rng.randint(3, 9))) for _ in range(20000)]
+        rows = (
+            (
+                book_id,
+                ' '.join(rng.choice(words).capitalize() for _ in range(rng.randint(1, 5))),
+                f'{rng.choice(words).capitalize()} {rng.choice(words).capitalize()}',
+            )
+            for book_id in range(1, options['titles'] + 1)
+        )
+
+        tracemalloc.start()
+        index = suggest.SuggestIndex.from_rows(rows, max_entries=options['titles'] * 3)
+        memory, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        self.stdout.write(
+            f'{len(index)} entries, {memory / 2 ** 20:.1f} MiB held, {peak / 2 ** 20:.1f} MiB peak while building'
+        )
+
+        prefixes = [rng.choice(words)[:rng.randint(1, 4)] for _ in range(1000)]
+        self.stdout.write(format_stats(
+            'SuggestIndex.search',
+            measure(lambda: index.search(rng.choice(prefixes)), repeat=options['repeat'])
+        ))
+
+        # Full DRF dispatch with the index already loaded.
+        suggest._indexes[current_branch()] = index
+        view = BookViewSet.as_view({'get': 'suggest'}, throttle_classes=[])
+        factory = APIRequestFactory()
+        user = User(pk=1, username='bench')
+
+        def request():
+            http_request = factory.get('/api/books/suggest/', {'q': rng.choice(prefixes)})
+            force_authenticate(http_request, user)
+            view(http_request).render()
+
+        self.stdout.write(format_stats('GET /api/books/suggest/', measure(request, repeat=options['repeat'])))
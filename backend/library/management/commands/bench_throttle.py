@@ -0,0 +1,31 @@
+import os
+import tempfile
+
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+
+from library.benchmarks import format_stats, measure
+from library.throttling import parse_rate, take_token
+
+
+class Command(BaseCommand):
+    help = 'Measure the cost of one token-bucket throttle check'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=1000)
+        parser.add_argument('--repeat', type=int, default=20000)
+
+    def handle(self, *args, **options):
+        rate = parse_rate('300/min')
+        with tempfile.TemporaryDirectory() as base_dir:
+            with override_settings(THROTTLE_DB_PATH=os.path.join(base_dir, 'throttle.sqlite3')):
+                clients = iter(range(options['repeat'] * 10))
+                self.stdout.write(format_stats(
+                    'allowed (rotating clients)',
+                    measure(lambda: take_token(f"api:user:{next(clients) % options['clients']}", rate, 100),
+                            repeat=options['repeat']),
+                ))
+                self.stdout.write(format_stats(
+                    'denied (one exhausted client)',
+                    measure(lambda: take_token('api:user:hot', rate, 1), repeat=options['repeat']),
+                ))
@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count
+
+from library.benchmarks import GENRES, format_stats, measure, scratch_database, seed_catalog
+from library.models import Book, Borrow
+from library.trending import rebuild, record_borrow, trending_books
+
+
+class Command(BaseCommand):
+    help = 'Compare the decayed trending index with a GROUP BY over borrow history'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--books', type=int, default=5000)
+        parser.add_argument('--users', type=int, default=2000)
+        parser.add_argument('--borrows', type=int, default=100000)
+        parser.add_argument('--repeat', type=int, default=20)
+
+    def handle(self, *args, **options):
+        with scratch_database():
+            seed_catalog(options['books'], options['users'], options['borrows'])
+            rebuild()
+            genre = GENRES[0]
+            book = Book.objects.first()
+
+            def naive(genre=None):
+                borrows = Borrow.objects.all()
+                if genre:
+                    borrows = borrows.filter(book__genre=genre)
+                return list(borrows.values('book_id').annotate(borrows=Count('id')).order_by('-borrows')[:20])
+
+            runs = [
+                ('naive GROUP BY', lambda: naive()),
+                ('decayed index', lambda: list(trending_books()[:20])),
+                (f'naive GROUP BY, genre={genre}', lambda: naive(genre)),
+                (f'decayed index, genre={genre}', lambda: list(trending_books(genre)[:20])),
+                ('record_borrow', lambda: record_borrow(book)),
+            ]
+            self.stdout.write(f"{Borrow.objects.count()} borrows over {options['books']} books")
+            for label, func in runs:
+                self.stdout.write(format_stats(label, measure(func, repeat=options['repeat'])))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from library.recommendations import build_cooccurrence
+
+
+class Command(BaseCommand):
+    help = 'Refresh the "borrowed together" co-occurrence matrix from new borrows'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='Rebuild from the whole borrow history')
+
+    def handle(self, *args, **options):
+        meta = build_cooccurrence(full=options['full'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Co-occurrence matrix covers {meta['books']} books and {meta['pairs']} pairs "
+            f"(borrows up to id {meta['watermark']})"
+        ))
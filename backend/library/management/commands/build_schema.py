@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from library.schema import write_schema
+
+
+class Command(BaseCommand):
+    help = 'Generate the OpenAPI schema once and write it to API_SCHEMA_PATH'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', help='Write here instead of API_SCHEMA_PATH')
+
+    def handle(self, *args, **options):
+        path = write_schema(options['output'])
+        self.stdout.write(self.style.SUCCESS(f'Wrote schema to {path}'))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from library.holds import expire_ready_holds
+
+
+class Command(BaseCommand):
+    help = 'Expire ready holds that were not picked up and pass the copies on'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        expired = expire_ready_holds(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Expired {expired} holds'))
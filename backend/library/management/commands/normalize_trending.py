@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from library.trending import normalize, rebuild
+
+
+class Command(BaseCommand):
+    help = 'Move the trending epoch forward and rescale popularity scores'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rebuild', action='store_true', help='Recompute scores from the full borrow history')
+
+    def handle(self, *args, **options):
+        if options['rebuild']:
+            ranked = rebuild()
+        else:
+            ranked = normalize()
+        self.stdout.write(self.style.SUCCESS(f'{ranked} books ranked'))
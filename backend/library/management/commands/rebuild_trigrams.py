@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from library.fuzzy import rebuild_index
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the trigram index used by fuzzy book search'
+
+    def handle(self, *args, **options):
+        indexed = rebuild_index()
+        self.stdout.write(self.style.SUCCESS(f'Indexed {indexed} books'))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from library.fines import recalculate_fines
+from library.routers import get_branches, using_branch
+
+
+class Command(BaseCommand):
+    help = "Bring every branch's overdue fines up to today"
+
+    def handle(self, *args, **options):
+        for code in get_branches():
+            with using_branch(code):
+                checked, changed = recalculate_fines()
+            self.stdout.write(self.style.SUCCESS(f'{code}: checked {checked} overdue loans, updated {changed} fines'))
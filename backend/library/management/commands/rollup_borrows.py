@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from library.analytics import run_rollups
+from library.routers import get_branches, using_branch
+
+
+class Command(BaseCommand):
+    help = 'Catch the daily borrow analytics rollups of every branch up with the borrow table'
+
+    def handle(self, *args, **options):
+        for code in get_branches():
+            with using_branch(code):
+                added = run_rollups()
+            self.stdout.write(self.style.SUCCESS(
+                f"{code}: added {added['borrows']} borrows, {added['returns']} returns "
+                f"and {added['overdues']} overdues"
+            ))
@@ -0,0 +1,37 @@
+import signal
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from django.utils import timezone
+
+from library.jobs import work
+from library.reminders import schedule_reminders
+
+
+class Command(BaseCommand):
+    help = 'Run background jobs from the database queue'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=10)
+        parser.add_argument('--sleep', type=float, default=5, help='Seconds to wait when the queue is empty')
+        parser.add_argument('--once', action='store_true', help='Run until the queue is empty, then exit')
+
+    def handle(self, *args, **options):
+        self.stopping = False
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
+        schedule_reminders(timezone.localdate())
+        while not self.stopping:
+            close_old_connections()
+            ran = work(options['batch_size'])
+            if ran:
+                self.stdout.write(f'Ran {ran} jobs')
+            elif options['once']:
+                break
+            else:
+                time.sleep(options['sleep'])
+
+    def stop(self, signum, frame):
+        self.stopping = True
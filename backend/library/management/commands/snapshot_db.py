@@ -0,0 +1,82 @@
+import gzip
+import os
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from library.snapshot import backup_database, compress, dump_snapshot
+
+
+class Command(BaseCommand):
+    help = 'Snapshot a live SQLite database with the online backup API, optionally with an NDJSON dump'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default='default')
+        parser.add_argument('--output', default=None,
+                            help='Snapshot file; defaults to a timestamped file in SNAPSHOT_DIR')
+        parser.add_argument('--pages', type=int, default=None,
+                            help='Pages copied per step; defaults to SNAPSHOT_STEP_PAGES')
+        parser.add_argument('--pause', type=float, default=None,
+                            help='Seconds between steps; defaults to SNAPSHOT_STEP_PAUSE')
+        parser.add_argument('--max-restarts', type=int, default=None,
+                            help='Restarts by concurrent writes before the copy finishes in one locked step; '
+                                 'defaults to SNAPSHOT_MAX_RESTARTS')
+        parser.add_argument('--compress', action='store_true', help='gzip the snapshot and the dump')
+        parser.add_argument('--ndjson', action='store_true',
+                            help='Also dump users, books and borrows from the snapshot as NDJSON')
+
+    def handle(self, *args, **options):
+        stamp = timezone.now().strftime('%Y%m%d-%H%M%S')
+        output = Path(options['output'] or Path(settings.SNAPSHOT_DIR) / f"{options['database']}-{stamp}.sqlite3")
+        output.parent.mkdir(parents=True, exist_ok=True)
+        partial = output.with_name(output.name + '.partial')
+        dump = output.with_suffix('.ndjson.gz' if options['compress'] else '.ndjson')
+        partial_dump = dump.with_name(dump.name + '.partial')
+        shown = -1
+
+        def progress(copied, total):
+            nonlocal shown
+            percent = 100 * copied // max(total, 1)
+            if percent != shown:
+                shown = percent
+                self.stdout.write(f'\r{copied}/{total} pages ({percent}%)', ending='')
+                self.stdout.flush()
+
+        try:
+            restarts, locked = backup_database(
+                options['database'], partial,
+                pages=options['pages'] or settings.SNAPSHOT_STEP_PAGES,
+                pause=settings.SNAPSHOT_STEP_PAUSE if options['pause'] is None else options['pause'],
+                max_restarts=(settings.SNAPSHOT_MAX_RESTARTS if options['max_restarts'] is None
+                              else options['max_restarts']),
+                progress=progress,
+            )
+            self.stdout.write('')
+
+            if options['ndjson']:
+                opener = gzip.open if options['compress'] else open
+                with opener(partial_dump, 'wt', encoding='utf-8') as stream:
+                    counts = dump_snapshot(partial, stream)
+                os.replace(partial_dump, dump)
+                rows = ', '.join(f'{count} {label}' for label, count in counts.items())
+                self.stdout.write(f'Dumped {rows} to {dump}')
+
+            if options['compress']:
+                target = output.with_name(output.name + '.gz')
+                compress(partial, target)
+            else:
+                target = output
+                os.replace(partial, target)
+        except ValueError as error:
+            raise CommandError(error)
+        finally:
+            partial.unlink(missing_ok=True)
+            partial_dump.unlink(missing_ok=True)
+
+        note = ''
+        if restarts:
+            finish = ', then finished in one locked step' if locked else ''
+            note = f' (restarted {restarts} times by concurrent writes{finish})'
+        self.stdout.write(self.style.SUCCESS(f'Snapshot written to {target}{note}'))
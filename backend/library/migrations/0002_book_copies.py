@@ -0,0 +1,50 @@
+# Generated by Django 5.2.18 on 2026-10-19 07:42
+
+from django.db import migrations, models
+
+
+def copy_availability(apps, schema_editor):
+    Book = apps.get_model('library', 'Book')
+    Book.objects.filter(available=False).update(available_copies=0)
+
+
+def restore_availability(apps, schema_editor):
+    Book = apps.get_model('library', 'Book')
+    Book.objects.filter(available_copies=0).update(available=False)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='available_copies',
+            field=models.PositiveIntegerField(default=1),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='total_copies',
+            field=models.PositiveIntegerField(default=1),
+        ),
+        migrations.RunPython(copy_availability, restore_availability),
+        migrations.RemoveField(
+            model_name='book',
+            name='available',
+        ),
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(fields=['available_copies'], name='book_available_copies_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='book',
+            constraint=models.CheckConstraint(condition=models.Q(('available_copies__gte', 0)), name='book_available_copies_non_negative'),
+        ),
+        migrations.AddConstraint(
+            model_name='book',
+            constraint=models.CheckConstraint(condition=models.Q(('available_copies__lte', models.F('total_copies'))), name='book_available_copies_lte_total'),
+        ),
+    ]
@@ -0,0 +1,67 @@
+# Generated by Django 5.2.18 on 2026-10-19 07:48
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0004_book_popularity'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyBookStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('borrows', models.PositiveIntegerField(default=0)),
+                ('returns', models.PositiveIntegerField(default=0)),
+                ('overdues', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='DailyGenreStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('genre', models.CharField(max_length=100)),
+                ('borrows', models.PositiveIntegerField(default=0)),
+                ('returns', models.PositiveIntegerField(default=0)),
+                ('overdues', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='RollupWatermark',
+            fields=[
+                ('name', models.CharField(max_length=50, primary_key=True, serialize=False)),
+                ('value', models.CharField(max_length=50)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='borrow',
+            index=models.Index(fields=['borrowed_at'], name='borrow_borrowed_at_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='borrow',
+            index=models.Index(fields=['returned_at'], name='borrow_returned_at_idx'),
+        ),
+        migrations.AddField(
+            model_name='dailybookstats',
+            name='book',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_stats', to='library.book'),
+        ),
+        migrations.AddIndex(
+            model_name='dailygenrestats',
+            index=models.Index(fields=['date'], name='daily_genre_stats_date_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='dailygenrestats',
+            constraint=models.UniqueConstraint(fields=('genre', 'date'), name='unique_daily_genre_stats'),
+        ),
+        migrations.AddConstraint(
+            model_name='dailybookstats',
+            constraint=models.UniqueConstraint(fields=('book', 'date'), name='unique_daily_book_stats'),
+        ),
+    ]
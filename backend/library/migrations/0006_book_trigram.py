@@ -0,0 +1,41 @@
+# Generated by Django 5.2.18 on 2026-10-19 07:53
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def index_existing_books(apps, schema_editor):
+    from library.fuzzy import trigrams
+
+    Book = apps.get_model('library', 'Book')
+    BookTrigram = apps.get_model('library', 'BookTrigram')
+    BookTrigram.objects.bulk_create(
+        [
+            BookTrigram(book_id=book_id, trigram=gram)
+            for book_id, title, author in Book.objects.values_list('pk', 'title', 'author')
+            for gram in trigrams(title) | trigrams(author)
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0005_borrow_rollups'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BookTrigram',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('trigram', models.CharField(max_length=3)),
+                ('book', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='trigrams', to='library.book')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('trigram', 'book'), name='unique_book_trigram')],
+            },
+        ),
+        migrations.RunPython(index_existing_books, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.2.18 on 2026-10-19 08:11
+
+import library.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0009_job_queue'),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name='book',
+            name='unique_book_title_author',
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='branch',
+            field=models.CharField(default=library.models.default_branch, max_length=20),
+        ),
+        migrations.AddField(
+            model_name='borrow',
+            name='branch',
+            field=models.CharField(default=library.models.default_branch, max_length=20),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='home_branch',
+            field=models.CharField(default=library.models.default_branch, max_length=20),
+        ),
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(fields=['branch', 'created_at'], name='book_branch_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='borrow',
+            index=models.Index(fields=['branch', 'borrowed_at'], name='borrow_branch_borrowed_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='book',
+            constraint=models.UniqueConstraint(fields=('branch', 'title', 'author'), name='unique_book_branch_title_author'),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.18 on 2026-10-19 08:16
+
+import django.db.models.deletion
+import library.models
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0010_branches'),
+    ]
+
+    operations = [
+        migrations.AlterUniqueTogether(
+            name='borrow',
+            unique_together=set(),
+        ),
+        migrations.CreateModel(
+            name='ArchivedBorrow',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('borrowed_at', models.DateTimeField()),
+                ('due_date', models.DateField()),
+                ('returned', models.BooleanField(default=True)),
+                ('returned_at', models.DateTimeField(blank=True, null=True)),
+                ('branch', models.CharField(default=library.models.default_branch, max_length=20)),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+                ('book', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_borrows', to='library.book')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_borrows', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', 'borrowed_at'], name='archived_borrow_user_idx'), models.Index(fields=['branch', 'borrowed_at'], name='archived_borrow_branch_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.2.18 on 2026-10-19 08:21
+
+import django.utils.timezone
+import library.models
+from django.db import migrations, models
+
+
+def start_from_created_at(apps, schema_editor):
+    Book = apps.get_model('library', 'Book')
+    Book.objects.using(schema_editor.connection.alias).update(updated_at=models.F('created_at'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0011_borrow_archive'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BookTombstone',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('book_id', models.BigIntegerField()),
+                ('branch', models.CharField(default=library.models.default_branch, max_length=20)),
+                ('deleted_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.RunPython(start_from_created_at, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(fields=['branch', 'updated_at', 'id'], name='book_branch_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='booktombstone',
+            index=models.Index(fields=['branch', 'deleted_at'], name='book_tombstone_branch_idx'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-19 08:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0012_book_changes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='archivedborrow',
+            name='fine_cents',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='borrow',
+            name='fine_cents',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-19 08:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0013_borrow_fines'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='archivedborrow',
+            name='archived_borrow_user_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='archivedborrow',
+            name='archived_borrow_branch_idx',
+        ),
+        migrations.AddIndex(
+            model_name='archivedborrow',
+            index=models.Index(fields=['user', 'branch', 'borrowed_at', 'id'], name='archived_borrow_user_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='archivedborrow',
+            index=models.Index(fields=['branch', 'borrowed_at', 'id'], name='archived_borrow_branch_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='borrow',
+            index=models.Index(fields=['user', 'branch', 'borrowed_at'], name='borrow_user_borrowed_idx'),
+        ),
+    ]
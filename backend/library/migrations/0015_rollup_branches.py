@@ -0,0 +1,59 @@
+# Generated by Django 5.2.18 on 2026-10-19 09:04
+
+import library.models
+from django.conf import settings
+from django.db import migrations, models
+
+ROLLUP_KINDS = ('borrows', 'returns', 'overdues')
+
+
+def split_by_branch(apps, schema_editor):
+    """
+    Book rollups take their book's branch. Genre rollups so far were pooled
+    and stay with the default branch. Every branch in this database carries
+    on from the shared watermarks, so nothing is counted twice.
+    """
+    database = schema_editor.connection.alias
+    Book = apps.get_model('library', 'Book')
+    DailyBookStats = apps.get_model('library', 'DailyBookStats')
+    RollupWatermark = apps.get_model('library', 'RollupWatermark')
+
+    DailyBookStats.objects.using(database).update(
+        branch=models.Subquery(Book.objects.using(database).filter(pk=models.OuterRef('book_id')).values('branch')[:1])
+    )
+    codes = [code for code, branch in settings.LIBRARY_BRANCHES.items() if branch['database'] == database]
+    for watermark in RollupWatermark.objects.using(database).filter(name__in=ROLLUP_KINDS):
+        RollupWatermark.objects.using(database).bulk_create(
+            [RollupWatermark(name=f'{watermark.name}:{code}', value=watermark.value) for code in codes],
+            ignore_conflicts=True,
+        )
+        watermark.delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0014_borrow_history_indexes'),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name='dailygenrestats',
+            name='unique_daily_genre_stats',
+        ),
+        migrations.AddField(
+            model_name='dailybookstats',
+            name='branch',
+            field=models.CharField(default=library.models.default_branch, max_length=20),
+        ),
+        migrations.AddField(
+            model_name='dailygenrestats',
+            name='branch',
+            field=models.CharField(default=library.models.default_branch, max_length=20),
+        ),
+        migrations.RunPython(split_by_branch, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='dailygenrestats',
+            constraint=models.UniqueConstraint(fields=('branch', 'genre', 'date'), name='unique_daily_branch_genre_stats'),
+        ),
+    ]
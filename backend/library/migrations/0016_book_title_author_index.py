@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-19 11:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0015_rollup_branches'),
+    ]
+
+    operations = [
+        # Databases migrated while 0010 briefly created this index already
+        # have it, hence IF NOT EXISTS.
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AddIndex(
+                    model_name='book',
+                    index=models.Index(fields=['title', 'author'], name='book_title_author_idx'),
+                ),
+            ],
+            database_operations=[
+                migrations.RunSQL(
+                    'CREATE INDEX IF NOT EXISTS "book_title_author_idx" ON "library_book" ("title", "author")',
+                    'DROP INDEX IF EXISTS "book_title_author_idx"',
+                ),
+            ],
+        ),
+    ]
@@ -1,6 +1,14 @@
+from django.conf import settings
 from django.contrib.auth.models import AbstractUser
 from django.db import models
+from django.db.models import F
 from django.core.exceptions import ValidationError
+from django.utils import timezone
+
+from .caching import bump_availability_version
+
+def default_branch():
+    return settings.DEFAULT_BRANCH
 
 class User(AbstractUser):
     ROLE_CHOICES = (
@@ -9,6 +17,7 @@ class User(AbstractUser):
     )
     role = models.CharField(max_length=10, choices=ROLE_CHOICES, default='user')
     email = models.EmailField(unique=True)
+    home_branch = models.CharField(max_length=20, default=default_branch)
 
     def __str__(self):
         return f"{self.username} ({self.role})"
@@ -17,16 +26,64 @@ class Book(models.Model):
     title = models.CharField(max_length=255)
     author = models.CharField(max_length=255)
     genre = models.CharField(max_length=100)
-    available = models.BooleanField(default=True)
+    branch = models.CharField(max_length=20, default=default_branch)
+    total_copies = models.PositiveIntegerField(default=1)
+    available_copies = models.PositiveIntegerField(default=1)
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         constraints = [
             models.UniqueConstraint(
-                fields=['title', 'author'],
-                name='unique_book_title_author'
-            )
+                fields=['branch', 'title', 'author'],
+                name='unique_book_branch_title_author'
+            ),
+            models.CheckConstraint(
+                condition=models.Q(available_copies__gte=0),
+                name='book_available_copies_non_negative'
+            ),
+            models.CheckConstraint(
+                condition=models.Q(available_copies__lte=F('total_copies')),
+                name='book_available_copies_lte_total'
+            ),
         ]
+        indexes = [
+            models.Index(fields=['available_copies'], name='book_available_copies_idx'),
+            models.Index(fields=['author'], name='book_author_idx'),
+            # The unique constraint leads with branch, so the admin's title
+            # prefix search needs an index of its own.
+            models.Index(fields=['title', 'author'], name='book_title_author_idx'),
+            models.Index(fields=['branch', 'created_at'], name='book_branch_created_idx'),
+            models.Index(fields=['branch', 'updated_at', 'id'], name='book_branch_updated_idx'),
+        ]
+
+    @property
+    def available(self):
+        return self.available_copies > 0
+
+    def check_out(self):
+        """
+        Take one copy off the shelf. Returns False if none was left.
+        """
+        updated = Book.objects.filter(pk=self.pk, available_copies__gt=0).update(
+            available_copies=F('available_copies') - 1, updated_at=timezone.now()
+        )
+        if updated:
+            self.available_copies -= 1
+            bump_availability_version()
+        return bool(updated)
+
+    def check_in(self):
+        """
+        Put one copy back on the shelf.
+        """
+        updated = Book.objects.filter(pk=self.pk, available_copies__lt=F('total_copies')).update(
+            available_copies=F('available_copies') + 1, updated_at=timezone.now()
+        )
+        if updated:
+            self.available_copies += 1
+            bump_availability_version()
+        return bool(updated)
 
     def clean(self):
         if not self.title.strip():
@@ -46,9 +103,11 @@ class Borrow(models.Model):
     due_date = models.DateField()
     returned = models.BooleanField(default=False)
     returned_at = models.DateTimeField(null=True, blank=True)
+    branch = models.CharField(max_length=20, default=default_branch)
+    # Overdue fine in cents, kept current by recalculate_fines and fixed on return.
+    fine_cents = models.PositiveIntegerField(default=0)
 
     class Meta:
-        unique_together = ['user', 'book', 'returned']
         constraints = [
             models.UniqueConstraint(
                 fields=['user', 'book'],
@@ -56,12 +115,239 @@ class Borrow(models.Model):
                 name='unique_active_borrow'
             )
         ]
+        indexes = [
+            models.Index(fields=['borrowed_at'], name='borrow_borrowed_at_idx'),
+            models.Index(fields=['returned_at'], name='borrow_returned_at_idx'),
+            models.Index(fields=['branch', 'borrowed_at'], name='borrow_branch_borrowed_idx'),
+            models.Index(fields=['user', 'branch', 'borrowed_at'], name='borrow_user_borrowed_idx'),
+            models.Index(
+                fields=['due_date', 'id'],
+                condition=models.Q(returned=False),
+                name='borrow_active_due_idx'
+            ),
+        ]
 
     def clean(self):
         if self.returned and not self.returned_at:
-            from django.utils import timezone
             self.returned_at = timezone.now()
 
     def __str__(self):
         status = "Returned" if self.returned else "Active"
         return f"{self.user.username} - {self.book.title} ({status})"
+
+class ArchivedBorrow(models.Model):
+    """
+    A returned borrow moved out of Borrow by archive_borrows, under its
+    original id, so the Borrow table and its indexes only cover recent
+    circulation.
+    """
+    id = models.BigIntegerField(primary_key=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='archived_borrows')
+    book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='archived_borrows')
+    borrowed_at = models.DateTimeField()
+    due_date = models.DateField()
+    returned = models.BooleanField(default=True)
+    returned_at = models.DateTimeField(null=True, blank=True)
+    branch = models.CharField(max_length=20, default=default_branch)
+    fine_cents = models.PositiveIntegerField(default=0)
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            # id is not the rowid here, so it is spelled out for the
+            # (borrowed_at, id) order history pages are read in.
+            models.Index(fields=['user', 'branch', 'borrowed_at', 'id'], name='archived_borrow_user_idx'),
+            models.Index(fields=['branch', 'borrowed_at', 'id'], name='archived_borrow_branch_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.user.username} - {self.book.title} (Archived)"
+
+class Hold(models.Model):
+    WAITING = 'waiting'
+    READY = 'ready'
+    FULFILLED = 'fulfilled'
+    CANCELLED = 'cancelled'
+    EXPIRED = 'expired'
+    STATUS_CHOICES = (
+        (WAITING, 'Waiting'),
+        (READY, 'Ready for pickup'),
+        (FULFILLED, 'Fulfilled'),
+        (CANCELLED, 'Cancelled'),
+        (EXPIRED, 'Expired'),
+    )
+    ACTIVE_STATUSES = (WAITING, READY)
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='holds')
+    book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='holds')
+    position = models.PositiveIntegerField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=WAITING)
+    created_at = models.DateTimeField(auto_now_add=True)
+    ready_at = models.DateTimeField(null=True, blank=True)
+    expires_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'book'],
+                condition=models.Q(status__in=['waiting', 'ready']),
+                name='unique_active_hold'
+            )
+        ]
+        indexes = [
+            models.Index(fields=['book', 'status', 'position'], name='hold_queue_idx'),
+            models.Index(fields=['status', 'expires_at'], name='hold_expiry_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.user.username} - {self.book.title} (#{self.position}, {self.status})"
+
+class BookPopularity(models.Model):
+    """
+    Exponentially decayed borrow count per book, stored relative to
+    PopularityEpoch so a borrow only has to add to one row.
+    """
+    book = models.OneToOneField(Book, on_delete=models.CASCADE, primary_key=True, related_name='popularity')
+    genre = models.CharField(max_length=100)
+    score = models.FloatField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-score'], name='popularity_score_idx'),
+            models.Index(fields=['genre', '-score'], name='popularity_genre_score_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.book_id}: {self.score:.3f}"
+
+class PopularityEpoch(models.Model):
+    epoch = models.DateTimeField()
+
+    def __str__(self):
+        return self.epoch.isoformat()
+
+class DailyBookStats(models.Model):
+    date = models.DateField()
+    book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='daily_stats')
+    branch = models.CharField(max_length=20, default=default_branch)
+    borrows = models.PositiveIntegerField(default=0)
+    returns = models.PositiveIntegerField(default=0)
+    overdues = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['book', 'date'], name='unique_daily_book_stats')
+        ]
+
+    def __str__(self):
+        return f"{self.date} book {self.book_id}"
+
+class DailyGenreStats(models.Model):
+    date = models.DateField()
+    genre = models.CharField(max_length=100)
+    branch = models.CharField(max_length=20, default=default_branch)
+    borrows = models.PositiveIntegerField(default=0)
+    returns = models.PositiveIntegerField(default=0)
+    overdues = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['branch', 'genre', 'date'], name='unique_daily_branch_genre_stats')
+        ]
+        indexes = [
+            models.Index(fields=['date'], name='daily_genre_stats_date_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.date} {self.genre}"
+
+class RollupWatermark(models.Model):
+    name = models.CharField(max_length=50, primary_key=True)
+    value = models.CharField(max_length=50)
+
+    def __str__(self):
+        return f"{self.name} = {self.value}"
+
+class BookTombstone(models.Model):
+    """
+    Marks a deleted book so catalog mirrors syncing through
+    /api/books/changes/ learn to drop it.
+    """
+    book_id = models.BigIntegerField()
+    branch = models.CharField(max_length=20, default=default_branch)
+    deleted_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['branch', 'deleted_at'], name='book_tombstone_branch_idx'),
+        ]
+
+    def __str__(self):
+        return f"Book {self.book_id} deleted {self.deleted_at:%Y-%m-%d %H:%M}"
+
+class BookTrigram(models.Model):
+    """
+    One row per distinct trigram of a book's normalized title and author,
+    used to find fuzzy-search candidates without scanning Book.
+    """
+    book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='trigrams')
+    trigram = models.CharField(max_length=3)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['trigram', 'book'], name='unique_book_trigram')
+        ]
+
+    def __str__(self):
+        return f"{self.book_id}: {self.trigram!r}"
+
+class Event(models.Model):
+    """
+    Append-only change log, written in the same transaction as the change it
+    describes. The id doubles as the feed cursor.
+    """
+    BOOK_CREATED = 'book.created'
+    BOOK_UPDATED = 'book.updated'
+    BOOK_DELETED = 'book.deleted'
+    BORROW_CREATED = 'borrow.created'
+    BORROW_RETURNED = 'borrow.returned'
+
+    kind = models.CharField(max_length=30)
+    object_id = models.BigIntegerField()
+    payload = models.JSONField(default=dict)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"#{self.pk} {self.kind} {self.object_id}"
+
+class Job(models.Model):
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    )
+
+    kind = models.CharField(max_length=50)
+    payload = models.JSONField(default=dict)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED)
+    run_at = models.DateTimeField()
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    unique_key = models.CharField(max_length=100, null=True, blank=True, unique=True)
+    locked_by = models.CharField(max_length=100, blank=True)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'run_at'], name='job_claim_idx'),
+        ]
+
+    def __str__(self):
+        return f"#{self.pk} {self.kind} ({self.status})"
@@ -0,0 +1,236 @@
+"""
+"Borrowed together" recommendations.
+
+Co-occurrence counts (how many patrons borrowed both book A and book B) are
+built offline from borrow history (archive included) and stored as a CSR matrix in plain .npy
+files, so API workers can memory-map them and answer lookups with a binary
+search and an array slice. Rows are keyed by book id and each row is sorted
+by count, most borrowed-together first.
+"""
+import json
+import os
+import shutil
+import threading
+import time
+
+import numpy as np
+from django.conf import settings
+from django.utils import timezone
+
+from .archive import borrow_history
+
+_PAIR_DTYPE = [('user', np.int64), ('book', np.int64)]
+_ARRAYS = ('book_ids', 'indptr', 'indices', 'counts')
+
+
+def get_recommendations_dir():
+    return settings.RECOMMENDATIONS_DIR
+
+
+def _borrow_pairs(queryset):
+    pairs = np.fromiter(queryset.values_list('user_id', 'book_id').iterator(chunk_size=10000), dtype=_PAIR_DTYPE)
+    return np.unique(pairs)
+
+
+def _pair_counts(pairs):
+    """
+    Count, for every ordered pair of distinct books, how many users in
+    ``pairs`` (distinct (user, book) records) borrowed both. Returns
+    (rows, cols, counts) in COO form.
+    """
+    if len(pairs) == 0:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty, empty
+
+    pairs = np.sort(pairs, order=('user', 'book'))
+    _, starts, sizes = np.unique(pairs['user'], return_index=True, return_counts=True)
+
+    # Every book in a user's history is paired with every book in that
+    # history: repeat each element once per book the user borrowed, then
+    # walk the user's block for the right-hand side.
+    per_element_size = np.repeat(sizes, sizes)
+    per_element_start = np.repeat(starts, sizes)
+    left = np.repeat(pairs['book'], per_element_size)
+    block_starts = np.repeat(per_element_start, per_element_size)
+    offsets = np.arange(len(left)) - np.repeat(np.cumsum(per_element_size) - per_element_size, per_element_size)
+    right = pairs['book'][block_starts + offsets]
+
+    distinct = left != right
+    return _sum_duplicates(left[distinct], right[distinct], np.ones(distinct.sum(), dtype=np.int64))
+
+
+def _sum_duplicates(rows, cols, counts):
+    if len(rows) == 0:
+        return rows, cols, counts
+    keys = np.stack([rows, cols], axis=1)
+    unique_keys, inverse = np.unique(keys, axis=0, return_inverse=True)
+    summed = np.bincount(inverse.ravel(), weights=counts, minlength=len(unique_keys)).astype(np.int64)
+    keep = summed != 0
+    return unique_keys[keep, 0], unique_keys[keep, 1], summed[keep]
+
+
+def _to_csr(rows, cols, counts):
+    # Row-major, then highest count first within a row.
+    order = np.lexsort((cols, -counts, rows))
+    rows, cols, counts = rows[order], cols[order], counts[order]
+    book_ids, row_sizes = np.unique(rows, return_counts=True)
+    indptr = np.zeros(len(book_ids) + 1, dtype=np.int64)
+    np.cumsum(row_sizes, out=indptr[1:])
+    return {
+        'book_ids': book_ids.astype(np.int64),
+        'indptr': indptr,
+        'indices': cols.astype(np.int64),
+        'counts': counts.astype(np.int32),
+    }
+
+
+def _from_csr(arrays):
+    rows = np.repeat(arrays['book_ids'], np.diff(arrays['indptr']))
+    return rows, np.asarray(arrays['indices']), np.asarray(arrays['counts'], dtype=np.int64)
+
+
+def _current_version_dir(base_dir):
+    try:
+        with open(os.path.join(base_dir, 'CURRENT')) as current:
+            name = current.read().strip()
+    except FileNotFoundError:
+        return None
+    return os.path.join(base_dir, name) if name else None
+
+
+def _read_matrix(version_dir, mmap_mode='r'):
+    arrays = {
+        name: np.load(os.path.join(version_dir, f'{name}.npy'), mmap_mode=mmap_mode)
+        for name in _ARRAYS
+    }
+    with open(os.path.join(version_dir, 'meta.json')) as meta_file:
+        meta = json.load(meta_file)
+    return arrays, meta
+
+
+def _write_matrix(base_dir, arrays, meta):
+    os.makedirs(base_dir, exist_ok=True)
+    name = f'v{time.time_ns()}'
+    version_dir = os.path.join(base_dir, name)
+    os.makedirs(version_dir)
+    for array_name in _ARRAYS:
+        np.save(os.path.join(version_dir, f'{array_name}.npy'), arrays[array_name])
+    with open(os.path.join(version_dir, 'meta.json'), 'w') as meta_file:
+        json.dump(meta, meta_file)
+
+    previous = _current_version_dir(base_dir)
+    pointer = os.path.join(base_dir, 'CURRENT.tmp')
+    with open(pointer, 'w') as current:
+        current.write(name)
+    os.replace(pointer, os.path.join(base_dir, 'CURRENT'))
+
+    # Workers that still have the previous version mapped keep reading it
+    # until they reload; the files stay valid on POSIX after unlinking.
+    if previous and os.path.isdir(previous):
+        shutil.rmtree(previous, ignore_errors=True)
+    return version_dir
+
+
+def build_cooccurrence(full=False, base_dir=None):
+    """
+    Refresh the co-occurrence matrix from borrows added since the last
+    run, or rebuild it from scratch with ``full=True``. Only the histories
+    of patrons with new borrows are re-read. Returns the stored metadata.
+    """
+    base_dir = base_dir or get_recommendations_dir()
+    version_dir = None if full else _current_version_dir(base_dir)
+    history = borrow_history()
+    watermark = max(
+        queryset.order_by('-pk').values_list('pk', flat=True).first() or 0
+        for queryset in (history.hot, history.cold)
+    )
+
+    if version_dir is None:
+        rows, cols, counts = _pair_counts(_borrow_pairs(history.filter(pk__lte=watermark)))
+    else:
+        arrays, meta = _read_matrix(version_dir, mmap_mode=None)
+        previous_watermark = meta['watermark']
+        if watermark <= previous_watermark:
+            return meta
+
+        new_borrows = history.filter(pk__gt=previous_watermark, pk__lte=watermark)
+        affected = history.filter(user_id__in=set(new_borrows.values_list('user_id', flat=True).iterator()))
+        after = _pair_counts(_borrow_pairs(affected.filter(pk__lte=watermark)))
+        before = _pair_counts(_borrow_pairs(affected.filter(pk__lte=previous_watermark)))
+        old_rows, old_cols, old_counts = _from_csr(arrays)
+        rows, cols, counts = _sum_duplicates(
+            np.concatenate([old_rows, after[0], before[0]]),
+            np.concatenate([old_cols, after[1], before[1]]),
+            np.concatenate([old_counts, after[2], -before[2]]),
+        )
+
+    meta = {
+        'watermark': watermark,
+        'built_at': timezone.now().isoformat(),
+        'books': int(len(np.unique(rows))),
+        'pairs': int(len(rows)),
+    }
+    _write_matrix(base_dir, _to_csr(rows, cols, counts), meta)
+    return meta
+
+
+class CooccurrenceIndex:
+    """
+    Read-only, memory-mapped view of the latest co-occurrence matrix.
+    """
+
+    def __init__(self, version_dir):
+        self.version_dir = version_dir
+        self.arrays, self.meta = _read_matrix(version_dir)
+
+    def related(self, book_id, limit=10):
+        book_ids = self.arrays['book_ids']
+        row = np.searchsorted(book_ids, book_id)
+        if row >= len(book_ids) or book_ids[row] != book_id:
+            return []
+        start, end = self.arrays['indptr'][row], self.arrays['indptr'][row + 1]
+        end = min(end, start + limit)
+        return list(zip(
+            self.arrays['indices'][start:end].tolist(),
+            self.arrays['counts'][start:end].tolist(),
+        ))
+
+
+_index = None
+_index_checked_at = 0.0
+_index_lock = threading.Lock()
+
+
+def get_index():
+    """
+    Return the process-wide index, re-reading the CURRENT pointer at most
+    every RECOMMENDATIONS_RELOAD_SECONDS so workers pick up new builds.
+    """
+    global _index, _index_checked_at
+
+    now = time.monotonic()
+    if now - _index_checked_at < getattr(settings, 'RECOMMENDATIONS_RELOAD_SECONDS', 30):
+        return _index
+
+    with _index_lock:
+        _index_checked_at = now
+        version_dir = _current_version_dir(get_recommendations_dir())
+        if version_dir is None:
+            _index = None
+        elif _index is None or _index.version_dir != version_dir:
+            try:
+                _index = CooccurrenceIndex(version_dir)
+            except FileNotFoundError:
+                pass
+    return _index
+
+
+def related_books(book_id, limit=10):
+    """
+    Return [(book_id, count), ...] of books most often borrowed by the same
+    patrons as ``book_id``.
+    """
+    index = get_index()
+    if index is None:
+        return []
+    return index.related(book_id, limit)
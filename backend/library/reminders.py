@@ -0,0 +1,60 @@
+"""
+"Due tomorrow" and overdue notices, sent by the job queue.
+
+One reminders.send job covers one day. It walks open borrows that are due
+tomorrow or already overdue in primary-key batches over the partial
+borrow_active_due_idx index, and queues a follow-up job for the next batch
+until it runs out. The last batch schedules the next day's run. Mail goes
+through Django's email backend, a file outbox by default.
+"""
+from datetime import date, datetime, time, timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db.models import Q
+from django.utils import timezone
+
+from .jobs import enqueue
+from .models import Borrow
+
+JOB_KIND = 'reminders.send'
+
+
+def schedule_reminders(day):
+    send_at = timezone.make_aware(datetime.combine(day, time(getattr(settings, 'REMINDER_SEND_HOUR', 8))))
+    return enqueue(JOB_KIND, {'date': day.isoformat()}, run_at=send_at, unique_key=f'reminders:{day.isoformat()}')
+
+
+def _message(borrow, day):
+    if borrow.due_date < day:
+        days = (day - borrow.due_date).days
+        subject = f'Overdue: {borrow.book.title}'
+        body = f'"{borrow.book.title}" was due on {borrow.due_date} and is {days} days overdue. Please return it.'
+    else:
+        subject = f'Due tomorrow: {borrow.book.title}'
+        body = f'"{borrow.book.title}" is due back tomorrow, {borrow.due_date}.'
+    return EmailMessage(subject, f'Hi {borrow.user.username},\n\n{body}\n', to=[borrow.user.email])
+
+
+def send_reminders(payload):
+    day = date.fromisoformat(payload['date'])
+    after = payload.get('after', 0)
+    batch_size = getattr(settings, 'REMINDER_BATCH_SIZE', 500)
+
+    borrows = list(
+        Borrow.objects.filter(returned=False, pk__gt=after)
+        .filter(Q(due_date=day + timedelta(days=1)) | Q(due_date__lt=day))
+        .select_related('user', 'book')
+        .order_by('pk')[:batch_size]
+    )
+    messages = [_message(borrow, day) for borrow in borrows if borrow.user.email]
+    if messages:
+        with get_connection() as connection:
+            connection.send_messages(messages)
+
+    if len(borrows) == batch_size:
+        last = borrows[-1].pk
+        enqueue(JOB_KIND, {'date': day.isoformat(), 'after': last}, unique_key=f'reminders:{day.isoformat()}:{last}')
+    else:
+        schedule_reminders(day + timedelta(days=1))
+    return len(messages)
@@ -0,0 +1,249 @@
+import random
+import time
+from contextlib import ContextDecorator, contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.utils.functional import SimpleLazyObject, empty
+
+PRIMARY_DB = 'default'
+
+# Library models that are not kept per branch: accounts and the job queue.
+GLOBAL_MODELS = {'user', 'job'}
+
+_request_state = ContextVar('library_db_request_state', default=None)
+_current_branch = ContextVar('library_branch', default=None)
+_migrating_database = ContextVar('library_migrating_database', default=None)
+
+
+class _RequestState:
+    def __init__(self, request, pinned, replica=None):
+        self.request = request
+        self.pinned = pinned
+        # Picked once per request, so all of its reads see the same lag.
+        self.replica = replica
+        self.wrote = False
+        self.lag_checked = False
+
+
+def _pin_cache_key(user_id):
+    return f'library:replica-pin:{user_id}'
+
+
+def _resolved_user(request):
+    # Never force a lazy session user here: resolving it would itself read
+    # from the database and re-enter the router.
+    user = getattr(request, 'user', None)
+    if isinstance(user, SimpleLazyObject):
+        if user._wrapped is empty:
+            return None
+        user = user._wrapped
+    return user
+
+
+def get_replica_aliases():
+    return list(getattr(settings, 'DATABASE_REPLICAS', []))
+
+
+def pin_to_primary():
+    """
+    Force every remaining query of the current request onto the primary.
+    """
+    state = _request_state.get()
+    if state is not None:
+        state.pinned = True
+
+
+def record_user_write(user_id):
+    """
+    Remember that a user just wrote, so their reads skip the replicas
+    until the lag window has passed, whichever worker serves them.
+    """
+    window = getattr(settings, 'REPLICA_LAG_WINDOW', 5)
+    if window > 0:
+        caches['shared'].set(_pin_cache_key(user_id), time.time(), window)
+
+
+def user_recently_wrote(user_id):
+    return caches['shared'].get(_pin_cache_key(user_id)) is not None
+
+
+class PrimaryReplicaRouter:
+    """
+    Send reads from safe-method requests to a replica and everything else to
+    the primary. A request that writes is pinned to the primary for the rest
+    of its life, and so is any request from a user who wrote within
+    REPLICA_LAG_WINDOW seconds. Reads outside a request (management
+    commands, shells) always use the primary.
+    """
+
+    def db_for_read(self, model, **hints):
+        replicas = get_replica_aliases()
+        state = _request_state.get()
+        if not replicas or state is None or state.pinned:
+            return PRIMARY_DB
+
+        if not state.lag_checked:
+            user = _resolved_user(state.request)
+            if user is not None and user.is_authenticated:
+                state.lag_checked = True
+                if user_recently_wrote(user.pk):
+                    state.pinned = True
+                    return PRIMARY_DB
+
+        return state.replica if state.replica in replicas else random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        state = _request_state.get()
+        if state is not None:
+            state.pinned = True
+            state.wrote = True
+        return PRIMARY_DB
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {PRIMARY_DB, *get_replica_aliases()}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db in get_replica_aliases():
+            return False
+        return None
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Tracks the routing state of each request for PrimaryReplicaRouter.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        replicas = get_replica_aliases()
+        state = _RequestState(
+            request,
+            pinned=request.method not in ('GET', 'HEAD', 'OPTIONS'),
+            replica=random.choice(replicas) if replicas else None,
+        )
+        token = _request_state.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            _request_state.reset(token)
+
+        user = _resolved_user(request)
+        if state.wrote and user is not None and user.is_authenticated:
+            record_user_write(user.pk)
+        return response
+
+
+def get_branches():
+    return settings.LIBRARY_BRANCHES
+
+
+def current_branch():
+    return _current_branch.get() or settings.DEFAULT_BRANCH
+
+
+def branch_database(code=None):
+    return get_branches()[code or current_branch()]['database']
+
+
+def branch_only_databases():
+    """
+    Databases that hold branch data but are not the primary.
+    """
+    return sorted({branch['database'] for branch in get_branches().values()} - {PRIMARY_DB})
+
+
+def activate_branch(code):
+    """
+    Make ``code`` the current branch. Returns a token for
+    ``deactivate_branch``.
+    """
+    if code not in get_branches():
+        raise KeyError(code)
+    return _current_branch.set(code)
+
+
+def deactivate_branch(token):
+    _current_branch.reset(token)
+
+
+@contextmanager
+def using_branch(code):
+    token = activate_branch(code)
+    try:
+        yield
+    finally:
+        deactivate_branch(token)
+
+
+class branch_atomic(ContextDecorator):
+    """
+    ``transaction.atomic()`` on the current branch's database, picked when
+    the block is entered. Works as a decorator or a context manager.
+    """
+
+    def _recreate_cm(self):
+        return type(self)()
+
+    def __enter__(self):
+        self.atomic = transaction.atomic(using=branch_database())
+        return self.atomic.__enter__()
+
+    def __exit__(self, *exc_info):
+        return self.atomic.__exit__(*exc_info)
+
+
+def set_migrating_database(alias):
+    """
+    Send every query to ``alias`` while ``migrate`` runs on it, or stop
+    doing so with None.
+    """
+    _migrating_database.set(alias)
+
+
+def is_branch_model(model):
+    return model._meta.app_label == 'library' and model._meta.model_name not in GLOBAL_MODELS
+
+
+class BranchRouter:
+    """
+    Keeps each branch's catalog and circulation in that branch's database.
+    Objects stay on the database they were loaded from; new queries use the
+    current branch (see ``using_branch``). Branches stored in the primary
+    database are left to the routers that follow. Branch databases carry
+    the full schema, with accounts mirrored from the primary so joins and
+    foreign keys to User keep working. While ``migrate`` runs, data
+    migrations use the database being migrated.
+    """
+
+    def _route(self, model, **hints):
+        migrating = _migrating_database.get()
+        if migrating is not None:
+            return migrating
+        if not is_branch_model(model):
+            return None
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db in branch_only_databases():
+            return instance._state.db
+        database = branch_database()
+        return None if database == PRIMARY_DB else database
+
+    db_for_read = _route
+    db_for_write = _route
+
+    def allow_relation(self, obj1, obj2, **hints):
+        branch1, branch2 = is_branch_model(type(obj1)), is_branch_model(type(obj2))
+        branch_only = branch_only_databases()
+        if branch1 and branch2 and {obj1._state.db, obj2._state.db} & set(branch_only):
+            return obj1._state.db == obj2._state.db
+        if branch1 != branch2:
+            # Accounts live in the primary and are mirrored to every branch.
+            return True
+        return None
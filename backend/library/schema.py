@@ -0,0 +1,86 @@
+"""
+OpenAPI schema for the API.
+
+Generating the schema introspects every viewset and serializer, so it is
+not done per request. ``build_schema`` writes it to API_SCHEMA_PATH when
+the app is deployed and /swagger.json serves those bytes as they are. If
+no file has been built, the first request generates the schema and the
+process keeps it.
+"""
+import os
+import threading
+
+from django.conf import settings
+from django.http import HttpResponse
+
+# drf_yasg (and the jsonschema validator it pulls in) is only imported when
+# the schema is generated or the Swagger UI is routed, so API workers that
+# serve the prebuilt file never load it.
+
+
+def _info():
+    from drf_yasg import openapi
+
+    return openapi.Info(
+        title="Library API",
+        default_version='v1',
+        description="API documentation for Library Management System",
+    )
+
+
+def swagger_ui_view(cache_timeout):
+    from drf_yasg.views import get_schema_view
+    from rest_framework import permissions
+
+    schema_view = get_schema_view(
+        _info(),
+        public=True,
+        permission_classes=(permissions.AllowAny,),
+    )
+    return schema_view.with_ui('swagger', cache_timeout=cache_timeout)
+
+
+_schema_json = None
+_schema_lock = threading.Lock()
+
+
+def generate_schema_json():
+    from drf_yasg.codecs import OpenAPICodecJson
+    from drf_yasg.generators import OpenAPISchemaGenerator
+
+    schema = OpenAPISchemaGenerator(_info()).get_schema(request=None, public=True)
+    return OpenAPICodecJson(validators=[]).encode(schema)
+
+
+def write_schema(path=None):
+    """
+    Generate the schema and write it to ``path`` (API_SCHEMA_PATH by
+    default). Returns the path written.
+    """
+    path = path or settings.API_SCHEMA_PATH
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    partial = f'{path}.tmp'
+    with open(partial, 'wb') as schema_file:
+        schema_file.write(generate_schema_json())
+    os.replace(partial, path)
+    return path
+
+
+def get_schema_json():
+    global _schema_json
+
+    if _schema_json is None:
+        with _schema_lock:
+            if _schema_json is None:
+                try:
+                    with open(settings.API_SCHEMA_PATH, 'rb') as schema_file:
+                        _schema_json = schema_file.read()
+                except FileNotFoundError:
+                    _schema_json = generate_schema_json()
+    return _schema_json
+
+
+def schema_json(request):
+    response = HttpResponse(get_schema_json(), content_type='application/json')
+    response['Cache-Control'] = f"public, max-age={getattr(settings, 'SCHEMA_CACHE_SECONDS', 3600)}"
+    return response
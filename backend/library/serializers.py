@@ -1,7 +1,109 @@
 from rest_framework import serializers
 from django.contrib.auth.password_validation import validate_password
 from django.core.exceptions import ValidationError as DjangoValidationError
-from .models import User, Book, Borrow
+from django.db import IntegrityError
+from django.db.models import F
+from django.utils import timezone
+from .caching import bump_catalog_version
+from .events import record_book_event
+from .models import User, Book, Borrow, Event, Hold
+from .routers import branch_atomic, current_branch, get_branches
+
+class SparseFieldsetMixin:
+    """
+    Lets GET requests trim the representation with ``?fields=a,b`` or
+    ``?omit=c``. ``field_sources`` lists the model columns read by fields
+    that are not plain columns themselves, so views can pass the same
+    selection to ``.only()``; ``row_sources`` gives such fields a column and
+    a converter for the ``values_list()`` fast path.
+    """
+    field_sources = {}
+    row_sources = {}
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        request = self.context.get('request')
+        selected = self.selected_fields(request, self.fields.keys())
+        if selected is not None:
+            for name in list(self.fields):
+                if name not in selected:
+                    self.fields.pop(name)
+
+    @staticmethod
+    def selected_fields(request, names):
+        if request is None or request.method != 'GET':
+            return None
+        params = request.query_params
+        if 'fields' not in params and 'omit' not in params:
+            return None
+
+        selected = list(names)
+        if params.get('fields'):
+            wanted = {name.strip() for name in params['fields'].split(',')}
+            selected = [name for name in selected if name in wanted]
+        if params.get('omit'):
+            unwanted = {name.strip() for name in params['omit'].split(',')}
+            selected = [name for name in selected if name not in unwanted]
+        return selected
+
+    @classmethod
+    def only_for(cls, request):
+        """
+        Model paths the selected fields read, for ``QuerySet.only()``, or
+        None when the request renders every field.
+        """
+        if cls.selected_fields(request, ()) is None:
+            return None
+
+        serializer = cls(context={'request': request})
+
+        paths = {'pk'}
+        for name, field in serializer.fields.items():
+            if name in cls.field_sources:
+                paths.update(cls.field_sources[name])
+            elif field.source != '*':
+                path = field.source.replace('.', '__')
+                paths.add(path)
+                if '__' in path:
+                    paths.add(path.split('__')[0])
+        return sorted(paths)
+
+    @classmethod
+    def row_builder(cls, request):
+        """
+        Columns for ``values_list()`` and a function that turns those tuples
+        into the same dicts ``to_representation`` returns, for read-only
+        listings that skip model instances and per-field lookups.
+        """
+        serializer = cls(context={'request': request})
+
+        names, columns, converters = [], [], []
+        for name, field in serializer.fields.items():
+            if field.write_only:
+                continue
+            if name in cls.row_sources:
+                column, convert = cls.row_sources[name]
+            else:
+                column = field.source.replace('.', '__')
+                convert = None
+                if isinstance(field, (serializers.DateField, serializers.DateTimeField)):
+                    convert = field.to_representation
+            names.append(name)
+            columns.append(column)
+            if convert is not None:
+                converters.append((name, convert))
+
+        def build(rows):
+            data = []
+            for row in rows:
+                item = dict(zip(names, row))
+                for name, convert in converters:
+                    if item[name] is not None:
+                        item[name] = convert(item[name])
+                data.append(item)
+            return data
+
+        return columns, build
 
 class RegisterSerializer(serializers.ModelSerializer):
     password = serializers.CharField(write_only=True, min_length=6)
@@ -9,7 +111,7 @@ class RegisterSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = User
-        fields = ['username', 'email', 'password', 'role']
+        fields = ['username', 'email', 'password', 'role', 'home_branch']
 
     def validate_password(self, value):
         validate_password(value)
@@ -20,6 +122,11 @@ class RegisterSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError("Email already exists")
         return value
 
+    def validate_home_branch(self, value):
+        if value not in get_branches():
+            raise serializers.ValidationError("Unknown branch")
+        return value
+
     def validate_username(self, value):
         if len(value) < 3:
             raise serializers.ValidationError("Username must be at least 3 characters")
@@ -30,15 +137,61 @@ class RegisterSerializer(serializers.ModelSerializer):
             username=validated_data['username'],
             email=validated_data['email'],
             password=validated_data['password'],
-            role=validated_data.get('role', 'user')
+            role=validated_data.get('role', 'user'),
+            home_branch=validated_data.get('home_branch', current_branch())
         )
         return user
 
-class BookSerializer(serializers.ModelSerializer):
+class BookSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
+    available = serializers.BooleanField(read_only=True)
+    field_sources = {'available': ['available_copies']}
+    row_sources = {'available': ('available_copies', bool)}
+
     class Meta:
         model = Book
         fields = '__all__'
-        read_only_fields = ['created_at']
+        read_only_fields = ['branch', 'available_copies', 'created_at', 'updated_at']
+
+    def validate_total_copies(self, value):
+        if value < 1:
+            raise serializers.ValidationError("A book needs at least one copy")
+        return value
+
+    def create(self, validated_data):
+        validated_data['available_copies'] = validated_data.get('total_copies', 1)
+        return super().create(validated_data)
+
+    def update(self, instance, validated_data):
+        total_copies = validated_data.pop('total_copies', None)
+        copies_changed = total_copies is not None and total_copies != instance.total_copies
+
+        with branch_atomic():
+            if copies_changed:
+                delta = total_copies - instance.total_copies
+                try:
+                    with branch_atomic():
+                        Book.objects.filter(pk=instance.pk).update(
+                            total_copies=F('total_copies') + delta,
+                            available_copies=F('available_copies') + delta,
+                            updated_at=timezone.now()
+                        )
+                except IntegrityError:
+                    raise serializers.ValidationError(
+                        {'total_copies': "Cannot remove copies that are currently on loan"}
+                    )
+                # The counters changed without a save signal.
+                bump_catalog_version()
+
+            instance.refresh_from_db(fields=['total_copies', 'available_copies', 'updated_at'])
+            for attr, value in validated_data.items():
+                setattr(instance, attr, value)
+            if validated_data:
+                instance.save(update_fields=[*validated_data, 'updated_at'])
+            elif copies_changed:
+                # Nothing else changed, so no save signal will log this.
+                record_book_event(Event.BOOK_UPDATED, instance)
+
+        return instance
 
     def validate_title(self, value):
         if not value.strip():
@@ -46,6 +199,7 @@ class BookSerializer(serializers.ModelSerializer):
         
         if self.instance is None:
             if Book.objects.filter(
+                branch=current_branch(),
                 title__iexact=value.strip(),
                 author__iexact=self.initial_data.get('author', '').strip()
             ).exists():
@@ -62,7 +216,7 @@ class BookSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError("Genre cannot be empty")
         return value.strip()
 
-class BorrowSerializer(serializers.ModelSerializer):
+class BorrowSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     book_title = serializers.CharField(source='book.title', read_only=True)
     book_author = serializers.CharField(source='book.author', read_only=True)
     user_username = serializers.CharField(source='user.username', read_only=True)
@@ -70,16 +224,61 @@ class BorrowSerializer(serializers.ModelSerializer):
     class Meta:
         model = Borrow
         fields = '__all__'
-        read_only_fields = ['user', 'borrowed_at', 'returned_at']
+        read_only_fields = ['user', 'branch', 'borrowed_at', 'returned_at', 'fine_cents']
 
     def validate(self, data):
+        if self.instance is not None:
+            # Inventory counters follow the loan's book and returned flag,
+            # so those only change through borrowing and the return action.
+            if 'book' in data and data['book'] != self.instance.book:
+                raise serializers.ValidationError("The book of a loan cannot be changed")
+            if 'returned' in data and data['returned'] != self.instance.returned:
+                raise serializers.ValidationError("Return books with POST /api/borrows/{id}/return/")
+            return data
+
         book = data.get('book')
         user = self.context['request'].user
         
-        if not book.available:
+        if book.branch != current_branch():
+            raise serializers.ValidationError("Book belongs to another branch")
+        
+        if not book.available and not Hold.objects.filter(
+            user=user, book=book, status=Hold.READY
+        ).exists():
             raise serializers.ValidationError("Book is not available")
         
         if Borrow.objects.filter(user=user, book=book, returned=False).exists():
             raise serializers.ValidationError("You have already borrowed this book")
         
-        return data
\ No newline at end of file
+        return data
+
+class HoldSerializer(serializers.ModelSerializer):
+    book_title = serializers.CharField(source='book.title', read_only=True)
+    user_username = serializers.CharField(source='user.username', read_only=True)
+
+    class Meta:
+        model = Hold
+        fields = '__all__'
+        read_only_fields = ['user', 'position', 'status', 'created_at', 'ready_at', 'expires_at']
+
+    def validate_book(self, book):
+        user = self.context['request'].user
+
+        if book.branch != current_branch():
+            raise serializers.ValidationError("Book belongs to another branch")
+
+        if book.available:
+            raise serializers.ValidationError("Book is available, borrow it instead")
+
+        if Borrow.objects.filter(user=user, book=book, returned=False).exists():
+            raise serializers.ValidationError("You have already borrowed this book")
+
+        if Hold.objects.filter(user=user, book=book, status__in=Hold.ACTIVE_STATUSES).exists():
+            raise serializers.ValidationError("You already have a hold on this book")
+
+        return book
+
+class EventSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Event
+        fields = ['id', 'kind', 'object_id', 'payload', 'created_at']
@@ -0,0 +1,107 @@
+from django.db.models.signals import post_delete, post_migrate, post_save, pre_migrate, pre_save
+from django.dispatch import receiver
+
+from .caching import bump_catalog_version
+from .events import record_book_event
+from .fuzzy import index_book
+from .models import Book, BookTombstone, Event, User
+from .routers import PRIMARY_DB, branch_only_databases, set_migrating_database
+from .suggest import loaded_index
+
+
+@receiver(post_save, sender=Book)
+@receiver(post_delete, sender=Book)
+def book_changed(sender, instance, **kwargs):
+    bump_catalog_version()
+
+
+@receiver(pre_save, sender=Book)
+def remember_suggest_keys(sender, instance, **kwargs):
+    if instance.pk is not None and loaded_index(instance.branch) is not None:
+        instance._suggest_previous = (
+            Book.objects.filter(pk=instance.pk).values_list('title', 'author').first()
+        )
+
+
+@receiver(post_save, sender=Book)
+def update_suggest_index(sender, instance, using, **kwargs):
+    index = loaded_index(instance.branch)
+    if index is None:
+        return
+
+    previous = getattr(instance, '_suggest_previous', None)
+    if previous == (instance.title, instance.author):
+        return
+    if previous is not None:
+        title, author = previous
+        index.remove_book(instance.pk, title, author, not _has_books_by(using, instance.branch, author))
+    index.add_book(instance.pk, instance.title, instance.author)
+
+
+@receiver(post_delete, sender=Book)
+def remove_from_suggest_index(sender, instance, using, **kwargs):
+    index = loaded_index(instance.branch)
+    if index is not None:
+        index.remove_book(
+            instance.pk, instance.title, instance.author,
+            not _has_books_by(using, instance.branch, instance.author)
+        )
+
+
+def _has_books_by(using, branch, author):
+    return Book.objects.using(using).filter(branch=branch, author=author).exists()
+
+
+@receiver(post_save, sender=Book)
+def update_trigram_index(sender, instance, update_fields=None, **kwargs):
+    if update_fields is None or {'title', 'author'} & set(update_fields):
+        index_book(instance)
+
+
+@receiver(post_save, sender=Book)
+def record_book_saved(sender, instance, created, **kwargs):
+    record_book_event(Event.BOOK_CREATED if created else Event.BOOK_UPDATED, instance)
+
+
+@receiver(post_delete, sender=Book)
+def record_book_deleted(sender, instance, **kwargs):
+    record_book_event(Event.BOOK_DELETED, instance)
+
+
+@receiver(post_delete, sender=Book)
+def leave_tombstone(sender, instance, using, **kwargs):
+    BookTombstone.objects.using(using).create(book_id=instance.pk, branch=instance.branch)
+
+
+@receiver(post_save, sender=User)
+def mirror_user(sender, instance, using, raw=False, **kwargs):
+    """
+    Copy accounts into every branch database, where borrows and holds
+    reference them.
+    """
+    if raw or using != PRIMARY_DB:
+        return
+    values = {
+        field.attname: getattr(instance, field.attname)
+        for field in User._meta.concrete_fields if not field.primary_key
+    }
+    for database in branch_only_databases():
+        User.objects.using(database).update_or_create(pk=instance.pk, defaults=values)
+
+
+@receiver(post_delete, sender=User)
+def remove_mirrored_user(sender, instance, using, **kwargs):
+    if using != PRIMARY_DB:
+        return
+    for database in branch_only_databases():
+        User.objects.using(database).filter(pk=instance.pk).delete()
+
+
+@receiver(pre_migrate)
+def route_data_migrations(sender, using, **kwargs):
+    set_migrating_database(using)
+
+
+@receiver(post_migrate)
+def stop_routing_data_migrations(sender, **kwargs):
+    set_migrating_database(None)
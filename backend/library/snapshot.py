@@ -0,0 +1,133 @@
+"""
+Online SQLite snapshots.
+
+backup_database() copies a live SQLite database with the online backup
+API, a few pages per step, pausing between steps so API writers get the
+lock in between. A write from another connection makes SQLite restart
+the copy, and a copy that keeps restarting is finished in one locked
+step; either way it is of one committed state. dump_snapshot()
+then writes the catalog, circulation and accounts of that copy as JSON
+Lines (Django's ``jsonl`` serialization, so ``loaddata`` can read it),
+streaming rows with iterator() and never touching the live database.
+"""
+import gzip
+import os
+import shutil
+import sqlite3
+import time
+import uuid
+from contextlib import contextmanager
+
+from django.core import serializers
+from django.db import connections
+from django.db.utils import load_backend
+
+from .models import ArchivedBorrow, Book, Borrow, User
+
+# Accounts first, so a loaddata of the dump satisfies foreign keys.
+DUMP_MODELS = (User, Book, Borrow, ArchivedBorrow)
+
+
+def _source_connection(alias):
+    name = str(connections[alias].settings_dict['NAME'])
+    if name.startswith('file:'):
+        return sqlite3.connect(name, uri=True)
+    return sqlite3.connect(f'file:{name}?mode=ro', uri=True)
+
+
+class _TooManyRestarts(Exception):
+    pass
+
+
+def backup_database(alias, target, pages=1024, pause=0.005, max_restarts=10, progress=None):
+    """
+    Copy database ``alias`` to the file ``target``. ``progress(copied,
+    total)`` is called after every step. After ``max_restarts`` restarts
+    caused by concurrent writes, the rest is copied in a single step that
+    holds the read lock, and so blocks writers, until it finishes.
+    Returns (restarts, whether that single step was needed).
+    """
+    if connections[alias].vendor != 'sqlite':
+        raise ValueError(f"Database '{alias}' is not SQLite")
+
+    restarts = 0
+    remaining_before = None
+
+    def step(status, remaining, total):
+        nonlocal restarts, remaining_before
+        if remaining_before is not None and remaining > remaining_before:
+            restarts += 1
+            if restarts > max_restarts:
+                # Raising from the callback makes sqlite3 abort the backup.
+                raise _TooManyRestarts
+        remaining_before = remaining
+        if progress is not None:
+            progress(total - remaining, total)
+        if remaining:
+            time.sleep(pause)
+
+    source = _source_connection(alias)
+    destination = sqlite3.connect(str(target))
+    locked = False
+    try:
+        try:
+            source.backup(destination, pages=pages, progress=step)
+        except _TooManyRestarts:
+            locked = True
+            source.backup(destination, pages=-1)
+            if progress is not None:
+                (total,) = destination.execute('PRAGMA page_count').fetchone()
+                progress(total, total)
+        (check,) = destination.execute('PRAGMA quick_check').fetchone()
+        if check != 'ok':
+            raise sqlite3.DatabaseError(f'Snapshot failed its integrity check: {check}')
+    finally:
+        destination.close()
+        source.close()
+    return restarts, locked
+
+
+@contextmanager
+def snapshot_alias(path):
+    """
+    A temporary database alias for a snapshot file.
+    """
+    alias = f'snapshot_{uuid.uuid4().hex}'
+    settings_dict = {**connections['default'].settings_dict, 'NAME': str(path)}
+    connection = load_backend(settings_dict['ENGINE']).DatabaseWrapper(settings_dict, alias)
+    connections[alias] = connection
+    try:
+        yield alias
+    finally:
+        connection.close()
+        del connections[alias]
+
+
+def dump_snapshot(path, stream, chunk_size=2000):
+    """
+    Write the rows of DUMP_MODELS in the snapshot at ``path`` to
+    ``stream`` as JSON Lines. Returns the number of rows per model.
+    """
+    counts = {}
+    with snapshot_alias(path) as alias:
+        for model in DUMP_MODELS:
+            fields = [field.name for field in model._meta.concrete_fields if not field.primary_key]
+            rows = model.objects.using(alias).order_by('pk').iterator(chunk_size=chunk_size)
+            serializer = serializers.get_serializer('jsonl')()
+            serializer.serialize(rows, stream=stream, fields=fields)
+            counts[model._meta.label] = model.objects.using(alias).count()
+    return counts
+
+
+def compress(path, target, level=6):
+    """
+    gzip ``path`` to ``target``, through a partial file so a crash never
+    leaves a truncated snapshot under the final name.
+    """
+    partial = target.with_name(target.name + '.partial')
+    try:
+        with open(path, 'rb') as source, gzip.open(partial, 'wb', compresslevel=level) as destination:
+            shutil.copyfileobj(source, destination, 1024 * 1024)
+        os.replace(partial, target)
+    finally:
+        partial.unlink(missing_ok=True)
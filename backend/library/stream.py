@@ -0,0 +1,182 @@
+"""
+Live book availability over Server-Sent Events.
+
+GET /api/books/stream/ (served under ASGI) keeps a connection open and
+pushes an ``availability`` event whenever a borrow, return or hold changes
+how many copies of a book are on the shelf. Changes are announced after
+their transaction commits and go through one in-process hub: each message
+is encoded once and kept in a short ring buffer. Waiting connections all
+share a single asyncio.Event that a publish sets, so a change costs one
+wake-up per connection and no per-connection queues. Only changes made by
+this process are pushed; /api/events/ remains the feed across processes.
+
+The stream is public: it carries shelf counts only, and the frontend
+follows it from one process-wide reader with no user session. Each client
+address may hold STREAM_MAX_CONNECTIONS_PER_CLIENT streams at once.
+"""
+import asyncio
+import json
+import secrets
+import threading
+from collections import Counter, deque
+from itertools import islice
+
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.db import transaction
+from django.http import JsonResponse, StreamingHttpResponse
+from rest_framework.throttling import BaseThrottle
+
+from .models import Book
+from .routers import branch_database, get_branches
+
+
+class AvailabilityHub:
+    def __init__(self, buffer_size=None):
+        # Event ids carry the hub's boot id, so a client reconnecting after a
+        # restart is told to reload rather than resuming at a stale position.
+        self.boot = secrets.token_hex(4)
+        self.seq = 0
+        self.recent = deque(maxlen=buffer_size or getattr(settings, 'STREAM_BUFFER_SIZE', 1000))
+        self.lock = threading.Lock()
+        self.loop = None
+        self.wakeup = None
+        self.subscribers = 0
+        self.clients = Counter()
+
+    def publish(self, branch, payload):
+        """
+        Queue ``payload`` for subscribers of ``branch``. Safe to call from
+        any thread.
+        """
+        with self.lock:
+            self.seq += 1
+            data = json.dumps(payload, separators=(',', ':'))
+            message = f'id: {self.boot}-{self.seq}\nevent: availability\ndata: {data}\n\n'.encode()
+            self.recent.append((self.seq, branch, message))
+            loop = self.loop
+        if loop is not None and not loop.is_closed():
+            loop.call_soon_threadsafe(self._wake)
+
+    def _wake(self):
+        wakeup, self.wakeup = self.wakeup, asyncio.Event()
+        wakeup.set()
+
+    def since(self, seq, branch=None):
+        """
+        Buffered messages after ``seq`` for ``branch`` (every branch when
+        None), the last sequence number seen, and whether older messages
+        after ``seq`` were already dropped from the buffer.
+        """
+        with self.lock:
+            dropped = bool(self.recent) and self.recent[0][0] > seq + 1
+            # Sequence numbers in the buffer are contiguous, so the messages
+            # after ``seq`` are exactly the newest ``self.seq - seq`` ones:
+            # read just that tail rather than the whole buffer.
+            newer = max(min(self.seq - seq, len(self.recent)), 0)
+            tail = list(islice(reversed(self.recent), newer))
+            messages = [message for _, code, message in reversed(tail) if branch is None or code == branch]
+            return messages, self.seq, dropped
+
+    def resume_position(self, last_event_id):
+        """
+        Sequence number to continue from for a ``Last-Event-ID``, or None if
+        the client has to reload because the id is from another run or has
+        left the buffer.
+        """
+        if not last_event_id:
+            return self.seq
+        boot, _, number = last_event_id.partition('-')
+        if boot != self.boot or not number.isdigit() or int(number) > self.seq:
+            return None
+        _, _, dropped = self.since(int(number))
+        return None if dropped else int(number)
+
+    def attach(self, client=None):
+        loop = asyncio.get_running_loop()
+        with self.lock:
+            if self.loop is not loop:
+                self.loop, self.wakeup = loop, asyncio.Event()
+            self.subscribers += 1
+            if client is not None:
+                self.clients[client] += 1
+
+    def detach(self, client=None):
+        with self.lock:
+            self.subscribers -= 1
+            if client is not None:
+                self.clients[client] -= 1
+                if not self.clients[client]:
+                    del self.clients[client]
+
+    async def stream(self, branch=None, last_event_id=None, keepalive=None, client=None):
+        keepalive = keepalive or getattr(settings, 'STREAM_KEEPALIVE_SECONDS', 15)
+        self.attach(client)
+        try:
+            yield b'retry: 3000\n\n'
+            seq = self.resume_position(last_event_id)
+            if seq is None:
+                seq = self.seq
+                yield f'id: {self.boot}-{seq}\nevent: reset\ndata: {{}}\n\n'.encode()
+            while True:
+                # Take the event before reading the buffer: a publish after
+                # the read then still wakes us.
+                wakeup = self.wakeup
+                messages, seq, _ = self.since(seq, branch)
+                if messages:
+                    yield b''.join(messages)
+                    continue
+                try:
+                    await asyncio.wait_for(wakeup.wait(), keepalive)
+                except asyncio.TimeoutError:
+                    yield b': keepalive\n\n'
+        finally:
+            self.detach(client)
+
+
+hub = AvailabilityHub()
+
+
+def announce_availability(book_ids):
+    """
+    Push the current availability of ``book_ids`` to stream subscribers
+    once the current transaction commits.
+    """
+    if not hub.subscribers:
+        return
+    book_ids = list(book_ids)
+
+    def send():
+        rows = Book.objects.filter(pk__in=book_ids).values('id', 'branch', 'available_copies', 'total_copies')
+        for row in rows:
+            hub.publish(row['branch'], {**row, 'available': row['available_copies'] > 0})
+
+    transaction.on_commit(send, using=branch_database())
+
+
+async def availability_stream(request):
+    """
+    ``text/event-stream`` of availability changes, for one branch with
+    ``?branch=``/``X-Library-Branch`` or all of them. Needs an ASGI server:
+    a WSGI worker would buffer the endless response. Deliberately outside
+    DRF and open to anonymous clients; see the module docstring.
+    """
+    if not isinstance(request, ASGIRequest):
+        return JsonResponse({'detail': 'The availability stream needs an ASGI server'}, status=501)
+
+    branch = request.headers.get('X-Library-Branch') or request.GET.get('branch') or None
+    if branch is not None and branch not in get_branches():
+        return JsonResponse({'branch': f'Unknown branch: {branch}'}, status=400)
+    if hub.subscribers >= getattr(settings, 'STREAM_MAX_CONNECTIONS', 10000):
+        return JsonResponse({'detail': 'Too many open streams, try again later'}, status=503)
+    # The address the throttles use, so NUM_PROXIES applies here too.
+    client = BaseThrottle().get_ident(request)
+    if hub.clients[client] >= getattr(settings, 'STREAM_MAX_CONNECTIONS_PER_CLIENT', 10):
+        return JsonResponse({'detail': 'Too many open streams from this address'}, status=429)
+
+    response = StreamingHttpResponse(
+        hub.stream(branch, request.headers.get('Last-Event-ID'), client=client), content_type='text/event-stream'
+    )
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
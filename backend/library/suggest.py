@@ -0,0 +1,289 @@
+"""
+Title and author autocomplete.
+
+Each branch has its own index. Its completions are "<display>\\0<kind><id>"
+strings, UTF-8 encoded back to back in one bytes buffer, sorted by their
+normalized key, with an array of offsets into the buffer; a prefix lookup is
+a bisect over the offsets followed by a short forward scan. Keys are not
+stored: they are recomputed from the display text of the few entries a
+lookup touches. Titles are also indexed without a leading article ("Hobbit"
+finds "The Hobbit"). Authors are indexed once however many books they have.
+
+An index is built from Book on first use. Book signals keep it current in
+this process through a small sorted list of added entries and a set of
+removed ones, and it is rebuilt in the background every
+SUGGEST_REBUILD_SECONDS to fold those in and pick up edits made by other
+processes.
+"""
+import bisect
+import heapq
+import threading
+import time
+from array import array
+from itertools import islice, takewhile
+
+from django.conf import settings
+from django.db import connections
+
+from .models import Book
+from .routers import current_branch, using_branch
+
+TITLE = 't'
+# A title indexed without its leading article.
+BARE_TITLE = 'u'
+AUTHOR = 'a'
+SEPARATOR = '\x00'
+ARTICLES = ('the ', 'a ', 'an ')
+MAX_KEY_LENGTH = 64
+# Entries sorted at a time while building.
+RUN_SIZE = 100_000
+
+
+def normalize(text):
+    return ' '.join(text.casefold().split())[:MAX_KEY_LENGTH]
+
+
+def _strip_article(key):
+    for article in ARTICLES:
+        if key.startswith(article) and len(key) > len(article):
+            return key[len(article):]
+    return None
+
+
+def _key(entry):
+    display, tag = entry.split(SEPARATOR)
+    key = normalize(display)
+    return _strip_article(key) if tag[0] == BARE_TITLE else key
+
+
+def _title_entries(book_id, title):
+    entries = [f'{title}{SEPARATOR}{TITLE}{book_id}']
+    if _strip_article(normalize(title)) is not None:
+        entries.append(f'{title}{SEPARATOR}{BARE_TITLE}{book_id}')
+    return entries
+
+
+def _author_entry(author):
+    return f'{author}{SEPARATOR}{AUTHOR}'
+
+
+def _unique_authors(items):
+    """
+    Drop repeats of an author that several build runs each indexed.
+    """
+    current, seen = None, False
+    for key, entry in items:
+        if key != current:
+            current, seen = key, False
+        if entry.endswith(f'{SEPARATOR}{AUTHOR}'):
+            if seen:
+                continue
+            seen = True
+        yield key, entry
+
+
+class SuggestIndex:
+    def __init__(self, max_entries=None):
+        self.max_entries = max_entries or getattr(settings, 'SUGGEST_MAX_ENTRIES', 2_000_000)
+        self.data = bytearray()
+        self.offsets = array('I', [0])
+        self.added = []
+        self.removed = set()
+        self.lock = threading.Lock()
+        self.built_at = time.monotonic()
+
+    @classmethod
+    def from_rows(cls, rows, max_entries=None):
+        """
+        Build an index from (book_id, title, author) rows. Entries are
+        sorted and packed about RUN_SIZE at a time and the runs merged, so
+        only one run is ever held as separate strings. An author found in
+        several runs counts once per run towards max_entries.
+        """
+        index = cls(max_entries)
+        runs = []
+        entries = []
+        authors = {}
+        count = 0
+        for book_id, title, author in rows:
+            titles = _title_entries(book_id, title)
+            entries.extend(titles)
+            count += len(titles)
+            if authors.setdefault(normalize(author), author) is author:
+                count += 1
+            if count >= index.max_entries:
+                break
+            if len(entries) + len(authors) >= RUN_SIZE:
+                runs.append(cls._run(entries, authors))
+                entries, authors = [], {}
+        runs.append(cls._run(entries, authors))
+        del entries, authors
+
+        index._load(_unique_authors(heapq.merge(*(run._packed('') for run in runs))))
+        return index
+
+    @classmethod
+    def _run(cls, entries, authors):
+        entries.extend(_author_entry(author) for author in authors.values())
+        run = cls(len(entries) or 1)
+        run._load(sorted((_key(entry), entry) for entry in entries))
+        return run
+
+    def _load(self, items):
+        """
+        Pack sorted (key, entry) pairs, up to max_entries of them.
+        """
+        data = bytearray()
+        offsets = array('Q', [0])
+        for _, entry in islice(items, self.max_entries):
+            data += entry.encode()
+            offsets.append(len(data))
+        self.data = data
+        self.offsets = offsets if len(data) >= 2 ** 32 else array('I', offsets)
+
+    def __len__(self):
+        return len(self.offsets) - 1 + len(self.added) - len(self.removed)
+
+    def _entry(self, position):
+        return self.data[self.offsets[position]:self.offsets[position + 1]].decode()
+
+    def _packed_position(self, key):
+        """
+        Position of the first packed entry whose key is not below ``key``.
+        """
+        low, high = 0, len(self.offsets) - 1
+        while low < high:
+            middle = (low + high) // 2
+            if _key(self._entry(middle)) < key:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def _packed(self, prefix):
+        position = self._packed_position(prefix)
+        while position < len(self.offsets) - 1:
+            entry = self._entry(position)
+            key = _key(entry)
+            if not key.startswith(prefix):
+                return
+            if entry not in self.removed:
+                yield key, entry
+            position += 1
+
+    def _added(self, prefix):
+        position = bisect.bisect_left(self.added, (prefix,))
+        for key, entry in self.added[position:]:
+            if not key.startswith(prefix):
+                return
+            yield key, entry
+
+    def _matches(self, prefix):
+        return heapq.merge(self._packed(prefix), self._added(prefix))
+
+    def _exact(self, key):
+        # Entries with exactly ``key`` sort before any longer key it prefixes.
+        return [entry for _, entry in takewhile(lambda match: match[0] == key, self._matches(key))]
+
+    def search(self, prefix, limit=10):
+        prefix = normalize(prefix)
+        if not prefix:
+            return []
+
+        results = []
+        for _, entry in self._matches(prefix):
+            if len(results) >= limit:
+                break
+            display, tag = entry.split(SEPARATOR)
+            book_id = int(tag[1:]) if tag[0] != AUTHOR else None
+            if book_id is None or not any(result['book_id'] == book_id for result in results):
+                kind = 'author' if book_id is None else 'title'
+                results.append({'text': display, 'kind': kind, 'book_id': book_id})
+        return results
+
+    def _insert(self, entry):
+        key = _key(entry)
+        if entry in self.removed:
+            self.removed.discard(entry)
+        elif entry not in self._exact(key) and len(self) < self.max_entries:
+            bisect.insort(self.added, (key, entry))
+
+    def _remove(self, entry):
+        key = _key(entry)
+        position = bisect.bisect_left(self.added, (key, entry))
+        if position < len(self.added) and self.added[position] == (key, entry):
+            del self.added[position]
+        elif entry in self._exact(key):
+            self.removed.add(entry)
+
+    def _author_entries(self, author_key):
+        return [entry for entry in self._exact(author_key) if entry.endswith(f'{SEPARATOR}{AUTHOR}')]
+
+    def add_book(self, book_id, title, author):
+        with self.lock:
+            for entry in _title_entries(book_id, title):
+                self._insert(entry)
+            if not self._author_entries(normalize(author)):
+                self._insert(_author_entry(author))
+
+    def remove_book(self, book_id, title, author, last_by_author=True):
+        """
+        Drop a book's titles, and its author too when ``last_by_author``
+        says no other book of theirs is left.
+        """
+        with self.lock:
+            for entry in _title_entries(book_id, title):
+                self._remove(entry)
+            if last_by_author:
+                for entry in self._author_entries(normalize(author)):
+                    self._remove(entry)
+
+
+_indexes = {}
+_index_lock = threading.Lock()
+_rebuilding = set()
+
+
+def _build(code):
+    with using_branch(code):
+        rows = (
+            Book.objects.filter(branch=code).order_by('-created_at')
+            .values_list('pk', 'title', 'author').iterator(chunk_size=10000)
+        )
+        return SuggestIndex.from_rows(rows)
+
+
+def _rebuild_in_background(code):
+    try:
+        _indexes[code] = _build(code)
+    finally:
+        _rebuilding.discard(code)
+        connections.close_all()
+
+
+def get_index(code=None):
+    code = code or current_branch()
+    index = _indexes.get(code)
+    if index is None:
+        with _index_lock:
+            index = _indexes.get(code)
+            if index is None:
+                index = _indexes[code] = _build(code)
+    elif (
+        code not in _rebuilding
+        and time.monotonic() - index.built_at > getattr(settings, 'SUGGEST_REBUILD_SECONDS', 300)
+    ):
+        _rebuilding.add(code)
+        threading.Thread(target=_rebuild_in_background, args=(code,), daemon=True).start()
+    return index
+
+
+def loaded_index(code):
+    """
+    Branch ``code``'s index if this process has built one, without building it.
+    """
+    return _indexes.get(code)
+
+
+def complete(prefix, limit=10):
+    return get_index().search(prefix, limit)
@@ -0,0 +1,31 @@
+import shutil
+import tempfile
+from pathlib import Path
+
+from django.test import override_settings
+from django.test.runner import DiscoverRunner
+
+
+class LibraryTestRunner(DiscoverRunner):
+    """
+    Runs the suite against its own scratch state instead of the host-wide
+    files under var/ that live workers share: the shared cache, and the
+    throttle buckets.
+    """
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self.scratch = tempfile.mkdtemp(prefix='library-tests-')
+        self.isolation = override_settings(
+            CACHES={
+                'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+                'shared': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'shared'},
+            },
+            THROTTLE_DB_PATH=Path(self.scratch) / 'throttle.sqlite3',
+        )
+        self.isolation.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self.isolation.disable()
+        shutil.rmtree(self.scratch, ignore_errors=True)
+        super().teardown_test_environment(**kwargs)
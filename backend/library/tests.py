@@ -1,3 +1,1138 @@
-from django.test import TestCase
+import asyncio
+import gzip
+import json
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from datetime import date, timedelta
+from io import StringIO
+from pathlib import Path
 
-# Create your tests here.
+from django.conf import settings
+from django.core import mail
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import connection, connections
+from django.db.utils import load_backend
+from django.test import AsyncRequestFactory, RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from . import schema, stream, suggest
+from .analytics import borrow_series, run_rollups
+from .archive import BorrowHistory, archive_returned_borrows
+from .changes import catalog_changes
+from .events import consume_events
+from .fines import recalculate_fines
+from .holds import expire_ready_holds, release_copy
+from .jobs import enqueue, work
+from .models import ArchivedBorrow, Book, Borrow, Event, Hold, Job, User
+from .recommendations import CooccurrenceIndex, _current_version_dir, build_cooccurrence
+from .reminders import schedule_reminders
+from .routers import (
+    BranchRouter, PrimaryReplicaRouter, ReplicaRoutingMiddleware, branch_only_databases, record_user_write,
+    set_migrating_database, using_branch,
+)
+from .signals import route_data_migrations, stop_routing_data_migrations
+from .snapshot import backup_database
+from .stream import AvailabilityHub
+from .throttling import purge_buckets, take_token
+from .trending import normalize, record_borrow, trending_books
+
+
+def clear_caches():
+    for alias in ('default', 'shared'):
+        caches[alias].clear()
+
+
+@override_settings(DATABASE_REPLICAS=['replica1', 'replica2'], REPLICA_LAG_WINDOW=5)
+class PrimaryReplicaRouterTests(SimpleTestCase):
+    def setUp(self):
+        clear_caches()
+        self.router = PrimaryReplicaRouter()
+        self.factory = RequestFactory()
+
+    def route_inside(self, request, callback):
+        seen = []
+        middleware = ReplicaRoutingMiddleware(lambda req: seen.append(callback(req)))
+        middleware(request)
+        return seen[0]
+
+    def test_reads_outside_requests_use_primary(self):
+        self.assertEqual(self.router.db_for_read(Book), 'default')
+
+    def test_safe_request_reads_from_replica(self):
+        request = self.factory.get('/api/books/')
+        db = self.route_inside(request, lambda req: self.router.db_for_read(Book))
+        self.assertIn(db, ['replica1', 'replica2'])
+
+    def test_request_sticks_to_one_replica(self):
+        for _ in range(5):
+            request = self.factory.get('/api/books/')
+            seen = self.route_inside(request, lambda req: {self.router.db_for_read(Book) for _ in range(20)})
+            self.assertEqual(len(seen), 1)
+
+    def test_unsafe_request_reads_from_primary(self):
+        request = self.factory.post('/api/borrows/')
+        db = self.route_inside(request, lambda req: self.router.db_for_read(Book))
+        self.assertEqual(db, 'default')
+
+    def test_read_after_write_stays_on_primary(self):
+        def write_then_read(req):
+            self.router.db_for_write(Book)
+            return self.router.db_for_read(Book)
+
+        db = self.route_inside(self.factory.get('/api/books/'), write_then_read)
+        self.assertEqual(db, 'default')
+
+    def test_recent_writer_is_pinned_during_lag_window(self):
+        user = User(pk=42, username='reader')
+        record_user_write(user.pk)
+        # Another worker has its own local cache but sees the same pin.
+        caches['default'].clear()
+        request = self.factory.get('/api/borrows/my_borrows/')
+        request.user = user
+        db = self.route_inside(request, lambda req: self.router.db_for_read(Book))
+        self.assertEqual(db, 'default')
+
+    def test_replicas_are_never_migrated(self):
+        self.assertFalse(self.router.allow_migrate('replica1', 'library'))
+        self.assertIsNone(self.router.allow_migrate('default', 'library'))
+
+
+BRANCHES_SHARING_PRIMARY = {
+    'main': {'name': 'Main Library', 'database': 'default'},
+    'east': {'name': 'East', 'database': 'default'},
+}
+
+
+@override_settings(LIBRARY_BRANCHES={
+    'main': {'name': 'Main Library', 'database': 'default'},
+    'east': {'name': 'East', 'database': 'branch_east'},
+})
+class BranchRouterTests(SimpleTestCase):
+    def setUp(self):
+        self.router = BranchRouter()
+
+    def test_branch_data_goes_to_the_branch_database(self):
+        self.assertIsNone(self.router.db_for_write(Borrow))
+        with using_branch('east'):
+            self.assertEqual(self.router.db_for_write(Borrow), 'branch_east')
+            self.assertEqual(self.router.db_for_read(Book), 'branch_east')
+            self.assertIsNone(self.router.db_for_read(User))
+
+    def test_objects_stay_on_their_branch_database(self):
+        book = Book(title='Dune')
+        book._state.db = 'branch_east'
+        self.assertEqual(self.router.db_for_write(Book, instance=book), 'branch_east')
+        self.assertFalse(self.router.allow_relation(book, Borrow()))
+        self.assertTrue(self.router.allow_relation(book, User()))
+
+    def test_data_migrations_use_the_database_being_migrated(self):
+        route_data_migrations(sender=None, using='branch_east')
+        self.addCleanup(set_migrating_database, None)
+        self.assertEqual(self.router.db_for_write(Book), 'branch_east')
+        self.assertEqual(self.router.db_for_read(User), 'branch_east')
+        stop_routing_data_migrations(sender=None, using='branch_east')
+        self.assertIsNone(self.router.db_for_read(Book))
+
+
+@override_settings(LIBRARY_BRANCHES=BRANCHES_SHARING_PRIMARY)
+class BranchScopingTests(TestCase):
+    def setUp(self):
+        clear_caches()
+        self.reader = User.objects.create(username='reader', email='reader@example.com')
+        self.client = APIClient()
+        self.client.force_authenticate(self.reader)
+        self.dune = Book.objects.create(title='Dune', author='Frank Herbert', genre='Sci-Fi')
+        self.emma = Book.objects.create(title='Emma', author='Jane Austen', genre='Classic', branch='east')
+
+    def test_catalog_and_loans_are_per_branch(self):
+        titles = [book['title'] for book in self.client.get('/api/books/').data['results']]
+        self.assertEqual(titles, ['Dune'])
+        response = self.client.get('/api/books/', HTTP_X_LIBRARY_BRANCH='east')
+        self.assertEqual([book['title'] for book in response.data['results']], ['Emma'])
+
+        due_date = (date.today() + timedelta(days=14)).isoformat()
+        response = self.client.post('/api/borrows/', {'book': self.emma.pk, 'due_date': due_date})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post('/api/borrows/?branch=east', {'book': self.emma.pk, 'due_date': due_date})
+        self.assertEqual(response.data['branch'], 'east')
+        self.assertEqual(self.client.get('/api/borrows/').data['count'], 0)
+
+    def test_unknown_branch_is_rejected(self):
+        self.assertEqual(self.client.get('/api/books/', {'branch': 'nowhere'}).status_code, 400)
+
+
+@override_settings(LIBRARY_BRANCHES=BRANCHES_SHARING_PRIMARY)
+class BranchSearchTests(TransactionTestCase):
+    def test_search_fans_out_to_every_branch(self):
+        Book.objects.create(title='Dune Messiah', author='Frank Herbert', genre='Sci-Fi', branch='east')
+        Book.objects.create(title='Dune', author='Frank Herbert', genre='Sci-Fi')
+        Book.objects.create(title='Emma', author='Jane Austen', genre='Classic', branch='east')
+        client = APIClient()
+        client.force_authenticate(User.objects.create(username='reader', email='reader@example.com'))
+
+        response = client.get('/api/books/everywhere/', {'search': 'herbert'})
+        self.assertEqual([(book['title'], book['branch']) for book in response.data],
+                         [('Dune', 'main'), ('Dune Messiah', 'east')])
+        for limit in (0, -1, 'x'):
+            response = client.get('/api/books/everywhere/', {'search': 'dune', 'limit': limit})
+            self.assertEqual(response.status_code, 400)
+
+
+@unittest.skipUnless(branch_only_databases(), 'set LIBRARY_BRANCH_DBS to give a branch its own database')
+class SeparateBranchDatabaseTests(TransactionTestCase):
+    """
+    Run with e.g. ``LIBRARY_BRANCH_DBS=east=/tmp/east.sqlite3 python manage.py
+    test library.tests.SeparateBranchDatabaseTests``.
+    """
+    databases = '__all__'
+
+    def test_branch_rows_live_in_the_branch_database(self):
+        database = branch_only_databases()[0]
+        code = next(code for code, branch in settings.LIBRARY_BRANCHES.items() if branch['database'] == database)
+        librarian = User.objects.create(username='libby', email='libby@example.com', role='librarian')
+        self.assertTrue(User.objects.using(database).filter(pk=librarian.pk).exists())
+        client = APIClient()
+        client.force_authenticate(librarian)
+
+        book_id = client.post('/api/books/', {'title': 'Dune', 'author': 'Frank Herbert', 'genre': 'Sci-Fi'},
+                              HTTP_X_LIBRARY_BRANCH=code).data['id']
+        due_date = (date.today() + timedelta(days=14)).isoformat()
+        response = client.post('/api/borrows/', {'book': book_id, 'due_date': due_date},
+                               HTTP_X_LIBRARY_BRANCH=code)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Borrow.objects.using(database).count(), 1)
+        self.assertEqual(Borrow.objects.using('default').count(), 0)
+
+        Book.objects.create(title='Dune Messiah', author='Frank Herbert', genre='Sci-Fi')
+        response = client.get('/api/books/everywhere/', {'search': 'dune'})
+        self.assertEqual([(book['title'], book['branch']) for book in response.data],
+                         [('Dune', code), ('Dune Messiah', 'main')])
+
+
+class BookInventoryTests(TestCase):
+    def setUp(self):
+        self.book = Book.objects.create(title='Dune', author='Frank Herbert', genre='Sci-Fi',
+                                        total_copies=2, available_copies=2)
+        self.due_date = (date.today() + timedelta(days=14)).isoformat()
+
+    def client_for(self, username, role='user'):
+        user = User.objects.create_user(username=username, email=f'{username}@example.com',
+                                        password='secret-pass-1', role=role)
+        client = APIClient()
+        client.force_authenticate(user)
+        return client
+
+    def borrow(self, client):
+        return client.post('/api/borrows/', {'book': self.book.pk, 'due_date': self.due_date})
+
+    def test_borrow_and_return_adjust_counters(self):
+        first = self.client_for('alice')
+        second = self.client_for('bob')
+        self.assertEqual(self.borrow(first).status_code, 201)
+        self.assertEqual(self.borrow(second).status_code, 201)
+
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.available_copies, 0)
+        self.assertEqual(self.borrow(self.client_for('carol')).status_code, 400)
+
+        borrow_id = first.get('/api/borrows/my_borrows/').data['results'][0]['id']
+        self.assertEqual(first.post(f'/api/borrows/{borrow_id}/return/').status_code, 200)
+        self.assertEqual(first.post(f'/api/borrows/{borrow_id}/return/').status_code, 400)
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.available_copies, 1)
+
+    def test_loans_cannot_be_repointed_or_unreturned(self):
+        other = Book.objects.create(title='Emma', author='Jane Austen', genre='Classic')
+        reader = self.client_for('frank')
+        borrow_id = self.borrow(reader).data['id']
+        self.assertEqual(reader.patch(f'/api/borrows/{borrow_id}/', {'book': other.pk}).status_code, 400)
+        self.assertEqual(reader.patch(f'/api/borrows/{borrow_id}/', {'returned': True}).status_code, 400)
+
+        reader.post(f'/api/borrows/{borrow_id}/return/')
+        self.assertEqual(reader.patch(f'/api/borrows/{borrow_id}/', {'returned': False}).status_code, 400)
+        self.book.refresh_from_db()
+        other.refresh_from_db()
+        self.assertEqual((self.book.available_copies, other.available_copies), (2, 1))
+
+    def test_available_filter_uses_counter(self):
+        Book.objects.create(title='Emma', author='Jane Austen', genre='Classic',
+                            total_copies=1, available_copies=0)
+        response = self.client_for('dave').get('/api/books/', {'available': 'true'})
+        self.assertEqual([book['title'] for book in response.data['results']], ['Dune'])
+
+    def test_cannot_shrink_below_copies_on_loan(self):
+        self.borrow(self.client_for('erin'))
+        self.borrow(self.client_for('frank'))
+        librarian = self.client_for('libby', role='librarian')
+        response = librarian.patch(f'/api/books/{self.book.pk}/', {'total_copies': 1})
+        self.assertEqual(response.status_code, 400)
+        response = librarian.patch(f'/api/books/{self.book.pk}/', {'total_copies': 5})
+        self.assertEqual(response.data['available_copies'], 3)
+
+
+class HoldQueueTests(TestCase):
+    def setUp(self):
+        self.book = Book.objects.create(title='Dune', author='Frank Herbert', genre='Sci-Fi')
+        self.due_date = (date.today() + timedelta(days=14)).isoformat()
+
+    def client_for(self, username):
+        user = User.objects.create_user(username=username, email=f'{username}@example.com',
+                                        password='secret-pass-1')
+        client = APIClient()
+        client.force_authenticate(user)
+        return client
+
+    def test_return_hands_copy_to_next_in_line(self):
+        owner = self.client_for('alice')
+        first = self.client_for('bob')
+        second = self.client_for('carol')
+        borrow_id = owner.post('/api/borrows/', {'book': self.book.pk, 'due_date': self.due_date}).data['id']
+
+        self.assertEqual(first.post('/api/holds/', {'book': self.book.pk}).data['position'], 1)
+        self.assertEqual(second.post('/api/holds/', {'book': self.book.pk}).data['position'], 2)
+
+        owner.post(f'/api/borrows/{borrow_id}/return/')
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.available_copies, 0)
+        self.assertEqual(Hold.objects.get(position=1).status, Hold.READY)
+
+        response = first.post('/api/borrows/', {'book': self.book.pk, 'due_date': self.due_date})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Hold.objects.get(position=1).status, Hold.FULFILLED)
+
+    def test_expired_holds_pass_copy_on(self):
+        owner = self.client_for('dave')
+        borrow_id = owner.post('/api/borrows/', {'book': self.book.pk, 'due_date': self.due_date}).data['id']
+        self.client_for('erin').post('/api/holds/', {'book': self.book.pk})
+        owner.post(f'/api/borrows/{borrow_id}/return/')
+
+        expired = expire_ready_holds(now=timezone.now() + timedelta(days=30))
+        self.assertEqual(expired, 1)
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.available_copies, 1)
+
+    def test_borrowing_a_shelf_copy_withdraws_the_waiting_hold(self):
+        owner = self.client_for('frank')
+        borrow_id = owner.post('/api/borrows/', {'book': self.book.pk, 'due_date': self.due_date}).data['id']
+        reader = self.client_for('gina')
+        reader.post('/api/holds/', {'book': self.book.pk})
+        Book.objects.filter(pk=self.book.pk).update(total_copies=2, available_copies=1)
+
+        self.assertEqual(reader.post('/api/borrows/', {'book': self.book.pk, 'due_date': self.due_date}).status_code, 201)
+        self.assertEqual(Hold.objects.get().status, Hold.CANCELLED)
+        owner.post(f'/api/borrows/{borrow_id}/return/')
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.available_copies, 1)
+
+    def test_rejects_bad_filters(self):
+        client = self.client_for('hank')
+        self.assertEqual(client.get('/api/holds/', {'book': 'abc'}).status_code, 400)
+        self.assertEqual(client.get('/api/holds/', {'status': 'lost'}).status_code, 400)
+        self.assertEqual(client.get('/api/holds/', {'status': Hold.EXPIRED}).status_code, 200)
+
+
+class RecommendationTests(TestCase):
+    def setUp(self):
+        self.books = [
+            Book.objects.create(title=f'Book {index}', author='Author', genre='Fiction', total_copies=5,
+                                available_copies=5)
+            for index in range(4)
+        ]
+        self.users = [
+            User.objects.create(username=f'reader{index}', email=f'reader{index}@example.com')
+            for index in range(3)
+        ]
+        self.base_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.base_dir)
+
+    def borrow(self, user, book):
+        Borrow.objects.create(user=user, book=book, due_date=date.today())
+
+    def related_ids(self, book):
+        return CooccurrenceIndex(_current_version_dir(self.base_dir)).related(book.pk)
+
+    def test_incremental_refresh_matches_full_rebuild(self):
+        first, second, third, fourth = self.books
+        self.borrow(self.users[0], first)
+        self.borrow(self.users[0], second)
+        self.borrow(self.users[1], first)
+        self.borrow(self.users[1], second)
+        self.borrow(self.users[1], third)
+        build_cooccurrence(base_dir=self.base_dir)
+        self.assertEqual(self.related_ids(first), [(second.pk, 2), (third.pk, 1)])
+
+        self.borrow(self.users[0], third)
+        self.borrow(self.users[2], fourth)
+        self.borrow(self.users[2], first)
+        build_cooccurrence(base_dir=self.base_dir)
+        incremental = {book.pk: self.related_ids(book) for book in self.books}
+
+        build_cooccurrence(full=True, base_dir=self.base_dir)
+        self.assertEqual(incremental, {book.pk: self.related_ids(book) for book in self.books})
+        self.assertEqual(incremental[first.pk], [(second.pk, 2), (third.pk, 2), (fourth.pk, 1)])
+
+
+class TrendingTests(TestCase):
+    def setUp(self):
+        self.old = Book.objects.create(title='Old Favourite', author='A', genre='Fantasy')
+        self.new = Book.objects.create(title='New Hit', author='B', genre='Fantasy')
+        self.other = Book.objects.create(title='Elsewhere', author='C', genre='History')
+
+    def test_recent_borrows_outrank_older_ones(self):
+        now = timezone.now()
+        for _ in range(3):
+            record_borrow(self.old, now - timedelta(days=28))
+        record_borrow(self.new, now)
+        record_borrow(self.other, now)
+
+        self.assertEqual(list(trending_books('Fantasy')), [self.new, self.old])
+        normalize(now)
+        self.assertEqual(list(trending_books('Fantasy')), [self.new, self.old])
+        self.assertAlmostEqual(self.new.popularity.score, 1.0, places=3)
+
+    @override_settings(LIBRARY_BRANCHES=BRANCHES_SHARING_PRIMARY)
+    def test_books_trend_in_their_own_branch(self):
+        east = Book.objects.create(title='Eastern Hit', author='D', genre='Fantasy', branch='east')
+        record_borrow(self.new)
+        record_borrow(east)
+        self.assertEqual(list(trending_books()), [self.new])
+        with using_branch('east'):
+            self.assertEqual(list(trending_books()), [east])
+
+
+class BorrowRollupTests(TestCase):
+    def test_rollups_catch_up_incrementally(self):
+        user = User.objects.create(username='reader', email='reader@example.com')
+        fantasy = Book.objects.create(title='Hobbit', author='Tolkien', genre='Fantasy')
+        history = Book.objects.create(title='SPQR', author='Beard', genre='History')
+        now = timezone.now()
+        late = Borrow.objects.create(user=user, book=fantasy, due_date=(now - timedelta(days=3)).date())
+        on_time = Borrow.objects.create(user=user, book=history, due_date=(now + timedelta(days=3)).date())
+        Borrow.objects.filter(pk__in=[late.pk, on_time.pk]).update(borrowed_at=now - timedelta(days=10))
+
+        self.assertEqual(run_rollups(now), {'borrows': 2, 'returns': 0, 'overdues': 1})
+        self.assertEqual(run_rollups(now), {'borrows': 0, 'returns': 0, 'overdues': 0})
+
+        Borrow.objects.filter(pk=on_time.pk).update(returned=True, returned_at=now + timedelta(minutes=5))
+        self.assertEqual(run_rollups(now + timedelta(hours=1))['returns'], 1)
+
+        monthly = borrow_series('month', genre='History')
+        self.assertEqual(sum(row['borrows'] for row in monthly), 1)
+        self.assertEqual(sum(row['returns'] for row in monthly), 1)
+        daily = borrow_series('day', genre='Fantasy')
+        self.assertEqual(sum(row['borrows'] for row in daily), 1)
+        self.assertEqual(sum(row['overdues'] for row in daily), 1)
+
+    @override_settings(LIBRARY_BRANCHES=BRANCHES_SHARING_PRIMARY)
+    def test_rollups_are_kept_per_branch(self):
+        librarian = User.objects.create(username='libby', email='libby@example.com', role='librarian')
+        now = timezone.now()
+        for code in ('main', 'east'):
+            with using_branch(code):
+                book = Book.objects.create(title='Hobbit', author='Tolkien', genre='Fantasy', branch=code)
+                Borrow.objects.create(user=librarian, book=book, branch=code, due_date=now.date())
+                Borrow.objects.update(borrowed_at=now - timedelta(days=1))
+                self.assertEqual(run_rollups(now)['borrows'], 1)
+
+        client = APIClient()
+        client.force_authenticate(librarian)
+        response = client.get('/api/analytics/borrows/', {'genre': 'Fantasy', 'branch': 'east'})
+        self.assertEqual(sum(row['borrows'] for row in response.data['results']), 1)
+        self.assertEqual(client.get('/api/analytics/borrows/', {'book': 'abc'}).status_code, 400)
+
+
+class BookFacetTests(TestCase):
+    def setUp(self):
+        clear_caches()
+        Book.objects.create(title='Hobbit', author='Tolkien', genre='Fantasy')
+        Book.objects.create(title='Silmarillion', author='Tolkien', genre='Fantasy', available_copies=0)
+        Book.objects.create(title='Dune', author='Herbert', genre='Sci-Fi')
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create(username='reader', email='reader@example.com'))
+
+    def test_facets_follow_search(self):
+        response = self.client.get('/api/books/', {'facets': 'genre,available'})
+        self.assertEqual(response.data['facets'], {
+            'genre': [{'value': 'Fantasy', 'count': 2}, {'value': 'Sci-Fi', 'count': 1}],
+            'available': {'true': 2, 'false': 1},
+        })
+
+        response = self.client.get('/api/books/', {'facets': 'genre', 'search': 'tolkien'})
+        self.assertEqual(response.data['facets'], {'genre': [{'value': 'Fantasy', 'count': 2}]})
+
+    def test_catalog_changes_invalidate_cached_facets(self):
+        self.client.get('/api/books/', {'facets': 'genre'})
+        Book.objects.create(title='Emma', author='Austen', genre='Classic')
+        response = self.client.get('/api/books/', {'facets': 'genre'})
+        self.assertEqual(len(response.data['facets']['genre']), 3)
+
+    def test_circulation_invalidates_cached_availability(self):
+        self.client.get('/api/books/', {'facets': 'available'})
+        with self.captureOnCommitCallbacks(execute=True):
+            Book.objects.get(title='Dune').check_out()
+        response = self.client.get('/api/books/', {'facets': 'available'})
+        self.assertEqual(response.data['facets']['available'], {'true': 1, 'false': 2})
+
+
+class SparseFieldsetTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='reader', email='reader@example.com')
+        self.book = Book.objects.create(title='Hobbit', author='Tolkien', genre='Fantasy')
+        Borrow.objects.create(user=self.user, book=self.book, due_date=date.today() + timedelta(days=14))
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_fields_and_omit_trim_books(self):
+        response = self.client.get('/api/books/', {'fields': 'id,title,available'})
+        self.assertEqual(response.data['results'], [{'id': self.book.pk, 'title': 'Hobbit', 'available': True}])
+
+        response = self.client.get('/api/books/', {'omit': 'created_at,isbn'})
+        self.assertNotIn('isbn', response.data['results'][0])
+        self.assertIn('author', response.data['results'][0])
+
+    def test_borrow_fields_skip_unselected_relations(self):
+        response = self.client.get('/api/borrows/', {'fields': 'id,book_title,due_date'})
+        self.assertEqual(list(response.data['results'][0]), ['id', 'book_title', 'due_date'])
+        self.assertEqual(response.data['results'][0]['book_title'], 'Hobbit')
+
+
+class FastListRowsTests(TestCase):
+    def setUp(self):
+        librarian = User.objects.create(username='librarian', email='librarian@example.com', role='librarian')
+        reader = User.objects.create(username='reader', email='reader@example.com')
+        hobbit = Book.objects.create(title='Hobbit', author='Tolkien', genre='Fantasy', total_copies=2)
+        dune = Book.objects.create(title='Dune', author='Herbert', genre='Sci-Fi', available_copies=0)
+        Borrow.objects.create(user=reader, book=dune, due_date=date.today() - timedelta(days=3))
+        Borrow.objects.create(
+            user=reader, book=hobbit, due_date=date.today(), returned=True, returned_at=timezone.now()
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(librarian)
+
+    def test_rows_render_like_the_serializers(self):
+        requests = [
+            ('/api/books/', {}),
+            ('/api/books/', {'facets': 'genre', 'fields': 'id,title,available'}),
+            ('/api/books/available/', {'omit': 'created_at'}),
+            ('/api/borrows/', {}),
+            ('/api/borrows/', {'fields': 'id,book_title,user_username,returned_at'}),
+            ('/api/borrows/overdue/', {}),
+        ]
+        for url, params in requests:
+            with self.subTest(url=url, params=params):
+                with self.settings(FAST_LIST_ROWS=False):
+                    expected = self.client.get(url, params).content
+                with self.settings(FAST_LIST_ROWS=True):
+                    self.assertEqual(self.client.get(url, params).content, expected)
+
+
+class BorrowArchiveTests(TestCase):
+    def setUp(self):
+        self.reader = User.objects.create(username='reader', email='reader@example.com')
+        self.client = APIClient()
+        self.client.force_authenticate(self.reader)
+        self.dune = Book.objects.create(title='Dune', author='Frank Herbert', genre='Sci-Fi')
+        self.due_date = (date.today() + timedelta(days=14)).isoformat()
+
+    def borrow_and_return(self):
+        borrow_id = self.client.post('/api/borrows/', {'book': self.dune.pk, 'due_date': self.due_date}).data['id']
+        return self.client.post(f'/api/borrows/{borrow_id}/return/')
+
+    def test_same_book_can_be_returned_twice(self):
+        self.assertEqual(self.borrow_and_return().status_code, 200)
+        self.assertEqual(self.borrow_and_return().status_code, 200)
+        self.assertEqual(Borrow.objects.filter(user=self.reader, returned=True).count(), 2)
+
+    def test_old_returns_move_to_archive_and_history_spans_both(self):
+        now = timezone.now()
+        for days_ago in (400, 500, 10):
+            borrow = Borrow.objects.create(user=self.reader, book=self.dune, due_date=date.today(),
+                                           returned=True, returned_at=now - timedelta(days=days_ago))
+            Borrow.objects.filter(pk=borrow.pk).update(borrowed_at=now - timedelta(days=days_ago + 7))
+        self.client.post('/api/borrows/', {'book': self.dune.pk, 'due_date': self.due_date})
+
+        self.assertEqual(archive_returned_borrows(older_than_days=365, batch_size=1), 2)
+        self.assertEqual((Borrow.objects.count(), ArchivedBorrow.objects.count()), (2, 2))
+
+        for fast in (False, True):
+            with self.subTest(fast=fast), self.settings(FAST_LIST_ROWS=fast):
+                response = self.client.get('/api/borrows/my_borrows/', {'page_size': 3})
+                self.assertEqual(response.data['count'], 4)
+                self.assertEqual([borrow['returned'] for borrow in response.data['results']], [False, True, True])
+                response = self.client.get('/api/borrows/', {'page': 2, 'page_size': 3, 'fields': 'id,book_title'})
+                self.assertEqual(response.data['results'],
+                                 [{'id': ArchivedBorrow.objects.order_by('borrowed_at').first().pk,
+                                   'book_title': 'Dune'}])
+
+    def test_history_pages_come_from_indexes_without_sorting(self):
+        for scope in ({'branch': 'main'}, {'branch': 'main', 'user': self.reader}):
+            history = BorrowHistory(Borrow.objects.filter(**scope).order_by('-borrowed_at'),
+                                    ArchivedBorrow.objects.filter(**scope).order_by('-borrowed_at'))
+            with CaptureQueriesContext(connection) as queries:
+                history[:20]
+            with self.subTest(scope=scope), connection.cursor() as cursor:
+                cursor.execute(f"EXPLAIN QUERY PLAN {queries[0]['sql']}")
+                self.assertNotIn('TEMP B-TREE', ' '.join(row[-1] for row in cursor.fetchall()))
+
+
+@override_settings(FINE_RATES={'default': (25, 100), 'Reference': (100, 5000)}, FINE_GRACE_DAYS=0)
+class FineTests(TestCase):
+    def setUp(self):
+        self.reader = User.objects.create(username='reader', email='reader@example.com')
+        self.client = APIClient()
+        self.client.force_authenticate(self.reader)
+        self.today = timezone.localdate()
+
+    def loan(self, title, genre, days_overdue, **fields):
+        book = Book.objects.create(title=title, author='Author', genre=genre, total_copies=1, available_copies=0)
+        return Borrow.objects.create(user=self.reader, book=book,
+                                     due_date=self.today - timedelta(days=days_overdue), **fields)
+
+    def test_recalculation_applies_genre_rates_and_caps(self):
+        late = self.loan('Dune', 'Sci-Fi', 3)
+        capped = self.loan('Emma', 'Classic', 10)
+        reference = self.loan('Atlas', 'Reference', 10)
+        extended = self.loan('Ulysses', 'Classic', -5, fine_cents=50)
+
+        self.assertEqual(recalculate_fines(self.today), (4, 4))
+        fines = dict(Borrow.objects.values_list('pk', 'fine_cents'))
+        self.assertEqual([fines[borrow.pk] for borrow in (late, capped, reference, extended)], [75, 100, 1000, 0])
+        self.assertEqual(recalculate_fines(self.today), (3, 0))
+
+    def test_return_fixes_the_fine_and_balance_sums_it(self):
+        returned = self.loan('Dune', 'Sci-Fi', 2)
+        self.loan('Atlas', 'Reference', 1)
+        recalculate_fines(self.today)
+        self.client.post(f'/api/borrows/{returned.pk}/return/')
+        recalculate_fines(self.today + timedelta(days=1))
+
+        returned.refresh_from_db()
+        self.assertEqual(returned.fine_cents, 50)
+        self.assertEqual(self.client.get('/api/borrows/fines/').data, {
+            'user': self.reader.pk, 'total_cents': 250, 'accruing_cents': 200, 'overdue_loans': 1,
+            'as_of': (self.today + timedelta(days=1)).isoformat(),
+        })
+        self.assertEqual(self.client.get('/api/borrows/fines/', {'user': self.reader.pk}).status_code, 403)
+
+
+@override_settings(
+    FINE_RATES={'default': (25, 100)}, FINE_GRACE_DAYS=0,
+    LIBRARY_BRANCHES={
+        'main': {'name': 'Main Library', 'database': 'default'},
+        'east': {'name': 'East', 'database': 'branch_east'},
+    },
+)
+class BranchDatabaseFineTests(TransactionTestCase):
+    def setUp(self):
+        # A second connection to the test database, standing in for a
+        # branch database without a DATABASES entry.
+        settings_dict = {**connection.settings_dict}
+        connections['branch_east'] = load_backend(settings_dict['ENGINE']).DatabaseWrapper(settings_dict, 'branch_east')
+        self.addCleanup(connections['branch_east'].close)
+        self.addCleanup(delattr, connections._connections, 'branch_east')
+
+    def test_fines_are_written_through_the_branch_database(self):
+        reader = User.objects.create(username='reader', email='reader@example.com')
+        today = timezone.localdate()
+        with using_branch('east'):
+            book = Book.objects.create(title='Dune', author='Frank Herbert', genre='Sci-Fi', branch='east')
+            loan = Borrow.objects.create(user=reader, book=book, branch='east', due_date=today - timedelta(days=2))
+            with CaptureQueriesContext(connections['branch_east']) as queries:
+                self.assertEqual(recalculate_fines(today), (1, 1))
+        self.assertTrue(any('UPDATE "library_borrow" SET fine_cents' in query['sql'] for query in queries))
+        loan.refresh_from_db(using='default')
+        self.assertEqual(loan.fine_cents, 50)
+
+
+class SnapshotTests(TransactionTestCase):
+    def setUp(self):
+        self.directory = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.directory)
+        Book.objects.create(title='Dune', author='Frank Herbert', genre='Sci-Fi')
+
+    def test_compressed_snapshot_and_dump(self):
+        output = self.directory / 'library.sqlite3'
+        out = StringIO()
+        call_command('snapshot_db', output=str(output), pages=1, pause=0, compress=True, ndjson=True, stdout=out)
+        self.assertIn('(100%)', out.getvalue())
+        self.assertEqual(sorted(path.name for path in self.directory.iterdir()),
+                         ['library.ndjson.gz', 'library.sqlite3.gz'])
+
+        restored = self.directory / 'restored.sqlite3'
+        with gzip.open(self.directory / 'library.sqlite3.gz') as source:
+            restored.write_bytes(source.read())
+        snapshot = sqlite3.connect(restored)
+        self.addCleanup(snapshot.close)
+        self.assertEqual(snapshot.execute('SELECT title FROM library_book').fetchall(), [('Dune',)])
+
+        with gzip.open(self.directory / 'library.ndjson.gz', 'rt') as dump:
+            records = [json.loads(line) for line in dump]
+        self.assertEqual([record['fields']['title'] for record in records if record['model'] == 'library.book'],
+                         ['Dune'])
+
+
+    def test_copy_that_keeps_restarting_finishes_in_one_step(self):
+        def write_on_every_step(copied, total):
+            if copied < total:
+                Book.objects.create(title=f'Copy {Book.objects.count()}', author='Author', genre='Fiction')
+
+        target = self.directory / 'busy.sqlite3'
+        restarts, locked = backup_database('default', target, pages=1, pause=0, max_restarts=2,
+                                           progress=write_on_every_step)
+        self.assertEqual((restarts, locked), (3, True))
+        snapshot = sqlite3.connect(target)
+        self.addCleanup(snapshot.close)
+        (count,) = snapshot.execute('SELECT COUNT(*) FROM library_book').fetchone()
+        self.assertEqual(count, Book.objects.count())
+
+
+@override_settings(CATALOG_CHANGES_SETTLE_SECONDS=0)
+class CatalogChangesTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create(username='libby', email='libby@example.com',
+                                                           role='librarian'))
+        self.books = [Book.objects.create(title=title, author='Author', genre='Fiction')
+                      for title in ('Dune', 'Emma', 'Ulysses')]
+
+    def sync(self, since=None, **params):
+        response = self.client.get('/api/books/changes/', {'since': since or '', 'fields': 'id,title', **params})
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_pages_through_the_catalog_then_only_changes(self):
+        first = self.sync(limit=2)
+        self.assertEqual(([book['title'] for book in first['results']], first['more']), (['Dune', 'Emma'], True))
+        second = self.sync(first['next'], limit=2)
+        self.assertEqual(([book['title'] for book in second['results']], second['more']), (['Ulysses'], False))
+        self.assertEqual(self.sync(second['next'])['results'], [])
+
+        self.books[0].check_out()
+        self.client.delete(f'/api/books/{self.books[1].pk}/')
+        changes = self.sync(second['next'])
+        self.assertEqual(changes['results'], [{'id': self.books[0].pk, 'title': 'Dune'}])
+        self.assertEqual(changes['deleted'], [self.books[1].pk])
+
+    def test_rejects_malformed_tokens(self):
+        response = self.client.get('/api/books/changes/', {'since': 'yesterday'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_rejects_bad_limits(self):
+        for limit in (0, -1, 'abc', 1001):
+            response = self.client.get('/api/books/changes/', {'limit': limit})
+            self.assertEqual(response.status_code, 400, limit)
+
+    def test_empty_page_keeps_the_cursor(self):
+        token = self.sync(limit=1)['next']
+        books, deleted, next_token, more = catalog_changes(token, limit=0)
+        self.assertEqual((books, deleted, next_token, more), ([], [], token, True))
+
+
+class AvailabilityStreamTests(TestCase):
+    def test_hub_wakes_streams_of_the_branch(self):
+        hub = AvailabilityHub(buffer_size=10)
+
+        async def read():
+            stream = hub.stream('main', keepalive=5)
+            self.assertEqual(await anext(stream), b'retry: 3000\n\n')
+            pending = asyncio.ensure_future(anext(stream))
+            await asyncio.sleep(0)
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, hub.publish, 'east', {'id': 1})
+            await loop.run_in_executor(None, hub.publish, 'main', {'id': 2})
+            chunk = await pending
+            await stream.aclose()
+            return chunk
+
+        self.assertEqual(asyncio.run(read()), f'id: {hub.boot}-2\nevent: availability\ndata: {{"id":2}}\n\n'.encode())
+        self.assertEqual(hub.subscribers, 0)
+        self.assertEqual(hub.resume_position(f'{hub.boot}-1'), 1)
+        self.assertIsNone(hub.resume_position('restarted-1'))
+
+    def test_since_reads_the_tail_of_a_wrapped_buffer(self):
+        hub = AvailabilityHub(buffer_size=3)
+        for number in range(1, 6):
+            hub.publish('main' if number % 2 else 'east', {'id': number})
+        messages, seq, dropped = hub.since(3, 'main')
+        self.assertEqual((len(messages), seq, dropped), (1, 5, False))
+        self.assertIn(b'"id":5', messages[0])
+        self.assertEqual(len(hub.since(1)[0]), 3)
+        self.assertTrue(hub.since(1)[2])
+        self.assertEqual(hub.since(5), ([], 5, False))
+
+    @override_settings(STREAM_MAX_CONNECTIONS_PER_CLIENT=1)
+    def test_stream_is_public_and_capped_per_address(self):
+        factory = AsyncRequestFactory()
+        response = asyncio.run(stream.availability_stream(factory.get('/api/books/stream/')))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+
+        stream.hub.clients['127.0.0.1'] += 1
+        self.addCleanup(stream.hub.clients.clear)
+        response = asyncio.run(stream.availability_stream(factory.get('/api/books/stream/')))
+        self.assertEqual(response.status_code, 429)
+        stream.hub.clients.clear()
+        response = asyncio.run(stream.availability_stream(factory.get('/api/books/stream/')))
+        self.assertEqual(response.status_code, 200)
+
+    def test_copies_handed_to_holds_are_not_announced(self):
+        book = Book.objects.create(title='Dune', author='Frank Herbert', genre='Sci-Fi', available_copies=0)
+        reader = User.objects.create(username='reader', email='reader@example.com')
+        Hold.objects.create(user=reader, book=book, position=1)
+        stream.hub.subscribers += 1
+        self.addCleanup(stream.hub.detach)
+        published = stream.hub.seq
+
+        with self.captureOnCommitCallbacks(execute=True):
+            release_copy(book)
+        self.assertEqual(stream.hub.seq, published)
+        with self.captureOnCommitCallbacks(execute=True):
+            release_copy(book)
+        self.assertEqual(stream.hub.seq, published + 1)
+
+    def test_borrow_is_announced_after_commit(self):
+        book = Book.objects.create(title='Dune', author='Frank Herbert', genre='Sci-Fi')
+        client = APIClient()
+        client.force_authenticate(User.objects.create(username='reader', email='reader@example.com'))
+        stream.hub.subscribers += 1
+        self.addCleanup(stream.hub.detach)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            client.post('/api/borrows/', {'book': book.pk, 'due_date': date.today().isoformat()})
+        _, branch, message = stream.hub.recent[-1]
+        self.assertEqual(branch, 'main')
+        self.assertIn(f'"id":{book.pk},"branch":"main","available_copies":0,"total_copies":1,'
+                      f'"available":false'.encode(), message)
+
+    def test_stream_needs_asgi(self):
+        self.assertEqual(self.client.get('/api/books/stream/').status_code, 501)
+
+
+@override_settings(BOOK_BATCH_MAX_IDS=3)
+class BookBatchTests(TestCase):
+    def setUp(self):
+        clear_caches()
+        self.hobbit = Book.objects.create(title='Hobbit', author='Tolkien', genre='Fantasy')
+        self.dune = Book.objects.create(title='Dune', author='Herbert', genre='Sci-Fi')
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create(username='reader', email='reader@example.com'))
+
+    def test_keeps_order_and_reports_missing(self):
+        ids = f'{self.dune.pk},999,{self.hobbit.pk},{self.dune.pk}'
+        response = self.client.get('/api/books/batch/', {'ids': ids, 'fields': 'id,title'})
+        self.assertEqual(response.data, {
+            'results': [{'id': self.dune.pk, 'title': 'Dune'}, {'id': self.hobbit.pk, 'title': 'Hobbit'}],
+            'missing': [999],
+        })
+
+        response = self.client.post('/api/books/batch/', {'ids': [self.hobbit.pk]}, format='json')
+        self.assertEqual(response.data['results'][0]['author'], 'Tolkien')
+
+    def test_books_are_cached_until_the_catalog_changes(self):
+        params = {'ids': str(self.hobbit.pk), 'fields': 'id,title'}
+        self.client.get('/api/books/batch/', params)
+        with self.assertNumQueries(0):
+            self.client.get('/api/books/batch/', params)
+
+        self.hobbit.title = 'The Hobbit'
+        self.hobbit.save()
+        response = self.client.get('/api/books/batch/', params)
+        self.assertEqual(response.data['results'][0]['title'], 'The Hobbit')
+
+    def test_availability_is_never_served_from_cache(self):
+        first = self.client.get('/api/books/batch/', {'ids': str(self.hobbit.pk)}).data['results'][0]
+        self.hobbit.check_out()
+        with self.assertNumQueries(1):
+            again = self.client.get('/api/books/batch/', {'ids': str(self.hobbit.pk)}).data['results'][0]
+        self.assertEqual((first['available'], again['available'], again['available_copies']), (True, False, 0))
+        self.assertEqual(list(again), list(first))
+
+    def test_rejects_bad_and_oversized_requests(self):
+        self.assertEqual(self.client.get('/api/books/batch/', {'ids': '1,x'}).status_code, 400)
+        self.assertEqual(self.client.get('/api/books/batch/', {'ids': '1,2,3,4'}).status_code, 400)
+        self.assertEqual(self.client.get('/api/books/batch/').status_code, 400)
+
+
+class SchemaTests(SimpleTestCase):
+    def setUp(self):
+        self.base_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.base_dir)
+        schema._schema_json = None
+        self.addCleanup(setattr, schema, '_schema_json', None)
+
+    def test_serves_the_prebuilt_schema(self):
+        path = schema.write_schema(f'{self.base_dir}/openapi.json')
+        with open(path, 'rb') as schema_file:
+            built = schema_file.read()
+        self.assertIn(b'/books/batch/', built)
+
+        with override_settings(API_SCHEMA_PATH=path):
+            response = self.client.get('/swagger.json')
+        self.assertEqual(response.content, built)
+        self.assertEqual(self.client.get('/api/swagger/').status_code, 404)
+
+
+class ThrottleTests(TestCase):
+    def setUp(self):
+        base_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, base_dir)
+        overrides = override_settings(
+            THROTTLE_DB_PATH=f'{base_dir}/throttle.sqlite3',
+            THROTTLE_BUCKETS={
+                'api': {'librarian': ('60/min', 5), 'user': ('60/min', 5), 'anon': ('60/min', 5)},
+                'search': {'librarian': ('60/min', 3), 'user': ('60/min', 1)},
+                'login': {'anon': ('60/min', 1)},
+            },
+        )
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        self.client = APIClient()
+
+    def test_bucket_refills_over_time(self):
+        self.assertEqual(take_token('k', rate=1.0, burst=2, now=100), (True, 0.0))
+        self.assertEqual(take_token('k', rate=1.0, burst=2, now=100), (True, 0.0))
+        self.assertEqual(take_token('k', rate=1.0, burst=2, now=100.25), (False, 0.75))
+        self.assertEqual(take_token('k', rate=1.0, burst=2, now=101), (True, 0.0))
+
+    def test_full_buckets_are_purged(self):
+        take_token('idle', rate=1.0, burst=2, now=100)
+        take_token('busy', rate=1.0, burst=2, now=100)
+        take_token('busy', rate=1.0, burst=2, now=100)
+        self.assertEqual(purge_buckets(now=101), 1)
+        self.assertEqual(purge_buckets(now=102), 1)
+
+        # The first take at 100 scheduled the next purge for 400.
+        take_token('idle', rate=1.0, burst=2, now=200)
+        take_token('other', rate=1.0, burst=2, now=400)
+        self.assertEqual(purge_buckets(now=1000), 1)
+
+    def test_searches_are_limited_per_role(self):
+        self.client.force_authenticate(User.objects.create(username='reader', email='reader@example.com'))
+        self.assertEqual(self.client.get('/api/books/', {'search': 'x'}).status_code, 200)
+        response = self.client.get('/api/books/', {'search': 'x'})
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '1')
+        self.assertEqual(self.client.get('/api/books/').status_code, 200)
+
+        self.client.force_authenticate(User.objects.create(
+            username='librarian', email='librarian@example.com', role='librarian'
+        ))
+        statuses = [self.client.get('/api/books/', {'search': 'x'}).status_code for _ in range(4)]
+        self.assertEqual(statuses, [200, 200, 200, 429])
+
+    def test_login_attempts_are_limited_per_address(self):
+        credentials = {'username': 'nobody', 'password': 'wrong'}
+        self.assertEqual(self.client.post('/api/login/', credentials).status_code, 401)
+        self.assertEqual(self.client.post('/api/login/', credentials).status_code, 429)
+
+
+class SuggestTests(TestCase):
+    def setUp(self):
+        self.hobbit = Book.objects.create(title='The Hobbit', author='J.R.R. Tolkien', genre='Fantasy')
+        Book.objects.create(title='The Silmarillion', author='J.R.R. Tolkien', genre='Fantasy')
+        suggest._indexes.clear()
+        self.addCleanup(suggest._indexes.clear)
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create(username='reader', email='reader@example.com'))
+
+    def texts(self, query):
+        return [item['text'] for item in self.client.get('/api/books/suggest/', {'q': query}).data]
+
+    def test_prefix_matches_titles_and_authors(self):
+        self.assertEqual(self.texts('hob'), ['The Hobbit'])
+        self.assertEqual(self.texts('the '), ['The Hobbit', 'The Silmarillion'])
+        self.assertEqual(self.texts('j.r'), ['J.R.R. Tolkien'])
+
+    def test_signals_keep_index_current(self):
+        self.texts('hob')
+        self.hobbit.title = 'Hobbit, or There and Back Again'
+        self.hobbit.save()
+        Book.objects.create(title='Holes', author='Louis Sachar', genre='Children')
+        self.assertEqual(self.texts('ho'), ['Hobbit, or There and Back Again', 'Holes'])
+
+        Book.objects.filter(author='J.R.R. Tolkien').delete()
+        self.assertEqual(self.texts('j'), [])
+
+    @override_settings(LIBRARY_BRANCHES=BRANCHES_SHARING_PRIMARY)
+    def test_suggestions_come_from_the_current_branch(self):
+        Book.objects.create(title='The Hollow Hills', author='Mary Stewart', genre='Fantasy', branch='east')
+        self.assertEqual(self.texts('ho'), ['The Hobbit'])
+        response = self.client.get('/api/books/suggest/', {'q': 'ho'}, HTTP_X_LIBRARY_BRANCH='east')
+        self.assertEqual([item['text'] for item in response.data], ['The Hollow Hills'])
+
+    def test_index_is_packed(self):
+        index = suggest.SuggestIndex.from_rows([(1, 'The Hobbit', 'J.R.R. Tolkien'), (2, 'Holes', 'Louis Sachar')])
+        self.assertEqual(len(index.offsets), 6)
+        self.assertEqual(len(index), 5)
+        index.add_book(3, 'Hobbit Lore', 'J.R.R. Tolkien')
+        index.remove_book(2, 'Holes', 'Louis Sachar')
+        self.assertEqual([item['text'] for item in index.search('ho')], ['The Hobbit', 'Hobbit Lore'])
+        self.assertEqual([item['text'] for item in index.search('l')], [])
+
+
+class FuzzySearchTests(TestCase):
+    def setUp(self):
+        Book.objects.create(title='The Hobbit', author='J.R.R. Tolkien', genre='Fantasy')
+        Book.objects.create(title='Crime and Punishment', author='Fyodor Dostoevsky', genre='Classic')
+        Book.objects.create(title='Dune', author='Frank Herbert', genre='Sci-Fi')
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create(username='reader', email='reader@example.com'))
+
+    def titles(self, query):
+        response = self.client.get('/api/books/', {'search': query, 'fuzzy': '1'})
+        return [book['title'] for book in response.data['results']]
+
+    def test_misspelt_authors_are_found(self):
+        self.assertEqual(self.titles('Tolkein'), ['The Hobbit'])
+        self.assertEqual(self.titles('Dostoyevsky'), ['Crime and Punishment'])
+        self.assertEqual(self.titles('Crime and Punishmnet'), ['Crime and Punishment'])
+
+    @override_settings(LIBRARY_BRANCHES=BRANCHES_SHARING_PRIMARY)
+    def test_candidates_come_from_the_current_branch(self):
+        Book.objects.create(title='Dune Messiah', author='Frank Herbert', genre='Sci-Fi', branch='east')
+        self.assertEqual(self.titles('Frank Hebert'), ['Dune'])
+        with override_settings(FUZZY_SEARCH_CANDIDATES=1):
+            self.assertEqual(self.titles('Frank Hebert'), ['Dune'])
+
+    def test_edits_reindex_the_book(self):
+        book = Book.objects.get(title='Dune')
+        book.author = 'Brian Herbert'
+        book.save()
+        self.assertEqual(self.titles('Brain Herbert'), ['Dune'])
+        self.assertEqual(self.titles('Frank'), [])
+
+
+class AdminTests(TestCase):
+    def setUp(self):
+        self.librarian = User.objects.create_superuser(username='admin', email='admin@example.com',
+                                                       password='secret-pass-1')
+        self.client.force_login(self.librarian)
+        self.book = Book.objects.create(title='Dune', author='Frank Herbert', genre='Sci-Fi',
+                                        total_copies=3, available_copies=1)
+        self.readers = [User.objects.create(username=f'reader{i}', email=f'reader{i}@example.com') for i in range(2)]
+        self.borrows = [Borrow.objects.create(user=reader, book=self.book, due_date=date.today())
+                        for reader in self.readers]
+
+    def test_changelist_search_uses_indexed_lookups(self):
+        response = self.client.get('/admin/library/borrow/', {'q': 'reader1'})
+        self.assertEqual(list(response.context['cl'].result_list), [self.borrows[1]])
+        response = self.client.get('/admin/library/borrow/', {'q': 'dun'})
+        self.assertEqual(response.context['cl'].result_count, 2)
+
+    @override_settings(ADMIN_EXACT_COUNT_LIMIT=1)
+    def test_large_changelists_use_estimated_count(self):
+        response = self.client.get('/admin/library/borrow/')
+        self.assertEqual(response.context['cl'].result_count, 2)
+
+    def test_bulk_mark_returned_restocks_copies(self):
+        self.client.post('/admin/library/borrow/', {
+            'action': 'mark_returned',
+            '_selected_action': [borrow.pk for borrow in self.borrows],
+        })
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.available_copies, 3)
+        self.assertFalse(Borrow.objects.filter(returned=False).exists())
+
+    def test_bulk_mark_available_recounts_shelf(self):
+        Book.objects.filter(pk=self.book.pk).update(available_copies=0)
+        self.client.post('/admin/library/book/', {
+            'action': 'mark_available',
+            '_selected_action': [self.book.pk],
+        })
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.available_copies, 1)
+
+    def test_recounted_copies_go_to_waiting_holds(self):
+        Book.objects.filter(pk=self.book.pk).update(available_copies=0)
+        waiting = User.objects.create(username='waiting', email='waiting@example.com')
+        hold = Hold.objects.create(user=waiting, book=self.book, position=1)
+        self.client.post('/admin/library/book/', {
+            'action': 'mark_available',
+            '_selected_action': [self.book.pk],
+        })
+        hold.refresh_from_db()
+        self.book.refresh_from_db()
+        self.assertEqual(hold.status, Hold.READY)
+        self.assertEqual(self.book.available_copies, 0)
+        self.assertTrue(Event.objects.filter(kind=Event.BOOK_UPDATED, object_id=self.book.pk).exists())
+
+
+@override_settings(EVENTS_SETTLE_SECONDS=0)
+class EventFeedTests(TestCase):
+    def setUp(self):
+        self.librarian = APIClient()
+        self.librarian.force_authenticate(User.objects.create(username='libby', email='libby@example.com',
+                                                              role='librarian'))
+        self.reader = APIClient()
+        self.reader.force_authenticate(User.objects.create(username='reader', email='reader@example.com'))
+
+    def test_changes_are_logged_and_paged_by_cursor(self):
+        book_id = self.librarian.post('/api/books/', {'title': 'Dune', 'author': 'Frank Herbert',
+                                                      'genre': 'Sci-Fi'}).data['id']
+        self.librarian.patch(f'/api/books/{book_id}/', {'total_copies': 2})
+        borrow_id = self.reader.post('/api/borrows/', {'book': book_id,
+                                                       'due_date': date.today().isoformat()}).data['id']
+        self.reader.post(f'/api/borrows/{borrow_id}/return/')
+        self.librarian.delete(f'/api/books/{book_id}/')
+
+        first = self.librarian.get('/api/events/', {'limit': 3}).data
+        second = self.librarian.get('/api/events/', {'after': first['next']}).data
+        kinds = [event['kind'] for event in first['results'] + second['results']]
+        self.assertEqual(kinds, ['book.created', 'book.updated', 'borrow.created', 'borrow.returned',
+                                 'book.deleted'])
+        self.assertEqual(self.reader.get('/api/events/').status_code, 403)
+
+    def test_rejects_bad_cursor_and_limit(self):
+        for params in ({'after': -1}, {'after': 'x'}, {'limit': 0}, {'limit': -5}, {'limit': 'x'}):
+            self.assertEqual(self.librarian.get('/api/events/', params).status_code, 400, params)
+
+    def test_consumer_resumes_after_last_batch(self):
+        Book.objects.create(title='Dune', author='Frank Herbert', genre='Sci-Fi')
+        seen = []
+        self.assertEqual(consume_events('search-sync', seen.extend), 1)
+        Book.objects.create(title='Emma', author='Jane Austen', genre='Classic')
+        self.assertEqual(consume_events('search-sync', seen.extend), 1)
+        self.assertEqual([event.payload['title'] for event in seen], ['Dune', 'Emma'])
+
+
+@override_settings(REMINDER_BATCH_SIZE=2, JOB_RETRY_BASE_SECONDS=0)
+class JobQueueTests(TestCase):
+    def test_reminders_run_in_batches_and_reschedule(self):
+        today = timezone.localdate()
+        book = Book.objects.create(title='Dune', author='Frank Herbert', genre='Sci-Fi', total_copies=5)
+        for index, due in enumerate([today + timedelta(days=1), today - timedelta(days=3),
+                                     today + timedelta(days=1), today + timedelta(days=7)]):
+            user = User.objects.create(username=f'reader{index}', email=f'reader{index}@example.com')
+            Borrow.objects.create(user=user, book=book, due_date=due)
+
+        schedule_reminders(today)
+        schedule_reminders(today)
+        Job.objects.update(run_at=timezone.now())
+        while work():
+            pass
+
+        self.assertEqual(sorted(message.subject for message in mail.outbox),
+                         ['Due tomorrow: Dune', 'Due tomorrow: Dune', 'Overdue: Dune'])
+        self.assertEqual(Job.objects.filter(status=Job.DONE).count(), 2)
+        self.assertTrue(Job.objects.filter(status=Job.QUEUED, unique_key=f'reminders:{today + timedelta(days=1)}')
+                        .exists())
+
+    @override_settings(JOB_HANDLERS={'reminders.send': 'library.tests.failing_handler'})
+    def test_failed_jobs_retry_then_fail(self):
+        job = enqueue('reminders.send', max_attempts=2)
+        work()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.QUEUED, 1))
+        work()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.FAILED, 2))
+        self.assertIn('RuntimeError', job.last_error)
+
+
+def failing_handler(payload):
+    raise RuntimeError('boom')
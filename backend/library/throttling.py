@@ -0,0 +1,149 @@
+"""
+Token-bucket request throttling.
+
+Every (endpoint group, role, client) has a bucket that refills at a steady
+rate up to a burst size; each request takes one token. Buckets live in a
+small SQLite file (THROTTLE_DB_PATH) so every worker process on the host
+draws from the same bucket, and one UPSERT both refills and takes a token,
+so concurrent workers cannot overspend it. Buckets that have refilled
+completely are deleted every THROTTLE_PURGE_SECONDS, so the file only
+holds recently active clients.
+"""
+import os
+import sqlite3
+import threading
+import time
+
+from django.conf import settings
+from rest_framework.throttling import BaseThrottle
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS bucket (
+    key TEXT PRIMARY KEY,
+    tokens REAL NOT NULL,
+    updated REAL NOT NULL,
+    full_at REAL NOT NULL DEFAULT 0
+) WITHOUT ROWID
+'''
+
+FULL_AT_INDEX = 'CREATE INDEX IF NOT EXISTS bucket_full_at ON bucket (full_at)'
+
+# Refill, then take a token only if a whole one is left. No row comes
+# back when the bucket is empty. full_at is when the bucket will be full
+# again if left alone.
+TAKE = '''
+INSERT INTO bucket (key, tokens, updated, full_at) VALUES (:key, :burst - 1, :now, :now + 1 / :rate)
+ON CONFLICT (key) DO UPDATE SET
+    tokens = MIN(:burst, tokens + (:now - updated) * :rate) - 1,
+    updated = :now,
+    full_at = :now + (:burst + 1 - MIN(:burst, tokens + (:now - updated) * :rate)) / :rate
+WHERE MIN(:burst, tokens + (:now - updated) * :rate) >= 1
+RETURNING tokens
+'''
+
+# A full bucket behaves exactly like a missing one, so it can go.
+PURGE = 'DELETE FROM bucket WHERE full_at <= :now'
+
+PEEK = 'SELECT MIN(:burst, tokens + (:now - updated) * :rate) FROM bucket WHERE key = :key'
+
+PERIODS = {'s': 1, 'sec': 1, 'm': 60, 'min': 60, 'h': 3600, 'hour': 3600, 'd': 86400, 'day': 86400}
+
+_local = threading.local()
+
+
+def parse_rate(rate):
+    """
+    '120/min' -> 2.0 tokens per second.
+    """
+    count, period = rate.split('/')
+    return int(count) / PERIODS[period]
+
+
+def _connection():
+    path = str(settings.THROTTLE_DB_PATH)
+    connection = getattr(_local, 'connection', None)
+    if connection is None or _local.path != path:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        connection = sqlite3.connect(path, timeout=1, isolation_level=None, check_same_thread=False)
+        connection.execute('PRAGMA journal_mode=WAL')
+        # Losing a few bucket updates in a crash is harmless.
+        connection.execute('PRAGMA synchronous=OFF')
+        connection.execute(SCHEMA)
+        columns = {row[1] for row in connection.execute('PRAGMA table_info(bucket)')}
+        if 'full_at' not in columns:
+            # Buckets from before full_at existed are purged on the first pass.
+            connection.execute('ALTER TABLE bucket ADD COLUMN full_at REAL NOT NULL DEFAULT 0')
+        connection.execute(FULL_AT_INDEX)
+        _local.connection, _local.path, _local.purge_at = connection, path, 0.0
+    return connection
+
+
+def purge_buckets(now=None):
+    """
+    Delete buckets that have refilled completely. Returns how many went.
+    """
+    return _connection().execute(PURGE, {'now': time.time() if now is None else now}).rowcount
+
+
+def take_token(key, rate, burst, now=None):
+    """
+    Take one token from ``key``'s bucket. Returns (allowed, seconds until
+    a token is available).
+    """
+    params = {'key': key, 'rate': rate, 'burst': burst, 'now': time.time() if now is None else now}
+    connection = _connection()
+    if params['now'] >= _local.purge_at:
+        _local.purge_at = params['now'] + getattr(settings, 'THROTTLE_PURGE_SECONDS', 300)
+        connection.execute(PURGE, params)
+    if connection.execute(TAKE, params).fetchone() is not None:
+        return True, 0.0
+
+    row = connection.execute(PEEK, params).fetchone()
+    tokens = row[0] if row else burst
+    return False, max(0.0, (1 - tokens) / rate)
+
+
+def role_of(user):
+    if user is None or not user.is_authenticated:
+        return 'anon'
+    return 'librarian' if hasattr(user, 'role') and user.role == 'librarian' else 'user'
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """
+    Throttles by the view's ``throttle_scope`` (``api`` by default) and the
+    caller's role, using the rates in THROTTLE_BUCKETS. Authenticated
+    callers are tracked by user id, anonymous ones by client address.
+    """
+    default_scope = 'api'
+
+    def get_scope(self, request, view):
+        return getattr(view, 'throttle_scope', self.default_scope)
+
+    def allow_request(self, request, view):
+        self.wait_seconds = None
+        scope = self.get_scope(request, view)
+        role = role_of(request.user)
+        limit = getattr(settings, 'THROTTLE_BUCKETS', {}).get(scope, {}).get(role)
+        if limit is None:
+            return True
+
+        rate, burst = limit
+        ident = request.user.pk if role != 'anon' else self.get_ident(request)
+        allowed, self.wait_seconds = take_token(f'{scope}:{role}:{ident}', parse_rate(rate), burst)
+        return allowed
+
+    def wait(self):
+        return self.wait_seconds
+
+
+class SearchThrottle(TokenBucketThrottle):
+    """
+    A second, tighter bucket for searches and autocomplete, on top of the
+    view's own scope.
+    """
+
+    def get_scope(self, request, view):
+        if request.query_params.get('search') or getattr(view, 'action', None) == 'suggest':
+            return 'search'
+        return None
@@ -0,0 +1,111 @@
+"""
+Trending books.
+
+Each borrow adds exp(k * (t - epoch)) to its book's score, where
+k = ln 2 / half-life. Dividing every score by exp(k * (now - epoch)) gives the
+decayed borrow count, and since that factor is shared by all books the stored
+scores can be ranked directly from an index without touching old rows.
+normalize_trending moves the epoch forward from time to time so the stored
+numbers stay small.
+"""
+import math
+
+from django.conf import settings
+from django.db import IntegrityError
+from django.db.models import F, OuterRef, Subquery
+from django.utils import timezone
+
+from .archive import borrow_history
+from .models import Book, BookPopularity, PopularityEpoch
+from .routers import branch_atomic, current_branch
+
+SCORE_FLOOR = 1e-6
+
+
+def decay_rate():
+    half_life = getattr(settings, 'TRENDING_HALF_LIFE_DAYS', 7) * 86400
+    return math.log(2) / half_life
+
+
+def get_epoch():
+    epoch, _ = PopularityEpoch.objects.get_or_create(pk=1, defaults={'epoch': timezone.now()})
+    return epoch.epoch
+
+
+def growth(when, epoch):
+    return math.exp(decay_rate() * (when - epoch).total_seconds())
+
+
+def record_borrow(book, when=None):
+    increment = growth(when or timezone.now(), get_epoch())
+    updated = BookPopularity.objects.filter(book_id=book.pk).update(
+        score=F('score') + increment, genre=book.genre
+    )
+    if not updated:
+        try:
+            with branch_atomic():
+                BookPopularity.objects.create(book_id=book.pk, genre=book.genre, score=increment)
+        except IntegrityError:
+            BookPopularity.objects.filter(book_id=book.pk).update(score=F('score') + increment)
+
+
+def current_score(score, epoch, now=None):
+    return score / growth(now or timezone.now(), epoch)
+
+
+def trending_books(genre=None):
+    queryset = Book.objects.filter(branch=current_branch(), popularity__score__gt=0).select_related('popularity')
+    if genre:
+        queryset = queryset.filter(popularity__genre=genre)
+    return queryset.order_by('-popularity__score', 'pk')
+
+
+@branch_atomic()
+def normalize(now=None):
+    """
+    Move the epoch to ``now``, rescale every score to match, drop scores that
+    have decayed to nothing and refresh the copied genres. Returns the number
+    of books still ranked.
+    """
+    now = now or timezone.now()
+    epoch = PopularityEpoch.objects.select_for_update().filter(pk=1).first()
+    if epoch is None:
+        PopularityEpoch.objects.create(pk=1, epoch=now)
+        return BookPopularity.objects.count()
+
+    factor = 1 / growth(now, epoch.epoch)
+    BookPopularity.objects.update(
+        score=F('score') * factor,
+        genre=Subquery(Book.objects.filter(pk=OuterRef('book_id')).values('genre')[:1]),
+    )
+    BookPopularity.objects.filter(score__lt=SCORE_FLOOR).delete()
+    epoch.epoch = now
+    epoch.save(update_fields=['epoch'])
+    return BookPopularity.objects.count()
+
+
+@branch_atomic()
+def rebuild(now=None):
+    """
+    Recompute every score from the full borrow history, archive included.
+    """
+    now = now or timezone.now()
+    PopularityEpoch.objects.update_or_create(pk=1, defaults={'epoch': now})
+    scores = {}
+    genres = {}
+    for book_id, genre, borrowed_at in (
+        borrow_history().values_list('book_id', 'book__genre', 'borrowed_at').iterator(chunk_size=10000)
+    ):
+        scores[book_id] = scores.get(book_id, 0.0) + growth(borrowed_at, now)
+        genres[book_id] = genre
+
+    BookPopularity.objects.all().delete()
+    BookPopularity.objects.bulk_create(
+        [
+            BookPopularity(book_id=book_id, genre=genres[book_id], score=score)
+            for book_id, score in scores.items()
+            if score >= SCORE_FLOOR
+        ],
+        batch_size=1000,
+    )
+    return len(scores)
@@ -4,21 +4,122 @@ from rest_framework.response import Response
 from rest_framework.filters import SearchFilter, OrderingFilter
 from rest_framework.pagination import PageNumberPagination
 from rest_framework.exceptions import ValidationError, PermissionDenied
+from rest_framework_simplejwt.views import TokenObtainPairView
+from datetime import date, timedelta
 from django.utils import timezone
-from django.db.models import Q
-from .models import User, Book, Borrow
-from .serializers import RegisterSerializer, BookSerializer, BorrowSerializer
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Case, Count, Q, Value, When
+from .models import User, ArchivedBorrow, Book, Borrow, Event, Hold
+from .serializers import RegisterSerializer, BookSerializer, BorrowSerializer, HoldSerializer, EventSerializer
+from .analytics import GRANULARITIES, borrow_series
+from .archive import BorrowHistory
+from .branches import search_all_branches
+from .caching import availability_version, catalog_version, make_key
+from .changes import catalog_changes
+from .events import events_after, record_borrow_event
+from .fines import fine_balance, fine_for
+from .fuzzy import fuzzy_search
+from .holds import cancel_hold, fulfill_ready_hold, place_hold, release_copy, withdraw_waiting_hold
+from .suggest import complete
+from .trending import current_score, get_epoch, record_borrow, trending_books
 from .permissions import IsLibrarian, IsLibrarianOrReadOnly
+from .stream import announce_availability
+from .routers import activate_branch, branch_atomic, current_branch, deactivate_branch, get_branches
+
+def int_param(params, name, default=None, minimum=0, maximum=None):
+    """
+    Query parameter ``name`` as an int, or ``default`` when it is absent.
+    Anything else, or a value outside ``minimum``..``maximum``, is a 400.
+    """
+    value = params.get(name)
+    if value is None or value == '':
+        return default
+    try:
+        number = int(value)
+    except ValueError:
+        raise ValidationError({name: 'Must be an integer'})
+    if number < minimum:
+        raise ValidationError({name: f'Must be at least {minimum}'})
+    if maximum is not None and number > maximum:
+        raise ValidationError({name: f'Must be at most {maximum}'})
+    return number
 
 class StandardResultsSetPagination(PageNumberPagination):
     page_size = 10
     page_size_query_param = 'page_size'
     max_page_size = 100
 
+class BranchViewMixin:
+    """
+    Runs the request against one library branch: the one named by the
+    ``X-Library-Branch`` header or ``?branch=``, else the caller's home
+    branch.
+    """
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        code = (
+            request.headers.get('X-Library-Branch')
+            or request.query_params.get('branch')
+            or getattr(request.user, 'home_branch', None)
+            or settings.DEFAULT_BRANCH
+        )
+        if code not in get_branches():
+            raise ValidationError({'branch': f"Unknown branch: {code}"})
+        self.branch_token = activate_branch(code)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        if getattr(self, 'branch_token', None) is not None:
+            deactivate_branch(self.branch_token)
+            self.branch_token = None
+        return super().finalize_response(request, response, *args, **kwargs)
+
+class SparseFieldsetViewMixin:
+    """
+    Loads only the columns a ``?fields=``/``?omit=`` request will render.
+    """
+    def sparse(self, queryset, select_related=()):
+        only = self.get_serializer_class().only_for(self.request)
+        if only is None:
+            return queryset.select_related(*select_related) if select_related else queryset
+
+        traversed = {path.split('__')[0] for path in only if '__' in path}
+        related = [relation for relation in select_related if relation in traversed]
+        if related:
+            queryset = queryset.select_related(*related)
+        return queryset.only(*only)
+
+    def list_response(self, queryset):
+        """
+        Paginated response for a read-only listing. With FAST_LIST_ROWS the
+        rows come straight from ``values_list()`` instead of serializing
+        model instances; the JSON is the same either way.
+        """
+        if not getattr(settings, 'FAST_LIST_ROWS', False):
+            page = self.paginate_queryset(queryset)
+            if page is not None:
+                serializer = self.get_serializer(page, many=True)
+                return self.get_paginated_response(serializer.data)
+
+            serializer = self.get_serializer(queryset, many=True)
+            return Response(serializer.data)
+
+        columns, build = self.get_serializer_class().row_builder(self.request)
+        rows = queryset.values_list(*columns)
+        page = self.paginate_queryset(rows)
+        if page is not None:
+            return self.get_paginated_response(build(page))
+
+        return Response(build(rows))
+
+class LoginView(TokenObtainPairView):
+    throttle_scope = 'login'
+
 class RegisterViewSet(viewsets.GenericViewSet):
     queryset = User.objects.all()
     serializer_class = RegisterSerializer
     permission_classes = [permissions.AllowAny]
+    throttle_scope = 'login'
 
     def create(self, request):
         serializer = self.get_serializer(data=request.data)
@@ -29,7 +130,7 @@ class RegisterViewSet(viewsets.GenericViewSet):
             status=status.HTTP_201_CREATED
         )
 
-class BookViewSet(viewsets.ModelViewSet):
+class BookViewSet(BranchViewMixin, SparseFieldsetViewMixin, viewsets.ModelViewSet):
     queryset = Book.objects.all().order_by('-created_at')
     serializer_class = BookSerializer
     permission_classes = [IsLibrarianOrReadOnly]
@@ -38,67 +139,334 @@ class BookViewSet(viewsets.ModelViewSet):
     ordering_fields = ['title', 'author', 'created_at']
     pagination_class = StandardResultsSetPagination
 
+    FACET_FIELDS = ('genre', 'available')
+    FACET_IGNORED_PARAMS = ('page', 'page_size', 'ordering', 'facets')
+    BATCH_LIVE_FIELDS = ('available', 'available_copies', 'updated_at')
+
     def get_queryset(self):
-        queryset = Book.objects.all()
+        if getattr(self, 'swagger_fake_view', False):
+            return Book.objects.none()
+
+        queryset = Book.objects.filter(branch=current_branch())
         available_only = self.request.query_params.get('available', None)
         if available_only is not None:
-            queryset = queryset.filter(available=True)
-        return queryset.order_by('-created_at')
+            queryset = queryset.filter(available_copies__gt=0)
+        return self.sparse(queryset).order_by('-created_at')
+
+    @branch_atomic()
+    def perform_create(self, serializer):
+        serializer.save(branch=current_branch())
+
+    @branch_atomic()
+    def perform_update(self, serializer):
+        book = serializer.save()
+        announce_availability([book.pk])
+
+    @branch_atomic()
+    def perform_destroy(self, instance):
+        instance.delete()
+
+    def filter_queryset(self, queryset):
+        params = self.request.query_params
+        if params.get('fuzzy') not in ('1', 'true'):
+            return super().filter_queryset(queryset)
+
+        search = params.get('search', '').strip()
+        if search:
+            ranked = [book_id for book_id, _ in fuzzy_search(search)]
+            queryset = queryset.filter(pk__in=ranked).order_by(
+                Case(*[When(pk=book_id, then=Value(position)) for position, book_id in enumerate(ranked)])
+            )
+        if 'ordering' in params:
+            queryset = OrderingFilter().filter_queryset(self.request, queryset, self)
+        return queryset
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        facets = self.get_facets(queryset)
+
+        response = self.list_response(queryset)
+        if facets is not None:
+            if isinstance(response.data, list):
+                response.data = {'results': response.data, 'facets': facets}
+            else:
+                response.data['facets'] = facets
+        return response
+
+    def get_facets(self, queryset):
+        requested = self.request.query_params.get('facets', None)
+        if not requested:
+            return None
+
+        fields = [field.strip() for field in requested.split(',') if field.strip()]
+        unknown = set(fields) - set(self.FACET_FIELDS)
+        if unknown:
+            raise ValidationError({'facets': f"Unknown facets: {', '.join(sorted(unknown))}"})
+
+        filters = sorted(
+            (key, value) for key, value in self.request.query_params.items()
+            if key not in self.FACET_IGNORED_PARAMS
+        )
+        # Availability counts, and any ?available= filter, also go stale
+        # with every borrow and return.
+        shelf = availability_version() if 'available' in fields or 'available' in self.request.query_params else None
+        key = make_key('book-facets', catalog_version(), shelf, current_branch(), filters)
+        counts = cache.get(key)
+        if counts is None:
+            # One grouped query answers both facets: per-genre totals, and
+            # how many of each genre have a copy on the shelf.
+            counts = list(
+                queryset.order_by()
+                .values('genre')
+                .annotate(total=Count('id'), available=Count('id', filter=Q(available_copies__gt=0)))
+            )
+            cache.set(key, counts, getattr(settings, 'FACET_CACHE_SECONDS', 60))
+
+        facets = {}
+        if 'genre' in fields:
+            facets['genre'] = [
+                {'value': row['genre'], 'count': row['total']}
+                for row in sorted(counts, key=lambda row: (-row['total'], row['genre']))
+            ]
+        if 'available' in fields:
+            available = sum(row['available'] for row in counts)
+            facets['available'] = {
+                'true': available,
+                'false': sum(row['total'] for row in counts) - available,
+            }
+        return facets
 
     @action(detail=False, methods=['get'])
     def available(self, request):
-        available_books = Book.objects.filter(available=True)
-        page = self.paginate_queryset(available_books)
+        available_books = self.sparse(
+            Book.objects.filter(branch=current_branch(), available_copies__gt=0)
+        ).order_by('-created_at')
+        return self.list_response(available_books)
+
+    @action(detail=False, methods=['get', 'post'], permission_classes=[permissions.IsAuthenticated])
+    def batch(self, request):
+        """
+        Several books in one call: ``?ids=1,2,3``, or ``{"ids": [...]}`` in a
+        POST body for long lists. Results keep the requested order and ids
+        that do not exist are listed under ``missing``.
+        """
+        book_ids = self._batch_ids(request)
+        params = request.query_params if request.method == 'GET' else {}
+        version = catalog_version()
+        keys = {
+            book_id: make_key('book', version, current_branch(), book_id, params.get('fields'), params.get('omit'))
+            for book_id in book_ids
+        }
+
+        cached = cache.get_many(keys.values())
+        found = {book_id: cached[key] for book_id, key in keys.items() if key in cached}
+
+        # Borrows and returns change these without bumping the catalog
+        # version, so they are never cached and are read fresh instead.
+        fields = self.get_serializer().fields
+        live = [name for name in self.BATCH_LIVE_FIELDS if name in fields]
+        if live and found:
+            shelf = {
+                book.pk: book for book in
+                Book.objects.filter(branch=current_branch(), pk__in=found).only('available_copies', 'updated_at')
+            }
+            for book_id, data in list(found.items()):
+                if book_id not in shelf:
+                    del found[book_id]
+                    continue
+                for name in live:
+                    data[name] = fields[name].to_representation(fields[name].get_attribute(shelf[book_id]))
+                found[book_id] = {name: data[name] for name in fields if name in data}
+
+        wanted = [book_id for book_id in book_ids if book_id not in found]
+        if wanted:
+            books = self.sparse(Book.objects.filter(branch=current_branch(), pk__in=wanted))
+            fetched = {book.pk: self.get_serializer(book).data for book in books}
+            cache.set_many(
+                {
+                    keys[book_id]: {name: value for name, value in data.items() if name not in live}
+                    for book_id, data in fetched.items()
+                },
+                getattr(settings, 'BOOK_BATCH_CACHE_SECONDS', 30)
+            )
+            found.update(fetched)
+
+        return Response({
+            'results': [found[book_id] for book_id in book_ids if book_id in found],
+            'missing': [book_id for book_id in book_ids if book_id not in found],
+        })
+
+    def _batch_ids(self, request):
+        if request.method == 'GET':
+            raw = [value for value in request.query_params.get('ids', '').split(',') if value.strip()]
+        else:
+            raw = request.data.get('ids', []) if isinstance(request.data, dict) else []
+            if not isinstance(raw, list):
+                raise ValidationError({'ids': 'Must be a list of book ids'})
+
+        try:
+            book_ids = list(dict.fromkeys(int(value) for value in raw))
+        except (TypeError, ValueError):
+            raise ValidationError({'ids': 'Book ids must be integers'})
+        if not book_ids:
+            raise ValidationError({'ids': 'At least one book id is required'})
+
+        limit = getattr(settings, 'BOOK_BATCH_MAX_IDS', 200)
+        if len(book_ids) > limit:
+            raise ValidationError({'ids': f'At most {limit} ids per request'})
+        return book_ids
+
+    @action(detail=False, methods=['get'])
+    def suggest(self, request):
+        try:
+            limit = min(int(request.query_params.get('limit', 10)), 25)
+        except ValueError:
+            raise ValidationError({'limit': 'Must be an integer'})
+        return Response(complete(request.query_params.get('q', ''), limit))
+
+    @action(detail=False, methods=['get'])
+    def changes(self, request):
+        """
+        Books created, changed or deleted since ``?since=<token>``, for
+        catalog mirrors. Send the returned ``next`` token on the next call;
+        ``more`` says whether to call again straight away.
+        """
+        limit = int_param(
+            request.query_params, 'limit', default=settings.CATALOG_CHANGES_PAGE_SIZE, minimum=1, maximum=1000
+        )
+        try:
+            books, deleted, token, more = catalog_changes(request.query_params.get('since'), limit)
+        except ValueError:
+            raise ValidationError({'since': 'Invalid sync token'})
+        return Response({
+            'results': self.get_serializer(books, many=True).data,
+            'deleted': deleted,
+            'next': token,
+            'more': more,
+        })
+
+    @action(detail=False, methods=['get'])
+    def everywhere(self, request):
+        """
+        Search the catalogs of all branches at once.
+        """
+        limit = min(int_param(request.query_params, 'limit', default=20, minimum=1), 100)
+        return Response(search_all_branches(request.query_params.get('search', '').strip(), limit))
+
+    @action(detail=False, methods=['get'])
+    def trending(self, request):
+        books = trending_books(request.query_params.get('genre', None))
+        page = self.paginate_queryset(books)
         if page is not None:
-            serializer = self.get_serializer(page, many=True)
-            return self.get_paginated_response(serializer.data)
+            return self.get_paginated_response(self._with_trending_scores(page))
         
-        serializer = self.get_serializer(available_books, many=True)
-        return Response(serializer.data)
+        return Response(self._with_trending_scores(books))
+
+    def _with_trending_scores(self, books):
+        books = list(books)
+        epoch = get_epoch()
+        now = timezone.now()
+        data = self.get_serializer(books, many=True).data
+        for book, item in zip(books, data):
+            item['trending_score'] = round(current_score(book.popularity.score, epoch, now), 4)
+        return data
+
+    @action(detail=True, methods=['get'])
+    def related(self, request, pk=None):
+        book = self.get_object()
+        try:
+            limit = min(int(request.query_params.get('limit', 10)), 50)
+        except ValueError:
+            raise ValidationError({'limit': 'Must be an integer'})
+
+        # Imported here so workers only load NumPy once recommendations are asked for.
+        from .recommendations import related_books
+
+        scores = related_books(book.pk, limit)
+        books = Book.objects.filter(branch=current_branch()).in_bulk([book_id for book_id, _ in scores])
+        results = []
+        for book_id, count in scores:
+            if book_id in books:
+                data = self.get_serializer(books[book_id]).data
+                data['borrowed_together'] = count
+                results.append(data)
+        return Response(results)
 
-class BorrowViewSet(viewsets.ModelViewSet):
+class BorrowViewSet(BranchViewMixin, SparseFieldsetViewMixin, viewsets.ModelViewSet):
     serializer_class = BorrowSerializer
     permission_classes = [permissions.IsAuthenticated]
     pagination_class = StandardResultsSetPagination
 
     def get_queryset(self):
+        if getattr(self, 'swagger_fake_view', False):
+            return Borrow.objects.none()
+
+        return self.scoped(Borrow)
+
+    def scoped(self, model):
         user = self.request.user
+        queryset = self.sparse(model.objects.filter(branch=current_branch()), select_related=('user', 'book'))
         if hasattr(user, 'role') and user.role == 'librarian':
-            return Borrow.objects.all().order_by('-borrowed_at')
+            return queryset.order_by('-borrowed_at')
         else:
-            return Borrow.objects.filter(user=user).order_by('-borrowed_at')
+            return queryset.filter(user=user).order_by('-borrowed_at')
+
+    def list(self, request, *args, **kwargs):
+        history = BorrowHistory(self.filter_queryset(self.get_queryset()), self.scoped(ArchivedBorrow))
+        return self.list_response(history)
 
+    @branch_atomic()
     def perform_create(self, serializer):
         book = serializer.validated_data['book']
         
-        if not book.available:
-            raise ValidationError("Book is not available")
+        if not fulfill_ready_hold(self.request.user, book):
+            if not book.check_out():
+                raise ValidationError("Book is not available")
+            # A shelf copy leaves the patron's place in the queue pointless.
+            withdraw_waiting_hold(self.request.user, book)
         
-        borrow = serializer.save(user=self.request.user)
-        
-        book.available = False
-        book.save()
+        borrow = serializer.save(user=self.request.user, branch=current_branch())
+        announce_availability([book.pk])
+        record_borrow(book, borrow.borrowed_at)
+        record_borrow_event(Event.BORROW_CREATED, borrow)
 
-    def perform_update(self, serializer):
-        instance = serializer.save()
-        
-        if instance.returned and not instance.returned_at:
-            instance.returned_at = timezone.now()
-            instance.save()
-            
-            instance.book.available = True
-            instance.book.save()
+    @action(detail=True, methods=['post'], url_path='return')
+    def return_book(self, request, pk=None):
+        borrow = self.get_object()
+        now = timezone.now()
+        fine = fine_for(borrow.book.genre, borrow.due_date, timezone.localdate(now))
+
+        with branch_atomic():
+            # Only the request that flips the flag puts the copy back.
+            if not Borrow.objects.filter(pk=borrow.pk, returned=False).update(
+                returned=True, returned_at=now, fine_cents=fine
+            ):
+                raise ValidationError("This book has already been returned")
+            borrow.returned, borrow.returned_at, borrow.fine_cents = True, now, fine
+            release_copy(borrow.book)
+            record_borrow_event(Event.BORROW_RETURNED, borrow)
+
+        return Response(self.get_serializer(borrow).data)
 
     @action(detail=False, methods=['get'])
     def my_borrows(self, request):
-        borrows = Borrow.objects.filter(user=request.user).order_by('-borrowed_at')
-        page = self.paginate_queryset(borrows)
-        if page is not None:
-            serializer = self.get_serializer(page, many=True)
-            return self.get_paginated_response(serializer.data)
-        
-        serializer = self.get_serializer(borrows, many=True)
-        return Response(serializer.data)
+        borrows = BorrowHistory(self.scoped(Borrow), self.scoped(ArchivedBorrow)).filter(user=request.user)
+        return self.list_response(borrows)
+
+    @action(detail=False, methods=['get'])
+    def fines(self, request):
+        """
+        Fine balance of the caller, or of ``?user=<id>`` for librarians.
+        """
+        user = request.user
+        if 'user' in request.query_params:
+            if not (hasattr(user, 'role') and user.role == 'librarian'):
+                raise PermissionDenied("Only librarians can view other patrons' fines")
+            try:
+                user = User.objects.get(pk=int(request.query_params['user']))
+            except (ValueError, User.DoesNotExist):
+                raise ValidationError({'user': 'Unknown user'})
+        return Response(fine_balance(user))
 
     @action(detail=False, methods=['get'])
     def overdue(self, request):
@@ -106,15 +474,87 @@ class BorrowViewSet(viewsets.ModelViewSet):
             raise PermissionDenied("Only librarians can view overdue books")
         
         today = timezone.now().date()
-        overdue_borrows = Borrow.objects.filter(
+        overdue_borrows = self.sparse(Borrow.objects.filter(branch=current_branch()), select_related=('user', 'book')).filter(
             due_date__lt=today,
             returned=False
         ).order_by('due_date')
-        
-        page = self.paginate_queryset(overdue_borrows)
-        if page is not None:
-            serializer = self.get_serializer(page, many=True)
-            return self.get_paginated_response(serializer.data)
-        
-        serializer = self.get_serializer(overdue_borrows, many=True)
-        return Response(serializer.data)
+        return self.list_response(overdue_borrows)
+
+class HoldViewSet(BranchViewMixin, viewsets.ModelViewSet):
+    serializer_class = HoldSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    pagination_class = StandardResultsSetPagination
+    http_method_names = ['get', 'post', 'delete', 'head', 'options']
+
+    def get_queryset(self):
+        if getattr(self, 'swagger_fake_view', False):
+            return Hold.objects.none()
+
+        user = self.request.user
+        queryset = Hold.objects.select_related('user', 'book').filter(book__branch=current_branch())
+        if not (hasattr(user, 'role') and user.role == 'librarian'):
+            queryset = queryset.filter(user=user)
+
+        book_id = int_param(self.request.query_params, 'book', minimum=1)
+        if book_id is not None:
+            queryset = queryset.filter(book_id=book_id)
+
+        status_filter = self.request.query_params.get('status', None)
+        if status_filter is not None:
+            statuses = [value for value, _ in Hold.STATUS_CHOICES]
+            if status_filter not in statuses:
+                raise ValidationError({'status': f"Must be one of: {', '.join(statuses)}"})
+            queryset = queryset.filter(status=status_filter)
+        else:
+            queryset = queryset.filter(status__in=Hold.ACTIVE_STATUSES)
+        return queryset.order_by('book_id', 'position')
+
+    def perform_create(self, serializer):
+        serializer.instance = place_hold(self.request.user, serializer.validated_data['book'])
+
+    def perform_destroy(self, instance):
+        if instance.status not in Hold.ACTIVE_STATUSES:
+            raise ValidationError("Only waiting or ready holds can be cancelled")
+        cancel_hold(instance)
+
+
+class AnalyticsViewSet(BranchViewMixin, viewsets.ViewSet):
+    permission_classes = [IsLibrarian]
+
+    @action(detail=False, methods=['get'])
+    def borrows(self, request):
+        params = request.query_params
+        granularity = params.get('granularity', 'day')
+        if granularity not in GRANULARITIES:
+            raise ValidationError({'granularity': f"Must be one of: {', '.join(GRANULARITIES)}"})
+
+        try:
+            start = date.fromisoformat(params['start']) if params.get('start') else None
+            end = date.fromisoformat(params['end']) if params.get('end') else None
+        except ValueError:
+            raise ValidationError("start and end must be dates in YYYY-MM-DD format")
+        if start is None:
+            start = timezone.now().date() - timedelta(days=365)
+
+        series = borrow_series(
+            granularity=granularity,
+            genre=params.get('genre', None),
+            book_id=int_param(params, 'book', minimum=1),
+            start=start,
+            end=end,
+        )
+        return Response({'granularity': granularity, 'results': series})
+
+class EventViewSet(BranchViewMixin, viewsets.GenericViewSet):
+    serializer_class = EventSerializer
+    permission_classes = [IsLibrarian]
+
+    def list(self, request):
+        after = int_param(request.query_params, 'after', default=0)
+        limit = min(int_param(request.query_params, 'limit', default=100, minimum=1), 1000)
+
+        events = events_after(after, limit)
+        return Response({
+            'results': self.get_serializer(events, many=True).data,
+            'next': events[-1].pk if events else after,
+        })
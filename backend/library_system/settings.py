@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -46,11 +47,13 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     # 'corsheaders.middleware.CorsMiddleware',
+    'django.middleware.gzip.GZipMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'library.routers.ReplicaRoutingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -85,6 +88,65 @@ DATABASES = {
     }
 }
 
+# Read replicas. Set LIBRARY_REPLICA_DBS to a comma separated list of SQLite
+# files (copies of db.sqlite3) to exercise the router locally.
+DATABASE_REPLICAS = []
+for index, replica_name in enumerate(filter(None, os.environ.get('LIBRARY_REPLICA_DBS', '').split(','))):
+    alias = f'replica{index + 1}'
+    DATABASES[alias] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': replica_name.strip(),
+        'TEST': {'MIRROR': 'default'},
+    }
+    DATABASE_REPLICAS.append(alias)
+
+# Library branches and the database holding each one's catalog and
+# circulation. Branches may share a database; rows carry their branch code.
+# Set LIBRARY_BRANCH_DBS to "code=/path/file.sqlite3,..." to give branches
+# their own SQLite files locally.
+DEFAULT_BRANCH = 'main'
+LIBRARY_BRANCHES = {
+    DEFAULT_BRANCH: {'name': 'Main Library', 'database': 'default'},
+}
+for branch_spec in filter(None, os.environ.get('LIBRARY_BRANCH_DBS', '').split(',')):
+    branch_code, branch_file = (part.strip() for part in branch_spec.split('=', 1))
+    DATABASES[f'branch_{branch_code}'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': branch_file,
+    }
+    LIBRARY_BRANCHES[branch_code] = {'name': branch_code.title(), 'database': f'branch_{branch_code}'}
+
+# Branch routing comes first: it places branch data, and leaves the main
+# database's reads to the replica router.
+DATABASE_ROUTERS = ['library.routers.BranchRouter', 'library.routers.PrimaryReplicaRouter']
+
+# Most branches searched at once by /api/books/everywhere/.
+BRANCH_FANOUT_WORKERS = 8
+
+# Seconds after a user's own write during which their reads stay on the primary.
+REPLICA_LAG_WINDOW = 5
+
+# 'default' caches per-process copies of API payloads. 'shared' holds the
+# small keys every worker must agree on: replica pins and the catalog
+# version. It is a directory on the host; set LIBRARY_REDIS_URL when
+# workers run on more than one host.
+CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    'shared': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / 'var' / 'shared-cache',
+        'OPTIONS': {'MAX_ENTRIES': 100000},
+    },
+}
+if os.environ.get('LIBRARY_REDIS_URL'):
+    CACHES['shared'] = {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.environ['LIBRARY_REDIS_URL'],
+    }
+
+# The test suite keeps shared state and throttle buckets out of var/.
+TEST_RUNNER = 'library.testing.LibraryTestRunner'
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -142,8 +204,23 @@ REST_FRAMEWORK = {
         'rest_framework.filters.SearchFilter',
         'rest_framework.filters.OrderingFilter',
     ],
+    'DEFAULT_THROTTLE_CLASSES': [
+        'library.throttling.TokenBucketThrottle',
+        'library.throttling.SearchThrottle',
+    ],
 }
 
+# Set LIBRARY_FAST_JSON=1 to render API responses with orjson.
+if os.environ.get('LIBRARY_FAST_JSON'):
+    REST_FRAMEWORK['DEFAULT_RENDERER_CLASSES'] = [
+        'library.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ]
+
+# Set LIBRARY_FAST_LISTS=1 to build list pages from values_list() rows
+# instead of serializing model instances.
+FAST_LIST_ROWS = bool(os.environ.get('LIBRARY_FAST_LISTS'))
+
 from datetime import timedelta
 
 SIMPLE_JWT = {
@@ -164,7 +241,122 @@ SWAGGER_SETTINGS = {
             'in': 'header'
         }
     },
+    # Swagger UI loads the prebuilt schema instead of regenerating it.
+    'SPEC_URL': 'schema-json',
+}
+
+# Where build_schema writes the OpenAPI schema, and how long browsers and
+# the Swagger UI page cache may keep it.
+API_SCHEMA_PATH = BASE_DIR / 'var' / 'openapi.json'
+SCHEMA_CACHE_SECONDS = 3600
+
+# Days a patron has to collect a book once their hold becomes ready.
+HOLD_PICKUP_DAYS = 3
+
+# Where build_recommendations stores the "borrowed together" matrix, and how
+# often API workers look for a newer build.
+RECOMMENDATIONS_DIR = BASE_DIR / 'var' / 'recommendations'
+RECOMMENDATIONS_RELOAD_SECONDS = 30
+
+# Half-life of a borrow's contribution to the trending score.
+TRENDING_HALF_LIFE_DAYS = 7
+
+# Borrows and returns younger than this are left for the next rollup run, so
+# rows from transactions still in flight are not skipped.
+ROLLUP_SETTLE_SECONDS = 60
+
+# How long facet counts for a given search are reused. Catalog edits,
+# borrows and returns invalidate them straight away.
+FACET_CACHE_SECONDS = 60
+
+# Autocomplete index: upper bound on entries held per branch in each process,
+# and how often it is rebuilt to pick up catalog edits made by other processes.
+SUGGEST_MAX_ENTRIES = 2_000_000
+SUGGEST_REBUILD_SECONDS = 300
+
+# Fuzzy (?fuzzy=1) book search: minimum trigram similarity for a match, and
+# how many index candidates are scored per query.
+FUZZY_SEARCH_THRESHOLD = 0.3
+FUZZY_SEARCH_CANDIDATES = 500
+
+# Admin changelists count rows exactly up to this many and estimate beyond.
+ADMIN_EXACT_COUNT_LIMIT = 10000
+
+# The event feed holds back events younger than this so transactions that
+# took an earlier id but committed later are not skipped by readers.
+EVENTS_SETTLE_SECONDS = 2
+
+# Background jobs (manage.py run_worker): handler per job kind, how long a
+# claimed job may run before another worker takes it over, and the first
+# retry delay (doubled on each further attempt).
+JOB_HANDLERS = {
+    'reminders.send': 'library.reminders.send_reminders',
+}
+JOB_LOCK_TIMEOUT_SECONDS = 600
+JOB_RETRY_BASE_SECONDS = 30
+
+# Due-date reminders: local hour they go out, and borrows handled per job.
+REMINDER_SEND_HOUR = 8
+REMINDER_BATCH_SIZE = 500
+
+# Outgoing mail is written to files until an SMTP backend is configured.
+EMAIL_BACKEND = 'django.core.mail.backends.filebased.EmailBackend'
+EMAIL_FILE_PATH = BASE_DIR / 'var' / 'outbox'
+DEFAULT_FROM_EMAIL = 'library@localhost'
+
+# /api/books/batch/: most ids per request, and how long each book is cached
+# (availability is always read fresh).
+BOOK_BATCH_MAX_IDS = 200
+BOOK_BATCH_CACHE_SECONDS = 30
+
+# Request throttling: (sustained rate, burst) per endpoint group and role.
+# Groups are a view's throttle_scope ('api' unless set) plus 'search' for
+# ?search= and autocomplete. Buckets are shared by all workers on a host
+# through THROTTLE_DB_PATH.
+THROTTLE_BUCKETS = {
+    'api': {'librarian': ('1200/min', 300), 'user': ('300/min', 100), 'anon': ('60/min', 20)},
+    'search': {'librarian': ('300/min', 60), 'user': ('120/min', 30), 'anon': ('30/min', 10)},
+    'login': {'librarian': ('20/min', 10), 'user': ('20/min', 10), 'anon': ('10/min', 5)},
+}
+THROTTLE_DB_PATH = BASE_DIR / 'var' / 'throttle.sqlite3'
+# How often each worker deletes buckets that have refilled completely.
+THROTTLE_PURGE_SECONDS = 300
+
+# archive_borrows: returned borrows older than this many days move to the
+# archive table, this many rows per transaction.
+BORROW_ARCHIVE_AFTER_DAYS = 365
+BORROW_ARCHIVE_BATCH_SIZE = 1000
+
+# Overdue fines in cents: (per day, cap) by book genre, with 'default' for
+# genres not listed, and days after the due date before a loan is fined.
+FINE_RATES = {
+    'default': (25, 1000),
+    'Reference': (100, 5000),
 }
+FINE_GRACE_DAYS = 0
+
+# /api/books/changes/: rows per page by default, and how old a change must
+# be before it is handed out (updated_at is stamped before commit).
+CATALOG_CHANGES_PAGE_SIZE = 500
+CATALOG_CHANGES_SETTLE_SECONDS = 2
+
+# /api/books/stream/: messages kept for clients resuming with Last-Event-ID,
+# seconds between keepalive comments, and most open streams per process and
+# per client address. The stream is public, so the per-address cap is what
+# stops one client from taking them all.
+STREAM_BUFFER_SIZE = 1000
+STREAM_KEEPALIVE_SECONDS = 15
+STREAM_MAX_CONNECTIONS = 10000
+STREAM_MAX_CONNECTIONS_PER_CLIENT = 10
+
+# snapshot_db: where snapshots go, how many pages the online backup copies
+# per step before pausing so writers can take the lock, and how many
+# restarts by concurrent writes it takes before finishing in one step that
+# blocks writers until the copy is done.
+SNAPSHOT_DIR = BASE_DIR / 'var' / 'backups'
+SNAPSHOT_STEP_PAGES = 1024
+SNAPSHOT_STEP_PAUSE = 0.005
+SNAPSHOT_MAX_RESTARTS = 10
 
 CORS_ALLOWED_ORIGINS = [
     "http://localhost:8501",  
@@ -0,0 +1,41 @@
+"""
+Lean settings for API workers.
+
+Use with DJANGO_SETTINGS_MODULE=library_system.settings_production. Only
+what the JSON API needs is loaded: no admin, sessions, messages, static
+files, browsable API or Swagger UI (the prebuilt /swagger.json is still
+served). Keep using library_system.settings for management commands, the
+admin site and local development.
+"""
+from .settings import *  # noqa: F401,F403
+
+DEBUG = False
+ALLOWED_HOSTS = [host.strip() for host in os.environ.get('LIBRARY_ALLOWED_HOSTS', 'localhost').split(',')]
+
+LEAN_EXCLUDED_APPS = {
+    'django.contrib.admin',
+    'django.contrib.sessions',
+    'django.contrib.messages',
+    'django.contrib.staticfiles',
+    'drf_yasg',
+}
+INSTALLED_APPS = [app for app in INSTALLED_APPS if app not in LEAN_EXCLUDED_APPS]
+
+# JWT authentication happens inside DRF, which also sets request.user for
+# ReplicaRoutingMiddleware, so the session-based middleware is not needed.
+LEAN_EXCLUDED_MIDDLEWARE = {
+    'django.contrib.sessions.middleware.SessionMiddleware',
+    'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'django.contrib.messages.middleware.MessageMiddleware',
+}
+MIDDLEWARE = [middleware for middleware in MIDDLEWARE if middleware not in LEAN_EXCLUDED_MIDDLEWARE]
+
+TEMPLATES[0]['OPTIONS']['context_processors'] = ['django.template.context_processors.request']
+
+REST_FRAMEWORK = {
+    **REST_FRAMEWORK,
+    'DEFAULT_RENDERER_CLASSES': [
+        'library.renderers.FastJSONRenderer' if os.environ.get('LIBRARY_FAST_JSON')
+        else 'rest_framework.renderers.JSONRenderer',
+    ],
+}
@@ -14,24 +14,25 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
-from django.contrib import admin
+from django.conf import settings
 from django.urls import path, include
-from drf_yasg.views import get_schema_view
-from drf_yasg import openapi
-from rest_framework_simplejwt.views import TokenObtainPairView
-from rest_framework import permissions
+from library.schema import schema_json, swagger_ui_view
+from library.views import LoginView
 
 
-schema_view = get_schema_view(
-    openapi.Info(title="Library API", default_version='v1'),
-    public=True,
-    permission_classes=(permissions.AllowAny,),
-)
-
 urlpatterns = [
-    path('admin/', admin.site.urls),
     path('api/', include('library.urls')),
-    path('swagger/', schema_view.with_ui('swagger', cache_timeout=0), name='schema-swagger-ui'),
-    path("api/token/", TokenObtainPairView.as_view(), name="token_obtain_pair"),
+    path('swagger.json', schema_json, name='schema-json'),
+    path("api/token/", LoginView.as_view(), name="token_obtain_pair"),
 
 ]
+
+# The lean production settings leave these apps out.
+if 'django.contrib.admin' in settings.INSTALLED_APPS:
+    from django.contrib import admin
+
+    urlpatterns.append(path('admin/', admin.site.urls))
+if 'drf_yasg' in settings.INSTALLED_APPS:
+    urlpatterns.append(
+        path('swagger/', swagger_ui_view(settings.SCHEMA_CACHE_SECONDS), name='schema-swagger-ui')
+    )
@@ -0,0 +1,25 @@
+from django.urls import get_resolver, reverse
+
+
+def warm_up():
+    """
+    Do the work Django otherwise leaves for the first request: import the
+    URLconf and every view it names, build the reverse-lookup tables and
+    load DRF's configured classes. wsgi.py and asgi.py call this, so a
+    pre-forking server (gunicorn --preload) pays for it once, before
+    forking. No database connection is opened here; sockets must not be
+    shared with forked workers.
+    """
+    from rest_framework.settings import api_settings
+
+    get_resolver().url_patterns
+    reverse('book-list')
+    for name in (
+        'DEFAULT_AUTHENTICATION_CLASSES',
+        'DEFAULT_PERMISSION_CLASSES',
+        'DEFAULT_RENDERER_CLASSES',
+        'DEFAULT_PARSER_CLASSES',
+        'DEFAULT_PAGINATION_CLASS',
+        'DEFAULT_FILTER_BACKENDS',
+    ):
+        getattr(api_settings, name)
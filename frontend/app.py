@@ -3,8 +3,18 @@ import requests
 import jwt
 from datetime import datetime, timedelta, date
 import pandas as pd
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 API_URL = "http://localhost:8000/api"
+BOOK_PAGE_CACHE_SIZE = 20
+# How often the book table re-applies availability pushed by the API
+LIVE_REFRESH_SECONDS = 2
+
+# Book pages are fetched off the script thread so the next one is ready early
+_prefetcher = ThreadPoolExecutor(max_workers=2)
 
 st.set_page_config(
     page_title="Library Management System",
@@ -18,6 +28,10 @@ if 'role' not in st.session_state:
 if 'username' not in st.session_state:
     st.session_state.username = None
 
+def format_cents(cents):
+    """Format a fine amount in cents"""
+    return f"${cents / 100:,.2f}"
+
 def get_headers():
     """Get authorization headers"""
     if st.session_state.token:
@@ -117,91 +131,199 @@ def login_register_page():
                 except requests.exceptions.RequestException:
                     st.error("Could not connect to server. Please try again.")
 
+def fetch_books_page(headers, params):
+    """Fetch one page of books (runs on the prefetch thread, so no st.* calls)"""
+    return requests.get(f"{API_URL}/books/", headers=headers, params=params, timeout=10)
+
+def request_books_page(params):
+    """Start fetching a page of books, or reuse the request already made for it"""
+    pages = st.session_state.setdefault("book_pages", {})
+    key = tuple(sorted(params.items()))
+    if key not in pages:
+        pages[key] = _prefetcher.submit(fetch_books_page, get_headers(), dict(params))
+        while len(pages) > BOOK_PAGE_CACHE_SIZE:
+            pages.pop(next(iter(pages)))
+    return key, pages[key]
+
+def clear_book_pages():
+    """Forget cached book pages after the catalog or a loan changed"""
+    st.session_state.book_pages = {}
+
+@st.cache_resource
+def availability_feed():
+    """Start the process-wide reader of the availability stream; returns {(branch, book id): book}"""
+    live = {}
+    threading.Thread(target=follow_availability, args=(live,), daemon=True).start()
+    return live
+
+def follow_availability(live):
+    """Keep /books/stream/ open and record each pushed change (background thread, so no st.* calls)"""
+    last_event_id = None
+    while True:
+        headers = {"Last-Event-ID": last_event_id} if last_event_id else {}
+        try:
+            with requests.get(f"{API_URL}/books/stream/", headers=headers, stream=True, timeout=(5, 60)) as response:
+                if response.status_code == 501:
+                    # API served without ASGI: tables refresh on rerun only
+                    return
+                event = None
+                for line in response.iter_lines(decode_unicode=True):
+                    if line.startswith("id: "):
+                        last_event_id = line[4:]
+                    elif line.startswith("event: "):
+                        event = line[7:]
+                    elif line.startswith("data: ") and event == "reset":
+                        live.clear()
+                    elif line.startswith("data: ") and event == "availability":
+                        book = json.loads(line[6:])
+                        live[(book["branch"], book["id"])] = book
+                    elif not line:
+                        event = None
+        except requests.exceptions.RequestException:
+            pass
+        time.sleep(3)
+
+def with_live_availability(books):
+    """Patch availability pushed since the page was fetched into its rows"""
+    live = availability_feed()
+    patched = []
+    for book in books:
+        update = live.get((book.get("branch"), book["id"]))
+        if update:
+            book = {**book, **{field: update[field] for field in ("available", "available_copies", "total_copies")}}
+        patched.append(book)
+    return patched
+
 def display_books():
-    """Display books with search and pagination"""
+    """Display books as a selectable table, prefetching the next page"""
     st.subheader(" Books")
     
     # Search and filters
-    col1, col2, col3 = st.columns([3, 1, 1])
+    col1, col2, col3, col4 = st.columns([3, 1, 1, 1])
     with col1:
         search_query = st.text_input("🔍 Search books by title, author, or genre", key="book_search")
     with col2:
         show_only_available = st.checkbox("Available only", key="available_filter")
+        fuzzy_search = st.checkbox("Typo-tolerant", key="fuzzy_filter")
     with col3:
+        page_size = st.selectbox("Per page", [10, 25, 50, 100], key="book_page_size")
+    with col4:
         page = st.number_input("Page", min_value=1, value=1, step=1, key="book_page")
     
-    # Build API URL
-    url = f"{API_URL}/books/"
-    params = {"page": page}
+    params = {
+        "page_size": page_size,
+        "facets": "genre,available",
+        "fields": "id,title,author,genre,branch,available,available_copies,total_copies",
+    }
     if search_query:
         params["search"] = search_query
     if show_only_available:
         params["available"] = "true"
+    if fuzzy_search:
+        params["fuzzy"] = "1"
     
+    key, request = request_books_page({**params, "page": page})
     try:
-        response = requests.get(url, headers=get_headers(), params=params)
-        
-        if response.status_code == 200:
-            data = response.json()
-            books = data.get('results', [])
-            total_count = data.get('count', 0)
-            
-            if books:
-                st.info(f"Found {total_count} books")
-                
-                for book in books:
-                    with st.container():
-                        col1, col2, col3 = st.columns([3, 1, 2])
-                        
-                        with col1:
-                            availability = "Available" if book['available'] else "Not Available"
-                            st.markdown(f"""
-                            **{book['title']}**  
-                            *by {book['author']}*  
-                            Genre: {book['genre']}  
-                            Status: {availability}
-                            """)
-                        
-                        with col2:
-                            if st.session_state.role == "user" and book['available']:
-                                if st.button("  Borrow", key=f"borrow_{book['id']}"):
-                                    borrow_book(book['id'])
-                        
-                        with col3:
-                            if st.session_state.role == "librarian":
-                                col3a, col3b = st.columns(2)
-                                with col3a:
-                                    if st.button("Edit", key=f"edit_{book['id']}"):
-                                        st.session_state[f"editing_{book['id']}"] = True
-                                with col3b:
-                                    if st.button("Delete", key=f"delete_{book['id']}"):
-                                        delete_book(book['id'])
-                        
-                        # Edit form
-                        if st.session_state.get(f"editing_{book['id']}", False):
-                            with st.form(f"edit_form_{book['id']}"):
-                                new_title = st.text_input("Title", value=book['title'])
-                                new_author = st.text_input("Author", value=book['author'])
-                                new_genre = st.text_input("Genre", value=book['genre'])
-                                
-                                col_save, col_cancel = st.columns(2)
-                                with col_save:
-                                    if st.form_submit_button("Save"):
-                                        update_book(book['id'], new_title, new_author, new_genre)
-                                        st.session_state[f"editing_{book['id']}"] = False
-                                        st.rerun()
-                                with col_cancel:
-                                    if st.form_submit_button("Cancel"):
-                                        st.session_state[f"editing_{book['id']}"] = False
-                                        st.rerun()
-                        
-                        st.divider()
-            else:
-                st.info("No books found")
-        else:
-            handle_api_error(response)
+        response = request.result()
     except requests.exceptions.RequestException:
+        st.session_state.book_pages.pop(key, None)
         st.error("Could not fetch books. Please check your connection.")
+        return
+    
+    if response.status_code != 200:
+        st.session_state.book_pages.pop(key, None)
+        handle_api_error(response)
+        return
+    
+    data = response.json()
+    books = data.get('results', [])
+    total_count = data.get('count', 0)
+    facets = data.get('facets', {})
+    
+    # Warm the next page while this one is on screen
+    if data.get('next'):
+        request_books_page({**params, "page": page + 1})
+    
+    if not books:
+        st.info("No books found")
+        return
+    
+    st.info(f"Found {total_count} books")
+    if facets:
+        genre_counts = " · ".join(
+            f"{facet['value']} ({facet['count']:,})" for facet in facets.get('genre', [])
+        )
+        available_count = facets.get('available', {}).get('true', 0)
+        st.caption(f"{genre_counts}  |  Available now: {available_count:,}")
+    
+    books_table(books, key)
+
+@st.fragment(run_every=LIVE_REFRESH_SECONDS)
+def books_table(books, key):
+    """The book table and actions; reruns on its own to show pushed availability in place"""
+    books = with_live_availability(books)
+    df = pd.DataFrame.from_records(books)
+    df['status'] = df['available'].map({True: "Available", False: "Not Available"})
+    df['copies'] = df['available_copies'].astype(str) + " of " + df['total_copies'].astype(str)
+    table = st.dataframe(
+        df,
+        column_order=["title", "author", "genre", "status", "copies"],
+        column_config={
+            "title": "Title",
+            "author": "Author",
+            "genre": "Genre",
+            "status": "Status",
+            "copies": "Copies",
+        },
+        hide_index=True,
+        use_container_width=True,
+        on_select="rerun",
+        selection_mode="single-row",
+        key=f"books_table_{abs(hash(key))}",
+    )
+    
+    selected_rows = table.selection.rows
+    if not selected_rows:
+        st.caption("Select a row to borrow, hold, edit or delete a book.")
+        return
+    
+    book = books[selected_rows[0]]
+    st.markdown(f"**{book['title']}** *by {book['author']}*")
+    col1, col2, col3 = st.columns([1, 1, 4])
+    
+    if st.session_state.role == "user":
+        with col1:
+            if book['available']:
+                if st.button("  Borrow", key=f"borrow_{book['id']}"):
+                    borrow_book(book['id'])
+            elif st.button("Place Hold", key=f"hold_{book['id']}"):
+                place_hold(book['id'])
+    
+    if st.session_state.role == "librarian":
+        with col1:
+            if st.button("Edit", key=f"edit_{book['id']}"):
+                st.session_state[f"editing_{book['id']}"] = True
+        with col2:
+            if st.button("Delete", key=f"delete_{book['id']}"):
+                delete_book(book['id'])
+        
+        # Edit form
+        if st.session_state.get(f"editing_{book['id']}", False):
+            with st.form(f"edit_form_{book['id']}"):
+                new_title = st.text_input("Title", value=book['title'])
+                new_author = st.text_input("Author", value=book['author'])
+                new_genre = st.text_input("Genre", value=book['genre'])
+                
+                col_save, col_cancel = st.columns(2)
+                with col_save:
+                    if st.form_submit_button("Save"):
+                        update_book(book['id'], new_title, new_author, new_genre)
+                        st.session_state[f"editing_{book['id']}"] = False
+                        st.rerun()
+                with col_cancel:
+                    if st.form_submit_button("Cancel"):
+                        st.session_state[f"editing_{book['id']}"] = False
+                        st.rerun()
 
 def borrow_book(book_id):
     """Borrow a book"""
@@ -218,6 +340,7 @@ def borrow_book(book_id):
         )
         
         if response.status_code == 201:
+            clear_book_pages()
             st.success("Book borrowed successfully! Due date: " + due_date.strftime("%Y-%m-%d"))
             st.rerun()
         else:
@@ -225,6 +348,77 @@ def borrow_book(book_id):
     except requests.exceptions.RequestException:
         st.error("Could not borrow book. Please try again.")
 
+def place_hold(book_id):
+    """Join the hold queue for a book"""
+    try:
+        response = requests.post(
+            f"{API_URL}/holds/",
+            headers=get_headers(),
+            json={"book": book_id}
+        )
+        
+        if response.status_code == 201:
+            st.success(f"Hold placed! You are number {response.json()['position']} in the queue.")
+        else:
+            handle_api_error(response)
+    except requests.exceptions.RequestException:
+        st.error("Could not place hold. Please try again.")
+
+def display_holds():
+    """Display user's active holds"""
+    st.subheader("  My Holds")
+    
+    try:
+        response = requests.get(f"{API_URL}/holds/", headers=get_headers())
+        
+        if response.status_code == 200:
+            data = response.json()
+            holds = data.get('results', []) if 'results' in data else data
+            
+            if holds:
+                for hold in holds:
+                    with st.container():
+                        col1, col2 = st.columns([3, 1])
+                        
+                        with col1:
+                            if hold['status'] == 'ready':
+                                expires = hold.get('expires_at', '').split('T')[0]
+                                status_text = f"Ready for pickup until {expires}"
+                            else:
+                                status_text = f"Waiting (queue position {hold['position']})"
+                            st.markdown(f"""
+                            **{hold.get('book_title', 'Unknown Title')}**  
+                            {status_text}
+                            """)
+                        
+                        with col2:
+                            if hold['status'] == 'ready':
+                                if st.button("Borrow", key=f"hold_borrow_{hold['id']}"):
+                                    borrow_book(hold['book'])
+                            if st.button("Cancel", key=f"cancel_hold_{hold['id']}"):
+                                cancel_hold(hold['id'])
+                        
+                        st.divider()
+            else:
+                st.info("You have no active holds.")
+        else:
+            handle_api_error(response)
+    except requests.exceptions.RequestException:
+        st.error("Could not fetch holds. Please check your connection.")
+
+def cancel_hold(hold_id):
+    """Cancel a hold"""
+    try:
+        response = requests.delete(f"{API_URL}/holds/{hold_id}/", headers=get_headers())
+        
+        if response.status_code == 204:
+            st.success("Hold cancelled.")
+            st.rerun()
+        else:
+            handle_api_error(response)
+    except requests.exceptions.RequestException:
+        st.error("Could not cancel hold. Please try again.")
+
 def update_book(book_id, title, author, genre):
     """Update a book"""
     try:
@@ -239,6 +433,7 @@ def update_book(book_id, title, author, genre):
         )
         
         if response.status_code == 200:
+            clear_book_pages()
             st.success("Book updated successfully!")
         else:
             handle_api_error(response)
@@ -254,6 +449,7 @@ def delete_book(book_id):
         )
         
         if response.status_code == 204:
+            clear_book_pages()
             st.success("Book deleted successfully!")
             st.rerun()
         else:
@@ -271,6 +467,7 @@ def add_book_form():
         title = st.text_input("Title")
         author = st.text_input("Author")
         genre = st.text_input("Genre")
+        total_copies = st.number_input("Copies", min_value=1, value=1, step=1)
         submit = st.form_submit_button("Add Book")
         
         if submit and title and author and genre:
@@ -282,11 +479,12 @@ def add_book_form():
                         "title": title,
                         "author": author,
                         "genre": genre,
-                        "available": True
+                        "total_copies": int(total_copies)
                     }
                 )
                 
                 if response.status_code == 201:
+                    clear_book_pages()
                     st.success("Book added successfully!")
                     st.rerun()
                 else:
@@ -299,6 +497,13 @@ def display_borrowed_books():
     st.subheader("  My Borrowed Books")
     
     try:
+        fines_response = requests.get(f"{API_URL}/borrows/fines/", headers=get_headers())
+        if fines_response.status_code == 200:
+            fines = fines_response.json()
+            if fines['total_cents']:
+                st.warning(f"Fines: {format_cents(fines['total_cents'])} "
+                           f"({format_cents(fines['accruing_cents'])} still accruing on overdue books)")
+        
         response = requests.get(f"{API_URL}/borrows/my_borrows/", headers=get_headers())
         
         if response.status_code == 200:
@@ -327,6 +532,8 @@ def display_borrowed_books():
                                         pass
                                 
                                 status_text = "OVERDUE" if is_overdue else "Active"
+                                if borrow.get('fine_cents'):
+                                    status_text += f", fine {format_cents(borrow['fine_cents'])}"
                                 
                                 st.markdown(f"""
                                 **{book_title}**  
@@ -350,13 +557,13 @@ def display_borrowed_books():
 def return_book(borrow_id):
     """Return a borrowed book"""
     try:
-        response = requests.patch(
-            f"{API_URL}/borrows/{borrow_id}/",
-            headers=get_headers(),
-            json={"returned": True}
+        response = requests.post(
+            f"{API_URL}/borrows/{borrow_id}/return/",
+            headers=get_headers()
         )
         
         if response.status_code == 200:
+            clear_book_pages()
             st.success("Book returned successfully!")
             st.rerun()
         else:
@@ -443,7 +650,9 @@ def librarian_dashboard():
                             except:
                                 pass
                         
-                        st.error(f" **{book_title}** - Borrowed by: {user_username} - Due: {due_date} ({days_overdue} days overdue)")
+                        fine = format_cents(borrow.get('fine_cents', 0))
+                        st.error(f" **{book_title}** - Borrowed by: {user_username} - Due: {due_date} "
+                                 f"({days_overdue} days overdue, fine {fine})")
             except requests.exceptions.RequestException:
                 st.error("Could not fetch overdue books.")
     
@@ -465,6 +674,7 @@ def main():
             st.session_state.token = None
             st.session_state.role = None
             st.session_state.username = None
+            clear_book_pages()
             st.rerun()
         
         st.divider()
@@ -479,7 +689,7 @@ def main():
         else:
             page = st.selectbox(
                 "  Navigation", 
-                ["Books", "My Borrowed Books"],
+                ["Books", "My Borrowed Books", "My Holds"],
                 key="user_nav"
             )
     
@@ -500,6 +710,8 @@ def main():
             display_books()
         elif page == "My Borrowed Books":
             display_borrowed_books()
+        elif page == "My Holds":
+            display_holds()
 
 def display_all_borrows():
     """Display all borrows for librarian"""